@@ -0,0 +1,87 @@
+"""Bytes transferred by internal api reads: full depth documents vs
+tree= projections.
+
+usage: python benchmarks/bench_projection.py <job name> [--build N]
+           [--server http://jenkins:8080 --username u --password p]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from urllib import quote
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scr'))
+
+import jenkins  # noqa: E402
+from engines.jenkins_eng import projection  # noqa: E402
+from engines.jenkins_eng.jenkins_server import (  # noqa: E402
+    JenkinsServer, JOB_TREE, BUILD_TREE)
+
+
+def _tree(fields):
+    return quote(fields.tree, safe=',')
+
+
+def _measure(server, url):
+    started = time.time()
+    body = server.jenkins_open(jenkins.Request(url))
+    return dict(bytes=len(body), seconds=round(time.time() - started, 4))
+
+
+def _job_url(server, name, template, **params):
+    folder_url, short_name = server._get_job_folder(name)
+    params.update(folder_url=folder_url, short_name=short_name)
+    return server._build_url(template, params)
+
+
+def run(server, job_name, build_number=None):
+    if build_number is None:
+        build_number = server.get_last_build_number(
+            job_name, JenkinsServer.BuildSelector.last_build)
+
+    def job(template, **params):
+        return _job_url(server, job_name, template, **params)
+
+    def build(template, **params):
+        return _job_url(server, job_name, template,
+                        number=build_number, **params)
+
+    # (caller, before, projection used now)
+    cases = [
+        ('get_last_build_number', job(jenkins.JOB_INFO, depth=1),
+         job(JOB_TREE, tree=_tree(projection.JOB_LAST_BUILDS))),
+        ('trigger_job', job(jenkins.JOB_INFO, depth=0),
+         job(JOB_TREE, tree=_tree(projection.JOB_PARAMS))),
+        ('wait_done poll', build(jenkins.BUILD_INFO, depth=0),
+         build(BUILD_TREE, tree=_tree(projection.BUILD_STATUS))),
+        ('invoke_job short_info', build(jenkins.BUILD_INFO, depth=0),
+         build(BUILD_TREE, tree=_tree(projection.BUILD_SHORT))),
+        ('fetch', build(jenkins.BUILD_INFO, depth=1),
+         build(BUILD_TREE, tree=_tree(projection.BUILD_ARTIFACTS))),
+    ]
+    report = []
+    for caller, before_url, after_url in cases:
+        before = _measure(server, before_url)
+        after = _measure(server, after_url)
+        report.append(dict(
+            caller=caller, before=before, after=after,
+            ratio=round(float(before['bytes']) / max(after['bytes'], 1), 1)))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('job')
+    parser.add_argument('--build', type=int, default=None)
+    parser.add_argument('--server', default='http://jenkins:8080')
+    parser.add_argument('--username', default=None)
+    parser.add_argument('--password', default=None)
+    args = parser.parse_args()
+    server = JenkinsServer(args.server, username=args.username,
+                           password=args.password)
+    print(json.dumps(run(server, args.job, args.build), indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Per command latency of the Runner execution modes.
+
+usage: python benchmarks/bench_runner.py [--count 200] [--cmd 'true']
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scr',
+                                'engines', 'jenkins_eng'))
+
+from infra.runner import Runner  # noqa: E402
+
+
+def _measure(count, run_one):
+    started = time.time()
+    for _ in range(count):
+        run_one()
+    total = time.time() - started
+    return dict(count=count, total_seconds=round(total, 3),
+                per_command_ms=round(total * 1000.0 / count, 3))
+
+
+def run(count, cmd):
+    runner = Runner()
+    modes = [
+        # what ShellCommand did before: temp file + sh + env + bash
+        ('tmp_script', lambda: runner.run(cmd, _tmp_script=True,
+                                          _fast=False)),
+        ('shell', lambda: runner.run(cmd, _fast=False)),
+        ('argv', lambda: runner.run(cmd, _fast=True)),
+    ]
+    report = {}
+    for name, run_one in modes:
+        report[name] = _measure(count, run_one)
+    with runner.bash_session() as bash:
+        report['bash_session'] = _measure(count, lambda: bash.run(cmd))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--cmd', default='true')
+    args = parser.parse_args()
+    print(json.dumps(run(args.count, args.cmd), indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Startup time of the jin cli, fails on regressions.
+
+Each case runs in a fresh interpreter, best of --count runs:
+  import - `import jin` and RootMenu() construction
+  help   - `jin.py --help` (needs fire)
+Interpreters with `-X importtime` (python 3.7+) also report the slowest
+imports. Exits 1 when a case is slower than --max-ms, or when `import jin`
+loads one of HEAVY_MODULES.
+
+usage: python benchmarks/bench_startup.py [--count 10] [--max-ms 150]
+           [--python python2]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+SCR_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
+                                       'scr'))
+
+# must stay out of `import jin`, they belong to the subcommands
+HEAVY_MODULES = ('jenkins', 'requests', 'bunch', 'fire', 'multiprocessing',
+                 'webbrowser', 'sqlite3', 'engines.jenkins_eng')
+
+IMPORT_CASE = ("import sys, json, jin; jin.RootMenu(); "
+               "sys.stdout.write(json.dumps(sorted(sys.modules)))")
+
+IMPORTTIME_RE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def _python_has_importtime(python):
+    code = 'import sys; sys.exit(sys.version_info < (3, 7))'
+    return subprocess.call([python, '-c', code]) == 0
+
+
+def _run(argv, env=None):
+    started = time.time()
+    proc = subprocess.Popen(argv, cwd=SCR_DIR, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    out, err = proc.communicate()
+    return proc.returncode, time.time() - started, out, err
+
+
+def _measure(argv, count):
+    best = None
+    rc, out, err = 0, '', ''
+    for _ in range(count):
+        rc, seconds, out, err = _run(argv)
+        if rc != 0:
+            break
+        best = seconds if best is None else min(best, seconds)
+    result = dict(ok=rc == 0)
+    if best is not None:
+        result['best_ms'] = round(best * 1000.0, 1)
+    if rc != 0:
+        result['error'] = err.strip().splitlines()[-1:] or ['rc {}'.format(rc)]
+    return result, out, err
+
+
+def _slowest_imports(python, code, top=10):
+    """top-level imports by cumulative microseconds, from -X importtime"""
+    _, _, _, err = _run([python, '-X', 'importtime', '-c', code])
+    totals = []
+    for line in err.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        # top level imports are indented by a single space
+        if match and len(match.group(3)) == 1:
+            totals.append((int(match.group(2)), match.group(4)))
+    totals.sort(reverse=True)
+    return [dict(module=name, cumulative_ms=round(us / 1000.0, 1))
+            for us, name in totals[:top]]
+
+
+def run(python, count, max_ms):
+    report = dict(python=python, max_ms=max_ms, failures=[])
+
+    result, out, _ = _measure([python, '-c', IMPORT_CASE], count)
+    if result['ok']:
+        modules = json.loads(out)
+        result['heavy_modules'] = sorted(
+            name for name in modules
+            if any(name == heavy or name.startswith(heavy + '.')
+                   for heavy in HEAVY_MODULES))
+        if result['heavy_modules']:
+            report['failures'].append('import jin loads {}'.format(
+                ', '.join(result['heavy_modules'])))
+    report['import'] = result
+
+    result, _, _ = _measure([python, 'jin.py', '--help'], count)
+    report['help'] = result
+
+    for case in ('import', 'help'):
+        best_ms = report[case].get('best_ms')
+        if best_ms is not None and best_ms > max_ms:
+            report['failures'].append('{} took {}ms > {}ms'.format(
+                case, best_ms, max_ms))
+    if not report['import']['ok']:
+        report['failures'].append('import jin failed')
+    if not report['help']['ok']:
+        report['failures'].append('jin --help failed')
+
+    if _python_has_importtime(python):
+        report['slowest_imports'] = _slowest_imports(
+            python, 'import jin; jin.RootMenu()')
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=150.0)
+    parser.add_argument('--python', default=sys.executable)
+    args = parser.parse_args()
+    report = run(args.python, args.count, args.max_ms)
+    print(json.dumps(report, indent=4, sort_keys=True))
+    sys.exit(1 if report['failures'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""Client benchmarks against an in-process fake jenkins (fake_jenkins.py).
+
+Cases: invoke_job, wait_done, fetch (per file, as a zip, from the cache),
+save_artifacts, list_jobs and run_server_script. Each reports latency
+percentiles, throughput, and requests and bytes per operation, counted
+by the fake server. The report is json. With --baseline it is compared
+to an earlier report and the run exits 1 on regressions.
+
+usage: python benchmarks/bench_suite.py [--count 20] [--concurrency 8]
+           [--latency 0.005] [--cases fetch,list_jobs] [--out report.json]
+           [--baseline old.json --max-regression 0.25]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scr'))
+
+from fake_jenkins import FakeJenkins, DEFAULTS  # noqa: E402
+from engines.jenkins_eng.jenkins_server import JenkinsServer  # noqa: E402
+from engines.jenkins_eng.build_waiter import BuildWaiter  # noqa: E402
+from engines.jenkins_eng.queue_monitor import QueueMonitor  # noqa: E402
+from engines.jenkins_eng.jenkins_scripts_api import (  # noqa: E402
+    run_server_script)
+
+CASES = ('invoke_job', 'wait_done', 'fetch', 'fetch_archive', 'fetch_cached',
+         'save_artifacts', 'list_jobs', 'run_server_script')
+
+# compared with --baseline: higher is worse
+COMPARED = ('latency_ms.p50', 'latency_ms.p90', 'requests_per_op',
+            'bytes_per_op')
+
+
+class NullOut(object):
+    """progress_out which drops the console"""
+
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def _percentile(ordered, share):
+    return ordered[min(len(ordered) - 1,
+                       int(round(share * (len(ordered) - 1))))]
+
+
+def measure(fake, count, op, setup=None, concurrency=1):
+    """Times op(arg) for count args made by setup(i) (default i).
+    setup runs before the timing and isn't counted in the requests.
+    """
+    args = [setup(i) if setup else i for i in range(count)]
+    fake.reset_stats()
+
+    def timed(arg):
+        started = time.time()
+        op(arg)
+        return time.time() - started
+
+    started = time.time()
+    if concurrency > 1:
+        pool = ThreadPool(min(concurrency, count))
+        try:
+            latencies = pool.map(timed, args)
+        finally:
+            pool.close()
+    else:
+        latencies = map(timed, args)
+    wall = time.time() - started
+    stats = fake.stats()
+    total = stats.pop('total')
+    latencies.sort()
+    return dict(
+        count=count, concurrency=concurrency,
+        wall_seconds=round(wall, 3),
+        throughput=round(count / wall, 2) if wall else None,
+        latency_ms=dict(
+            (name, round(value * 1000.0, 2)) for name, value in (
+                ('p50', _percentile(latencies, 0.5)),
+                ('p90', _percentile(latencies, 0.9)),
+                ('p99', _percentile(latencies, 0.99)),
+                ('max', latencies[-1]),
+                ('mean', sum(latencies) / len(latencies)))),
+        requests=total['requests'], bytes=total['bytes'],
+        requests_per_op=round(total['requests'] / float(count), 2),
+        bytes_per_op=int(total['bytes'] / count),
+        endpoints=stats)
+
+
+class Cases(object):
+    """One method per name of CASES, returning the measure() result"""
+
+    def __init__(self, fake, server, args, tmp_dir):
+        self.fake = fake
+        self.server = server
+        self.args = args
+        self.tmp_dir = tmp_dir
+        self.job_names = sorted(fake.jobs)
+
+    def _job(self, i):
+        return self.job_names[i % len(self.job_names)]
+
+    def _dir(self, case, i):
+        return os.path.join(self.tmp_dir, case, str(i))
+
+    def invoke_job(self):
+        def invoke(i):
+            info = self.server.invoke_job(
+                self._job(i), cause='bench', wait_started=True,
+                wait_done=True, output_progress=False, output_done=False,
+                short_info=True)
+            if info['result'] is None:
+                raise AssertionError('{} #{} returned without a result'.format(
+                    self._job(i), info['number']))
+
+        return measure(self.fake, self.args.count, invoke,
+                       concurrency=self.args.concurrency)
+
+    def wait_done(self):
+        def setup(i):
+            name = self._job(i)
+            queue_url = self.server.trigger_job(name, cause='bench')
+            return name, self.server._wait_started(queue_url)
+
+        return measure(
+            self.fake, self.args.count,
+            lambda build: self.server.wait_done(
+                *build, output_progress=True, progress_out=NullOut()),
+            setup=setup, concurrency=self.args.concurrency)
+
+    def _fetch(self, case, archive, warm=False):
+        def setup(i):
+            self.server.meta_cache.clear()
+            if warm:
+                # every fetch is served by the cache the first one filled
+                if i == 0:
+                    self.server.fetch(self._job(0), cache=self._dir(case, 0),
+                                      build_number=1).wait_all()
+                return self._dir(case, 0)
+            return self._dir(case, i)
+
+        return measure(
+            self.fake, self.args.count,
+            lambda cache: self.server.fetch(
+                self._job(0), cache=cache, build_number=1,
+                archive=archive).wait_all(),
+            setup=setup)
+
+    def fetch(self):
+        return self._fetch('fetch', archive=False)
+
+    def fetch_archive(self):
+        return self._fetch('fetch_archive', archive=True)
+
+    def fetch_cached(self):
+        return self._fetch('fetch_cached', archive=None, warm=True)
+
+    def save_artifacts(self):
+        build_info = self.server.get_build_info(self._job(0), 1)
+        return measure(
+            self.fake, self.args.count,
+            lambda i: self.server.save_artifacts(
+                self._dir('save_artifacts', i), build_info,
+                archive=False).wait_all())
+
+    def list_jobs(self):
+        return measure(self.fake, self.args.count,
+                       lambda i: list(self.server.list_jobs()))
+
+    def run_server_script(self):
+        return measure(
+            self.fake, self.args.count,
+            lambda i: run_server_script(
+                self.server, 'jobs_transform.groovy',
+                action='list', pattern='.*'))
+
+
+def make_server(url, poll_interval):
+    server = JenkinsServer(url)
+    server._waiter = BuildWaiter(min_interval=poll_interval,
+                                 max_interval=poll_interval * 4)
+    server._queue = QueueMonitor(server, interval=poll_interval)
+    return server
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _lookup(result, dotted):
+    for key in dotted.split('.'):
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+
+def compare(report, baseline, max_regression):
+    """Metrics of COMPARED grown by more than max_regression share"""
+    regressions = []
+    for case, result in sorted(report['cases'].items()):
+        before = baseline.get('cases', {}).get(case)
+        if not before or 'error' in result or 'error' in before:
+            continue
+        for metric in COMPARED:
+            old, new = _lookup(before, metric), _lookup(result, metric)
+            if old and new is not None and new > old * (1 + max_regression):
+                regressions.append(dict(
+                    case=case, metric=metric, baseline=old, value=new,
+                    ratio=round(float(new) / old, 2)))
+    return regressions
+
+
+def run(args):
+    config = dict((name, getattr(args, name)) for name in DEFAULTS)
+    tmp_dir = tempfile.mkdtemp(prefix='jin-bench-')
+    report = dict(meta=dict(
+        created=time.time(), revision=_git_revision(),
+        python=sys.version.split()[0], server=config,
+        client=dict(count=args.count, concurrency=args.concurrency,
+                    poll_interval=args.poll_interval)), cases={})
+    try:
+        with FakeJenkins(**config) as fake:
+            server = make_server(fake.url, args.poll_interval)
+            cases = Cases(fake, server, args, tmp_dir)
+            names = args.cases.split(',') if args.cases else CASES
+            for name in names:
+                logging.warn('running {}'.format(name))
+                try:
+                    report['cases'][name] = getattr(cases, name)()
+                except Exception as e:
+                    logging.exception('case {} failed'.format(name))
+                    report['cases'][name] = dict(error=str(e))
+            # keep-alive connections would outlive the fake server threads
+            server.http.session.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    parser.add_argument('--cases', default=None,
+                        help='comma separated, default all')
+    parser.add_argument('--out', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--max-regression', type=float, default=0.25)
+    for name, default in sorted(DEFAULTS.items()):
+        parser.add_argument('--' + name.replace('_', '-'),
+                            type=type(default), default=default)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARN)
+
+    report = run(args)
+    failed = [name for name, result in report['cases'].items()
+              if 'error' in result]
+    if args.baseline:
+        with open(args.baseline) as fp:
+            report['regressions'] = compare(report, json.load(fp),
+                                            args.max_regression)
+    text = json.dumps(report, indent=4, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as fp:
+            fp.write(text + '\n')
+    print(text)
+    sys.exit(1 if failed or report.get('regressions') else 0)
+
+
+if __name__ == '__main__':
+    main()
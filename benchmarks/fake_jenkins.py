@@ -0,0 +1,565 @@
+"""In-process stand-in for a jenkins server, for benchmarks.
+
+Serves the endpoints jin uses: root/folder/job/build api (with tree=
+projections and {start,end} ranges), build triggers, the queue,
+progressiveText, artifacts (HEAD, Range and *zip* archives), nodes,
+plugins, scriptText and crumbIssuer (404, no crumb). Builds are timed:
+queue items start after queue_delay and builds run for build_duration,
+writing their console as they go. Every response waits latency seconds.
+
+Requests and bytes sent are counted per endpoint, see stats().
+Only the standard library is used, so it runs wherever jin does.
+"""
+import io
+import re
+import json
+import time
+import zipfile
+import hashlib
+import threading
+import urlparse
+import SocketServer
+import BaseHTTPServer
+from urllib import unquote
+
+FOLDER_CLASS = 'com.cloudbees.hudson.plugins.folder.Folder'
+JOB_CLASS = 'hudson.model.FreeStyleProject'
+BUILD_CLASS = 'hudson.model.FreeStyleBuild'
+
+DEFAULTS = dict(
+    latency=0.0,            # seconds added to every response
+    jobs=100,               # jobs in total, spread over the folders
+    folders=0,              # 0 puts every job at the root
+    builds=3,               # completed builds every job starts with
+    artifacts=10,           # artifacts of every build
+    artifact_size=64 * 1024,
+    console_size=256 * 1024,
+    queue_delay=0.1,        # seconds a triggered build waits in the queue
+    build_duration=0.3,     # seconds a triggered build runs
+    nodes=20,
+    plugins=50,
+)
+
+NAME_RE = re.compile(r'[\w$.*-]+')
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def parse_tree(text):
+    """'a,b[c,d]{0,10}' => [(name, subfields or None, (start, end) or None)]"""
+    fields, _ = _parse_fields(text, 0)
+    return fields
+
+
+def _parse_fields(text, pos):
+    fields = []
+    while pos < len(text):
+        match = NAME_RE.match(text, pos)
+        if not match:
+            raise ValueError('bad tree at {}: {}'.format(pos, text))
+        name, pos = match.group(0), match.end()
+        subfields = span = None
+        if text[pos:pos + 1] == '[':
+            subfields, pos = _parse_fields(text, pos + 1)
+            pos += 1
+        if text[pos:pos + 1] == '{':
+            end = text.index('}', pos)
+            bounds = text[pos + 1:end].split(',')
+            start = int(bounds[0] or 0)
+            if len(bounds) == 1:
+                span = (start, start + 1)
+            else:
+                span = (start, int(bounds[1]) if bounds[1] else None)
+            pos = end + 1
+        fields.append((name, subfields, span))
+        if text[pos:pos + 1] == ',':
+            pos += 1
+        elif text[pos:pos + 1] == ']':
+            return fields, pos
+    return fields, pos
+
+
+def apply_tree(value, fields):
+    if fields is None:
+        return value
+    if isinstance(value, list):
+        return [apply_tree(item, fields) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result = {}
+    if '_class' in value:
+        result['_class'] = value['_class']
+    for name, subfields, span in fields:
+        if name not in value:
+            continue
+        field = value[name]
+        if span is not None and isinstance(field, list):
+            field = field[span[0]:span[1]]
+        result[name] = apply_tree(field, subfields)
+    return result
+
+
+def make_blob(seed, size):
+    """size deterministic bytes which don't compress, unlike a pattern"""
+    blocks = []
+    for counter in xrange(size // 20 + 1):
+        blocks.append(hashlib.sha1('{}:{}'.format(seed, counter)).digest())
+    return ''.join(blocks)[:size]
+
+
+class FakeBuild(object):
+
+    def __init__(self, job, number, started, duration, queue_id=None):
+        self.job = job
+        self.number = number
+        self.started = started
+        self.duration = duration
+        self.queue_id = queue_id
+
+    def building(self, now):
+        return now < self.started + self.duration
+
+    def console_end(self, now, size):
+        if not self.building(now):
+            return size
+        done = (now - self.started) / self.duration if self.duration else 1
+        return int(size * max(0.0, min(done, 1.0)))
+
+    def url(self, base):
+        return '{}{}/'.format(self.job.url(base), self.number)
+
+
+class FakeJob(object):
+
+    def __init__(self, fullname):
+        self.fullname = fullname
+        self.name = fullname.rsplit('/', 1)[-1]
+        self.builds = {}
+        self.next_number = 1
+
+    def url(self, base):
+        return base + ''.join('job/{}/'.format(part)
+                              for part in self.fullname.split('/'))
+
+    def add_build(self, started, duration, queue_id=None):
+        build = FakeBuild(self, self.next_number, started, duration,
+                          queue_id)
+        self.builds[build.number] = build
+        self.next_number += 1
+        return build
+
+
+class FakeJenkins(object):
+    """Threaded http server on 127.0.0.1, use as a context manager or
+    start()/stop(). url is the jenkins root url, with a trailing /.
+    """
+
+    def __init__(self, **config):
+        unknown = set(config) - set(DEFAULTS)
+        if unknown:
+            raise ValueError('unknown options {}'.format(sorted(unknown)))
+        self.config = dict(DEFAULTS, **config)
+        self.url = None
+        self.jobs = {}
+        self.folders = {'': []}
+        self.queue = {}
+        self._next_queue_id = 1
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._blobs = {}
+        self._md5s = {}
+        self._pending = set()
+        self._zips = {}
+        self._console = None
+        self._server = None
+        self._populate()
+
+    # model
+
+    def _populate(self):
+        config = self.config
+        folders = ['folder-{:03d}'.format(i)
+                   for i in range(config['folders'])]
+        for folder in folders:
+            self.folders[''].append(folder)
+            self.folders[folder] = []
+        started = time.time() - 3600
+        for i in range(config['jobs']):
+            folder = folders[i % len(folders)] if folders else ''
+            name = 'job-{:04d}'.format(i)
+            fullname = folder + '/' + name if folder else name
+            job = FakeJob(fullname)
+            for _ in range(config['builds']):
+                job.add_build(started, 1.0)
+            self.jobs[fullname] = job
+            self.folders[folder].append(name)
+
+    def artifacts(self, build):
+        return ['out/file-{:04d}.bin'.format(i)
+                for i in range(self.config['artifacts'])]
+
+    def blob(self, seed, size):
+        key = (seed, size)
+        if key not in self._blobs:
+            self._blobs[key] = make_blob(seed, size)
+        return self._blobs[key]
+
+    def artifact_data(self, build, path):
+        # same content in every build, as jenkins fingerprints would show
+        return self.blob(path, self.config['artifact_size'])
+
+    def artifact_md5(self, build, path):
+        if path not in self._md5s:
+            self._md5s[path] = hashlib.md5(
+                self.artifact_data(build, path)).hexdigest()
+        return self._md5s[path]
+
+    def console_text(self):
+        if self._console is None:
+            line = 'fake build output line of some length for the console\n'
+            size = self.config['console_size']
+            self._console = (line * (size // len(line) + 1))[:size]
+        return self._console
+
+    def archive(self, build, prefix=''):
+        key = (build.job.fullname, build.number, prefix)
+        if key not in self._zips:
+            buf = io.BytesIO()
+            top = prefix.rstrip('/').split('/')[-1] if prefix else 'archive'
+            with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for path in self.artifacts(build):
+                    if prefix and not path.startswith(prefix + '/'):
+                        continue
+                    member = path[len(prefix) + 1:] if prefix else path
+                    archive.writestr('{}/{}'.format(top, member),
+                                     self.artifact_data(build, path))
+            self._zips[key] = buf.getvalue()
+        return self._zips[key]
+
+    def _advance(self, now):
+        """Starts the queue items whose delay passed"""
+        for queue_id in list(self._pending):
+            item = self.queue[queue_id]
+            if item['cancelled']:
+                self._pending.discard(queue_id)
+            elif now >= item['queued_at'] + self.config['queue_delay']:
+                job = self.jobs[item['job']]
+                item['build'] = job.add_build(
+                    now, self.config['build_duration'], queue_id)
+                self._pending.discard(queue_id)
+
+    def trigger(self, fullname):
+        now = time.time()
+        queue_id = self._next_queue_id
+        self._next_queue_id += 1
+        self.queue[queue_id] = dict(id=queue_id, job=fullname,
+                                    queued_at=now, build=None,
+                                    cancelled=False)
+        self._pending.add(queue_id)
+        return queue_id
+
+    # documents
+
+    def job_doc(self, job, now):
+        base = self.url
+        builds = sorted(job.builds.values(), key=lambda b: -b.number)
+        done = [b for b in builds if not b.building(now)]
+
+        def ref(build):
+            if build is None:
+                return None
+            return dict(number=build.number, url=build.url(base),
+                        timestamp=int(build.started * 1000))
+
+        last_done = done[0] if done else None
+        return dict(
+            _class=JOB_CLASS, name=job.name, fullName=job.fullname,
+            url=job.url(base), buildable=True, inQueue=any(
+                self.queue[queue_id]['job'] == job.fullname
+                for queue_id in self._pending),
+            nextBuildNumber=job.next_number,
+            builds=[ref(b) for b in builds],
+            lastBuild=ref(builds[0] if builds else None),
+            lastCompletedBuild=ref(last_done),
+            lastSuccessfulBuild=ref(last_done),
+            lastStableBuild=ref(last_done),
+            lastFailedBuild=None, lastUnstableBuild=None,
+            lastUnsuccessfulBuild=None,
+            actions=[{}], property=[])
+
+    def build_doc(self, build, now):
+        building = build.building(now)
+        artifacts = self.artifacts(build)
+        return dict(
+            _class=BUILD_CLASS, number=build.number, url=build.url(self.url),
+            queueId=build.queue_id or 0,
+            displayName='#{}'.format(build.number),
+            fullDisplayName='{} #{}'.format(build.job.fullname, build.number),
+            timestamp=int(build.started * 1000),
+            duration=0 if building else int(build.duration * 1000),
+            estimatedDuration=int(self.config['build_duration'] * 1000),
+            building=building, result=None if building else 'SUCCESS',
+            actions=[{'_class': 'hudson.model.CauseAction', 'causes': [
+                {'shortDescription': 'Started by fake jenkins'}]}],
+            artifacts=[dict(fileName=path.rsplit('/', 1)[-1],
+                            relativePath=path, displayPath=path)
+                       for path in artifacts],
+            fingerprint=[dict(
+                fileName=path, hash=self.artifact_md5(build, path))
+                for path in artifacts])
+
+    def folder_doc(self, folder):
+        base = self.url
+        jobs = []
+        for name in self.folders[folder]:
+            fullname = folder + '/' + name if folder else name
+            if fullname in self.folders:
+                jobs.append(dict(_class=FOLDER_CLASS, name=name,
+                                 url='{}job/{}/'.format(base, name)))
+            else:
+                job = self.jobs[fullname]
+                jobs.append(dict(_class=JOB_CLASS, name=name,
+                                 url=job.url(base)))
+        doc = dict(jobs=jobs, url=base + (
+            'job/{}/'.format(folder) if folder else ''))
+        if folder:
+            doc.update(_class=FOLDER_CLASS, name=folder, fullName=folder)
+        return doc
+
+    def queue_item_doc(self, item, now):
+        doc = dict(
+            id=item['id'], url='queue/item/{}/'.format(item['id']),
+            inQueueSince=int(item['queued_at'] * 1000),
+            blocked=False, buildable=item['build'] is None,
+            stuck=False, cancelled=item['cancelled'],
+            why=None if item['build'] else 'Waiting for next executor',
+            task=dict(name=item['job'].rsplit('/', 1)[-1],
+                      url=self.jobs[item['job']].url(self.url)),
+            actions=[{'causes': [{'shortDescription': 'fake trigger'}]}])
+        if item['build'] is not None:
+            doc['executable'] = dict(number=item['build'].number,
+                                     url=item['build'].url(self.url))
+        return doc
+
+    def node_doc(self, i):
+        name = 'master' if i == 0 else 'node-{:03d}'.format(i)
+        return dict(displayName=name, offline=i % 10 == 9,
+                    temporarilyOffline=False, idle=True, numExecutors=2,
+                    offlineCauseReason='',
+                    assignedLabels=[dict(name=name),
+                                    dict(name='linux' if i % 2 else 'docker')])
+
+    # http
+
+    def count(self, endpoint, sent):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint,
+                                           dict(requests=0, bytes=0))
+            stats['requests'] += 1
+            stats['bytes'] += sent
+
+    def stats(self):
+        """{endpoint: {requests, bytes}} plus 'total'"""
+        with self._lock:
+            stats = dict((name, dict(value))
+                         for name, value in self._stats.items())
+        stats['total'] = dict(
+            requests=sum(s['requests'] for s in stats.values()),
+            bytes=sum(s['bytes'] for s in stats.values()))
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+    def handle(self, request, method):
+        if self.config['latency']:
+            time.sleep(self.config['latency'])
+        # not urlparse: jin sends //job/... paths, read as a netloc there
+        path, _, query = request.path.partition('?')
+        query = dict(urlparse.parse_qsl(query))
+        parts = [unquote(part) for part in path.split('/') if part]
+        body = None
+        if method == 'POST':
+            length = int(request.headers.getheader('content-length') or 0)
+            body = request.rfile.read(length)
+        with self._lock:
+            now = time.time()
+            self._advance(now)
+            endpoint, status, headers, payload = self.route(
+                method, parts, query, body, request.headers, now)
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload)
+            headers.setdefault('Content-Type', 'application/json')
+        payload = payload or ''
+        request.send_response(status)
+        headers.setdefault('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.end_headers()
+        sent = 0
+        if method != 'HEAD':
+            request.wfile.write(payload)
+            sent = len(payload)
+        self.count(endpoint, sent)
+
+    def route(self, method, parts, query, body, request_headers, now):
+        """returns (endpoint, status, headers, payload)"""
+        job_parts = []
+        while len(parts) >= 2 and parts[0] == 'job':
+            job_parts.append(parts[1])
+            parts = parts[2:]
+        fullname = '/'.join(job_parts)
+        tree = parse_tree(query['tree']) if 'tree' in query else None
+
+        def api(endpoint, doc):
+            return endpoint, 200, {}, apply_tree(doc, tree)
+
+        if not job_parts:
+            return self.route_root(method, parts, query, body, api, now)
+        if fullname in self.folders:
+            if parts == ['api', 'json']:
+                return api('folder', self.folder_doc(fullname))
+            return 'not_found', 404, {}, ''
+        job = self.jobs.get(fullname)
+        if job is None:
+            return 'not_found', 404, {}, ''
+        if parts == ['api', 'json']:
+            return api('job', self.job_doc(job, now))
+        if method == 'POST' and parts and parts[0] in (
+                'build', 'buildWithParameters'):
+            queue_id = self.trigger(fullname)
+            return 'trigger', 201, {'Location': '{}queue/item/{}/'.format(
+                self.url, queue_id)}, ''
+        if not parts or not parts[0].isdigit():
+            return 'not_found', 404, {}, ''
+        build = job.builds.get(int(parts[0]))
+        if build is None:
+            return 'not_found', 404, {}, ''
+        rest = parts[1:]
+        if rest == ['api', 'json']:
+            return api('build', self.build_doc(build, now))
+        if rest == ['logText', 'progressiveText']:
+            text = self.console_text()
+            start = int(query.get('start', 0))
+            end = build.console_end(now, len(text))
+            return 'console', 200, {
+                'X-Text-Size': str(max(start, end)),
+                'X-More-Data': 'true' if build.building(now) else 'false',
+                'Content-Type': 'text/plain'}, text[start:end]
+        if method == 'POST' and rest == ['stop']:
+            build.duration = max(0.0, now - build.started)
+            return 'stop', 200, {}, ''
+        if rest and rest[0] == 'artifact':
+            return self.route_artifact(build, rest[1:], request_headers)
+        return 'not_found', 404, {}, ''
+
+    def route_root(self, method, parts, query, body, api, now):
+        if parts == ['api', 'json']:
+            return api('folder', self.folder_doc(''))
+        if parts == ['crumbIssuer', 'api', 'json']:
+            return 'crumb', 404, {}, ''
+        if parts == ['queue', 'api', 'json']:
+            items = [self.queue_item_doc(self.queue[queue_id], now)
+                     for queue_id in sorted(self._pending)]
+            return api('queue', dict(items=items))
+        if len(parts) == 5 and parts[:2] == ['queue', 'item'] and \
+                parts[3:] == ['api', 'json']:
+            item = self.queue.get(int(parts[2]))
+            if item is None:
+                return 'not_found', 404, {}, ''
+            return api('queue_item', self.queue_item_doc(item, now))
+        if method == 'POST' and parts == ['queue', 'cancelItem']:
+            item = self.queue.get(int(query.get('id', 0)))
+            if item is not None and item['build'] is None:
+                item['cancelled'] = True
+            return 'queue_cancel', 200, {}, ''
+        if parts == ['computer', 'api', 'json']:
+            return api('nodes', dict(computer=[
+                self.node_doc(i) for i in range(self.config['nodes'])]))
+        if len(parts) == 4 and parts[0] == 'computer' and \
+                parts[2:] == ['api', 'json']:
+            name = 'master' if parts[1] == '(master)' else parts[1]
+            for i in range(self.config['nodes']):
+                doc = self.node_doc(i)
+                if doc['displayName'] == name:
+                    return api('node', doc)
+            return 'not_found', 404, {}, ''
+        if parts == ['pluginManager', 'api', 'json']:
+            return api('plugins', dict(plugins=[
+                dict(shortName='plugin-{:03d}'.format(i), version='1.{}'
+                     .format(i), active=True, enabled=True)
+                for i in range(self.config['plugins'])]))
+        if method == 'POST' and parts == ['scriptText']:
+            # groovy isn't run: answers as jobs_transform list would
+            lines = ['JIN:' + json.dumps(name) for name in sorted(self.jobs)]
+            return 'script', 200, {'Content-Type': 'text/plain'}, \
+                '\n'.join(lines) + '\n'
+        return 'not_found', 404, {}, ''
+
+    def route_artifact(self, build, path_parts, request_headers):
+        if '*zip*' in path_parts:
+            prefix = '/'.join(path_parts[:path_parts.index('*zip*')])
+            return 'archive', 200, {'Content-Type': 'application/zip'}, \
+                self.archive(build, prefix)
+        path = '/'.join(path_parts)
+        if path not in self.artifacts(build):
+            return 'not_found', 404, {}, ''
+        data = self.artifact_data(build, path)
+        headers = {'Accept-Ranges': 'bytes',
+                   'Content-Type': 'application/octet-stream'}
+        match = RANGE_RE.match(request_headers.getheader('range') or '')
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = int(match.group(2)) if match.group(2) else len(data) - 1
+            else:
+                start, end = len(data) - int(match.group(2)), len(data) - 1
+            end = min(end, len(data) - 1)
+            if start >= len(data):
+                return 'artifact', 416, {}, ''
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end, len(data))
+            return 'artifact', 206, headers, data[start:end + 1]
+        return 'artifact', 200, headers, data
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                fake.handle(self, 'GET')
+
+            def do_HEAD(self):
+                fake.handle(self, 'HEAD')
+
+            def do_POST(self):
+                fake.handle(self, 'POST')
+
+            def log_message(self, fmt, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            request_queue_size = 128
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/'.format(self._server.server_port)
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  name='fake-jenkins')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,303 @@
+import os
+import json
+import stat
+import time
+import errno
+import fcntl
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+import bunch
+
+import fs_utils
+
+CACHE_DIR_NAME = '.jin-cache'
+HASH_BLOCK_SIZE = 1024 * 1024
+NO_WRITE = ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fd:
+        for block in iter(lambda: fd.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def _replace_with_link(src, dst):
+    """Makes dst a hardlink of src, atomically replacing dst if exists."""
+    fs_utils.ensure_dir(os.path.dirname(dst))
+    tmp = '{}.jin-link-{}'.format(dst, os.getpid())
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.link(src, tmp)
+    os.rename(tmp, dst)
+
+
+def _is_sealed(path, size):
+    """path is an object of size which nothing could write to"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_size == size and not st.st_mode & ~NO_WRITE
+
+
+def _seal(path):
+    """Drops the write bits, the fetched files share the object inode"""
+    mode = os.stat(path).st_mode
+    if mode & ~NO_WRITE:
+        os.chmod(path, mode & NO_WRITE)
+
+
+class ArtifactCache(object):
+    """Content addressed artifacts store under <root>/.jin-cache
+
+    objects/<sha1[:2]>/<sha1>  - one file per unique content
+    index.json                 - job#build#relativePath => entry
+
+    Every fetched file is a hardlink to its object, so identical
+    artifacts of different builds take disk space once. When the objects
+    total size exceeds max_size the least recently used ones are evicted
+    together with the fetched files that point at them.
+    """
+
+    def __init__(self, root, max_size=None):
+        self.root = os.path.join(root, CACHE_DIR_NAME)
+        self.objects_dir = os.path.join(self.root, 'objects')
+        self.index_path = os.path.join(self.root, 'index.json')
+        self.lock_path = os.path.join(self.root, 'index.lock')
+        self.max_size = max_size
+        self.stats = bunch.Bunch(hits=0, misses=0, stored=0, deduped=0,
+                                 fingerprint_hits=0, evicted=0,
+                                 bytes_saved=0)
+        self._thread_lock = threading.RLock()
+        self._batch_index = None
+        self._batch_md5 = None
+        fs_utils.ensure_dir(self.objects_dir)
+
+    @staticmethod
+    def entry_key(job_name, build_number, relative_path):
+        return '{}#{}#{}'.format(job_name, build_number, relative_path)
+
+    def object_path(self, sha1):
+        return os.path.join(self.objects_dir, sha1[:2], sha1)
+
+    @contextmanager
+    def _locked_index(self, write=False):
+        """Yields the index dict under an exclusive file lock, so several
+        jin processes can share one cache dir. Inside batch() yields the
+        batch index, saved when the batch ends.
+        """
+        with self._thread_lock:
+            if self._batch_index is not None:
+                yield self._batch_index
+                return
+            with open(self.lock_path, 'a') as lock_fd:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                try:
+                    index = self._load_index()
+                    yield index
+                    if write:
+                        self._save_index(index)
+                finally:
+                    fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def batch(self):
+        """Holds the index lock, loads the index once and saves it once
+        for all the checkouts/stores/evict of the block. Other threads
+        and processes wait for the block to end.
+        """
+        with self._locked_index(write=True) as index:
+            self._batch_index = index
+            try:
+                yield self
+            finally:
+                self._batch_index = None
+                self._batch_md5 = None
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as fd:
+                return json.load(fd)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            logging.warn('artifacts cache index {} is corrupted, '
+                         'starting a new one'.format(self.index_path))
+        return {}
+
+    def _save_index(self, index):
+        tmp = '{}.{}'.format(self.index_path, os.getpid())
+        with open(tmp, 'w') as fd:
+            json.dump(index, fd)
+        os.rename(tmp, self.index_path)
+
+    def _is_valid(self, entry):
+        """The object exists and wasn't written to since it was stored
+        (the write bits don't stop root)
+        """
+        try:
+            st = os.stat(self.object_path(entry['sha1']))
+        except OSError:
+            return False
+        if entry.get('mtime') is not None and st.st_mtime != entry['mtime']:
+            return False
+        return st.st_size == entry['size']
+
+    def _md5_entries(self, index):
+        """md5 => most recently used entry, built once per batch"""
+        if self._batch_md5 is not None:
+            return self._batch_md5
+        by_md5 = dict((entry['md5'], entry) for entry in sorted(
+            index.values(), key=lambda entry: entry['last_used'])
+            if entry.get('md5'))
+        if self._batch_index is not None:
+            self._batch_md5 = by_md5
+        return by_md5
+
+    def _add_entry(self, index, key, entry):
+        index[key] = entry
+        if self._batch_md5 is not None and entry.get('md5'):
+            self._batch_md5[entry['md5']] = entry
+
+    def checkout(self, job_name, build_number, relative_path, dst,
+                 md5=None):
+        """Links a cached artifact into dst.
+        md5 - jenkins fingerprint of the artifact, looked up with
+        checkout_fingerprint when the artifact itself isn't cached.
+        returns the object sha1 on a hit, None when it has to be downloaded.
+        """
+        key = self.entry_key(job_name, build_number, relative_path)
+        with self._locked_index(write=True) as index:
+            entry = index.get(key)
+            if entry is not None and self._is_valid(entry):
+                obj = self.object_path(entry['sha1'])
+                if not _same_file(obj, dst):
+                    _replace_with_link(obj, dst)
+                entry['path'] = os.path.abspath(dst)
+                entry['last_used'] = time.time()
+                self.stats.hits += 1
+                self.stats.bytes_saved += entry['size']
+                return entry['sha1']
+            index.pop(key, None)
+        # outside of the lock: a second flock of the process would block
+        sha1 = None
+        if md5:
+            sha1 = self.checkout_fingerprint(job_name, build_number,
+                                             relative_path, md5, dst)
+        if sha1 is None:
+            self.stats.misses += 1
+        return sha1
+
+    def checkout_fingerprint(self, job_name, build_number, relative_path,
+                             md5, dst):
+        """Links the cached object with md5 (a jenkins fingerprint) into
+        dst, whatever job or build it came from.
+        returns the object sha1, None when no valid object has that md5.
+        """
+        md5 = md5.lower()
+        with self._locked_index(write=True) as index:
+            by_md5 = self._md5_entries(index)
+            entry = by_md5.get(md5)
+            if entry is None or not self._is_valid(entry):
+                by_md5.pop(md5, None)
+                return None
+            obj = self.object_path(entry['sha1'])
+            if not _same_file(obj, dst):
+                _replace_with_link(obj, dst)
+            key = self.entry_key(job_name, build_number, relative_path)
+            self._add_entry(index, key, dict(
+                sha1=entry['sha1'], size=entry['size'],
+                mtime=entry.get('mtime'), md5=md5,
+                path=os.path.abspath(dst), last_used=time.time()))
+            self.stats.fingerprint_hits += 1
+            self.stats.bytes_saved += entry['size']
+            return entry['sha1']
+
+    def store(self, job_name, build_number, relative_path, path,
+              sha1=None, md5=None):
+        """Adds a freshly downloaded file, replacing it with a link to an
+        existing object when the same content is already cached.
+        sha1/md5 - hashes computed while downloading, saves re-reading
+        the file.
+        """
+        sha1 = sha1 or file_sha1(path)
+        size = os.path.getsize(path)
+        obj = self.object_path(sha1)
+        key = self.entry_key(job_name, build_number, relative_path)
+        with self._locked_index(write=True) as index:
+            if _is_sealed(obj, size):
+                if not _same_file(obj, path):
+                    _replace_with_link(obj, path)
+                    self.stats.deduped += 1
+            else:
+                _replace_with_link(path, obj)
+            _seal(obj)
+            self._add_entry(index, key, dict(
+                sha1=sha1, size=size, mtime=os.path.getmtime(obj), md5=md5,
+                path=os.path.abspath(path), last_used=time.time()))
+            self.stats.stored += 1
+        return sha1
+
+    def total_size(self, index=None):
+        if index is None:
+            with self._locked_index() as index:
+                return self._objects_size(index)
+        return self._objects_size(index)
+
+    @staticmethod
+    def _objects_size(index):
+        sizes = {}
+        for entry in index.values():
+            sizes[entry['sha1']] = entry['size']
+        return sum(sizes.values())
+
+    def _evict(self, index, keep=()):
+        if not self.max_size:
+            return
+        total = self._objects_size(index)
+        if total <= self.max_size:
+            return
+        last_used = {}
+        for entry in index.values():
+            sha1 = entry['sha1']
+            last_used[sha1] = max(last_used.get(sha1, 0), entry['last_used'])
+        for sha1 in sorted(last_used, key=last_used.get):
+            if total <= self.max_size:
+                break
+            if sha1 in keep:
+                continue
+            total -= self._drop_object(index, sha1)
+
+    def _drop_object(self, index, sha1):
+        obj = self.object_path(sha1)
+        size = 0
+        for key in [k for k, e in index.items() if e['sha1'] == sha1]:
+            entry = index.pop(key)
+            size = entry['size']
+            if _same_file(obj, entry['path']):
+                os.remove(entry['path'])
+        if os.path.exists(obj):
+            os.remove(obj)
+        self.stats.evicted += 1
+        logging.debug('evicted {} from artifacts cache'.format(sha1))
+        return size
+
+    def evict(self, keep=()):
+        """Evicts least recently used objects down to max_size.
+        keep - sha1s which must survive, e.g. the ones just fetched.
+        """
+        with self._locked_index(write=True) as index:
+            self._evict(index, keep=set(keep))
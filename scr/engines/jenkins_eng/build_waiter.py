@@ -0,0 +1,223 @@
+import json
+import time
+import logging
+import threading
+
+import utils
+
+
+class Backoff(object):
+    """Poll interval policy.
+
+    While the build is expected to run (estimated duration from jenkins)
+    polls at half of the remaining time, then falls back to geometric
+    growth from min_interval, always bounded by [min, max].
+    """
+
+    def __init__(self, min_interval=1.0, max_interval=30.0, factor=1.5,
+                 estimated=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.estimated = estimated
+        self.interval = min_interval / factor
+
+    def _clamp(self, interval):
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def next(self, elapsed):
+        if self.estimated and elapsed < self.estimated:
+            return self._clamp((self.estimated - elapsed) / 2.0)
+        self.interval = self._clamp(self.interval * self.factor)
+        return self.interval
+
+
+class Watch(object):
+    def __init__(self, key, check, backoff):
+        self.key = key
+        self.check = check
+        self.backoff = backoff
+        self.started = time.time()
+        self.due = self.started
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.key)
+
+
+class BuildWaiter(object):
+    """Single poller thread which serves all the waits of one server.
+
+    Every wait registers a check function under a key, (job, number) for
+    builds (queue items are served by QueueMonitor). The poller runs each
+    check when it's due according to its Backoff. Notification sources (see
+    WebhookReceiver) call notify(key) to run a check right away, in which
+    case polling is kept only as a slow fallback.
+    """
+    TICK = 0.5
+
+    def __init__(self, min_interval=1.0, max_interval=30.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.sources = []
+        self._watches = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def add_source(self, source, notify=None):
+        """notify - receives the source keys instead of self.notify"""
+        source.start(notify or self.notify)
+        self.sources.append(source)
+
+    def notify(self, key):
+        with self._cond:
+            watch = self._watches.get(key)
+            if watch:
+                logging.debug('notified {}'.format(watch))
+                watch.due = 0
+                self._cond.notify()
+
+    def _make_backoff(self, estimated):
+        if self.sources:
+            return Backoff(self.max_interval, self.max_interval)
+        return Backoff(self.min_interval, self.max_interval,
+                       estimated=estimated)
+
+    def watch(self, key, check, estimated=None):
+        watch = Watch(key, check, self._make_backoff(estimated))
+        with self._cond:
+            self._watches[key] = watch
+            self._ensure_thread()
+            self._cond.notify()
+        return watch
+
+    def forget(self, watch):
+        with self._cond:
+            if self._watches.get(watch.key) is watch:
+                del self._watches[watch.key]
+
+    def wait(self, key, check, estimated=None, timeout=None):
+        """Blocks until check() returns non None and returns its value.
+        estimated - expected seconds until done, tunes the poll interval.
+        """
+        watch = self.watch(key, check, estimated)
+        try:
+            # short waits keep the main thread responsive to Ctrl-C
+            while not watch.done.wait(self.TICK):
+                if timeout and time.time() - watch.started > timeout:
+                    raise utils.JinException(
+                        'timeout waiting for {}'.format(key))
+        finally:
+            self.forget(watch)
+        if watch.error:
+            raise watch.error
+        return watch.result
+
+    def _ensure_thread(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run,
+                                        name='jin-build-waiter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _due_watches(self):
+        with self._cond:
+            while True:
+                now = time.time()
+                due = [w for w in self._watches.values() if w.due <= now]
+                if due:
+                    return due
+                pending = [w.due for w in self._watches.values()
+                           if not w.done.is_set()]
+                delay = min(pending) - now if pending else None
+                self._cond.wait(delay)
+
+    def _run(self):
+        while True:
+            for watch in self._due_watches():
+                self._poll(watch)
+
+    @staticmethod
+    def _poll(watch):
+        try:
+            result = watch.check()
+        except Exception as e:
+            watch.error = e
+            watch.due = float('inf')
+            watch.done.set()
+            return
+        if result is not None:
+            watch.result = result
+            watch.due = float('inf')
+            watch.done.set()
+            return
+        now = time.time()
+        watch.due = now + watch.backoff.next(now - watch.started)
+
+
+def _job_name_from_url(url):
+    """job/folder/job/name/ => folder/name"""
+    parts = [p for p in url.strip('/').split('/') if p]
+    return '/'.join(parts[i + 1] for i, p in enumerate(parts)
+                    if p == 'job' and i + 1 < len(parts))
+
+
+class WebhookReceiver(object):
+    """Local http endpoint for the jenkins Notification plugin.
+
+    Configure the job notification endpoint (JSON, HTTP) to
+    http://<this host>:<port>/ and queue/build phase changes will wake
+    the matching waits instead of waiting for the next poll.
+    """
+
+    def __init__(self, host='0.0.0.0', port=8765):
+        self.host = host
+        self.port = port
+        self._server = None
+
+    @staticmethod
+    def keys_from_payload(payload):
+        build = payload.get('build', {})
+        keys = []
+        if 'queue_id' in build:
+            keys.append(('queue', build['queue_id']))
+        if 'number' in build:
+            name = _job_name_from_url(payload.get('url', '')) or \
+                payload.get('name')
+            keys.append((name, build['number']))
+        return keys
+
+    def start(self, notify):
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+        keys_from_payload = self.keys_from_payload
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.getheader('content-length') or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length))
+                    for key in keys_from_payload(payload):
+                        notify(key)
+                    self.send_response(200)
+                except ValueError:
+                    self.send_response(400)
+                self.end_headers()
+
+            def log_message(self, fmt, *args):
+                logging.debug('webhook: ' + fmt, *args)
+
+        self._server = HTTPServer((self.host, self.port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  name='jin-webhook-receiver')
+        thread.daemon = True
+        thread.start()
+        logging.info('listening for jenkins notifications on {}:{}'.format(
+                     self.host, self.port))
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server = None
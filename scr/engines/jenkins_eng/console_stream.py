@@ -0,0 +1,74 @@
+import time
+import logging
+
+import jenkins
+
+PROGRESSIVE_TEXT = ('%(folder_url)sjob/%(short_name)s/%(number)d/'
+                    'logText/progressiveText?start=%(start)d')
+BLOCK_SIZE = 64 * 1024
+
+
+class ConsoleStream(object):
+    """Incremental build console reader.
+
+    Uses jenkins logText/progressiveText?start=<offset>, so every poll
+    transfers only the new part of the log. Text is yielded in blocks of
+    at most block_size bytes and never kept, which bounds memory for any
+    log size.
+    """
+
+    def __init__(self, server, name, number, start=0,
+                 block_size=BLOCK_SIZE, interval=1.0):
+        self.server = server
+        self.name = name
+        self.number = number
+        self.offset = start
+        self.block_size = block_size
+        self.interval = interval
+        self.more_data = True
+
+    def _url(self):
+        folder_url, short_name = self.server._get_job_folder(self.name)
+        return self.server._build_url(PROGRESSIVE_TEXT, dict(
+            folder_url=folder_url, short_name=short_name,
+            number=self.number, start=self.offset))
+
+    def poll(self):
+        """One request: yields the text appended since the last poll."""
+        rs = self.server.jenkins_open_ex(jenkins.Request(self._url()))
+        try:
+            while True:
+                block = rs.read(self.block_size)
+                if not block:
+                    break
+                yield block
+            headers = rs.info()
+            text_size = headers.get('X-Text-Size')
+            if text_size is not None:
+                self.offset = int(text_size)
+            self.more_data = headers.get('X-More-Data') == 'true'
+        finally:
+            rs.close()
+
+    def follow(self):
+        """Yields the console until the build stops writing to it."""
+        while True:
+            for block in self.poll():
+                yield block
+            if not self.more_data:
+                break
+            time.sleep(self.interval)
+
+    def __iter__(self):
+        return self.follow()
+
+    def write_to(self, out, follow=True):
+        blocks = self.follow() if follow else self.poll()
+        written = 0
+        for block in blocks:
+            out.write(block)
+            written += len(block)
+        out.flush()
+        logging.debug('console {}#{}: wrote {} bytes, offset {}'.format(
+            self.name, self.number, written, self.offset))
+        return written
@@ -1,10 +1,23 @@
 import os
 import sys
+import time
+import errno
+import fcntl
+import stat
+import shutil
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
 
 from utils import JinException
 from infra.runner import Runner
 
+FS_CONCURRENCY = 8
+# below this many entries a thread pool costs more than it saves
+PARALLEL_MIN_ITEMS = 256
+# linux ioctl cloning a whole file (btrfs, xfs with reflink=1)
+FICLONE = 0x40049409
+
 
 def run_cmd(*args, **kwargs):
     return Runner.run_sh(*args, **kwargs)
@@ -34,48 +47,400 @@ def ensure_dir_exists(dest):
         os.makedirs(dest)
 
 
+class FsStats(object):
+    """Thread safe counters of one fs operation.
+    files/bytes - regular files and symlinks handled and their size
+    renames - entries moved by a single rename (their content is not
+    walked, so not counted in files/bytes)
+    """
+
+    def __init__(self, op):
+        self.op = op
+        self.files = 0
+        self.dirs = 0
+        self.bytes = 0
+        self.renames = 0
+        self.linked = 0
+        self.copied = 0
+        self.started = time.time()
+        self.elapsed = None
+        self._lock = threading.Lock()
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def done(self):
+        self.elapsed = round(time.time() - self.started, 3)
+        logging.debug(repr(self))
+        return self
+
+    def __repr__(self):
+        return ('{}(files={}, dirs={}, bytes={}, renames={}, linked={}, '
+                'copied={}, elapsed={})').format(
+            self.op, self.files, self.dirs, self.bytes, self.renames,
+            self.linked, self.copied, self.elapsed)
+
+
+def _walk(root):
+    """(dirs top-down, files) under root. symlinks to dirs are listed as
+    files and not followed.
+    """
+    dirs, files = [], []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirs.append(dirpath)
+        for name in dirnames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                files.append(path)
+        files.extend(os.path.join(dirpath, name) for name in filenames)
+    return dirs, files
+
+
+def _parallel(func, items, concurrency=FS_CONCURRENCY):
+    if concurrency <= 1 or len(items) < PARALLEL_MIN_ITEMS:
+        for item in items:
+            func(item)
+        return
+    pool = ThreadPool(concurrency)
+    try:
+        pool.map(func, items, chunksize=64)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _same_device(src, dst):
+    """True when dst (existing or not) would be on the device of src"""
+    parent = os.path.dirname(os.path.abspath(dst))
+    while not os.path.exists(parent):
+        parent = os.path.dirname(parent)
+    return os.lstat(src).st_dev == os.stat(parent).st_dev
+
+
+def remove_tree(path, concurrency=FS_CONCURRENCY):
+    """rm -rf without forking: files are unlinked by a thread pool, then
+    directories are removed bottom-up. Missing path is not an error.
+    """
+    stats = FsStats('remove')
+    if not os.path.lexists(path):
+        return stats.done()
+    if os.path.islink(path) or not os.path.isdir(path):
+        size = os.lstat(path).st_size
+        os.remove(path)
+        stats.add(files=1, bytes=size)
+        return stats.done()
+
+    dirs, files = _walk(path)
+
+    def remove(file_path):
+        size = os.lstat(file_path).st_size
+        os.remove(file_path)
+        stats.add(files=1, bytes=size)
+
+    _parallel(remove, files, concurrency)
+    for dir_path in reversed(dirs):
+        os.rmdir(dir_path)
+        stats.add(dirs=1)
+    return stats.done()
+
+
+def reflink_file(src, dst):
+    """Copy on write clone of src to dst. raises IOError/OSError when the
+    filesystem can't clone (EOPNOTSUPP, EXDEV, EINVAL, ENOTTY).
+    """
+    with open(src, 'rb') as src_fd:
+        with open(dst, 'wb') as dst_fd:
+            try:
+                fcntl.ioctl(dst_fd.fileno(), FICLONE, src_fd.fileno())
+            except (IOError, OSError):
+                dst_fd.close()
+                os.remove(dst)
+                raise
+    shutil.copystat(src, dst)
+
+
+LINK_FALLBACK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                        errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY)
+
+
+def _make_writable(path):
+    os.chmod(path, os.stat(path).st_mode | stat.S_IWUSR)
+
+
+def _place_file(src, dst, mode, stats):
+    size = os.lstat(src).st_size
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        stats.add(files=1, bytes=size, copied=1)
+        return
+    if mode == 'symlink':
+        os.symlink(src, dst)
+        stats.add(files=1, bytes=size, linked=1)
+        return
+    if mode != 'copy':
+        try:
+            if mode == 'hardlink':
+                os.link(src, dst)
+            else:
+                reflink_file(src, dst)
+                # a clone is private, the source may be sealed
+                _make_writable(dst)
+            stats.add(files=1, bytes=size, linked=1)
+            return
+        except (IOError, OSError) as e:
+            if e.errno not in LINK_FALLBACK_ERRORS:
+                raise
+    shutil.copy2(src, dst)
+    _make_writable(dst)
+    stats.add(files=1, bytes=size, copied=1)
+
+
+LINK_MODES = ('hardlink', 'reflink', 'symlink', 'copy')
+
+
+def link_tree(src, dst, mode='hardlink', concurrency=FS_CONCURRENCY):
+    """Materializes the tree of src at dst without copying data where
+    possible: hardlinks, reflinks (copy on write clones) or symlinks to
+    the absolute src paths. hardlink/reflink fall back to a copy per file
+    when the filesystem refuses (other device, no reflink support, link
+    count limit). dst dirs may already exist, files in them are replaced.
+    """
+    if mode not in LINK_MODES:
+        raise ValueError('unknown mode {}, choose from {}'.format(
+            mode, LINK_MODES))
+    stats = FsStats(mode)
+    src = os.path.abspath(src)
+    dirs, files = _walk(src)
+    for dir_path in dirs:
+        ensure_dir(os.path.join(dst, os.path.relpath(dir_path, src)))
+        stats.add(dirs=1)
+    _parallel(lambda path: _place_file(
+        path, os.path.join(dst, os.path.relpath(path, src)), mode, stats),
+        files, concurrency)
+    return stats.done()
+
+
+def move_tree(src, dst, concurrency=FS_CONCURRENCY):
+    """mv src dst: a single rename on the same filesystem, else a copy
+    of the tree followed by removal of src. A rename refused with EXDEV
+    (bind mounts, overlayfs) falls back to the copy as well.
+    """
+    ensure_dir(os.path.dirname(os.path.abspath(dst)))
+    if _same_device(src, dst):
+        stats = FsStats('move')
+        try:
+            os.rename(src, dst)
+            stats.add(renames=1)
+            return stats.done()
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            logging.debug('cannot rename {} to {}, copying'.format(src, dst))
+    stats = link_tree(src, dst, mode='copy', concurrency=concurrency)
+    stats.op = 'move'
+    remove_tree(src, concurrency)
+    return stats.done()
+
+
+def move_contents(src_dir, dst_dir, concurrency=FS_CONCURRENCY):
+    """mv src_dir/* dst_dir/ including dot files. Entries existing in
+    dst_dir are replaced.
+    """
+    ensure_dir(dst_dir)
+    stats = FsStats('move')
+    for name in os.listdir(src_dir):
+        dst = os.path.join(dst_dir, name)
+        if os.path.lexists(dst):
+            remove_tree(dst, concurrency)
+        entry_stats = move_tree(os.path.join(src_dir, name), dst,
+                                concurrency)
+        stats.add(files=entry_stats.files, dirs=entry_stats.dirs,
+                  bytes=entry_stats.bytes, renames=entry_stats.renames,
+                  copied=entry_stats.copied)
+    return stats.done()
+
+
+def chown_tree(path, uid, gid, concurrency=FS_CONCURRENCY):
+    """chown -R without forking, symlinks themselves are changed"""
+    stats = FsStats('chown')
+    dirs, files = _walk(path)
+    for dir_path in dirs:
+        os.lchown(dir_path, uid, gid)
+        stats.add(dirs=1)
+
+    def chown(file_path):
+        os.lchown(file_path, uid, gid)
+        stats.add(files=1)
+
+    _parallel(chown, files, concurrency)
+    return stats.done()
+
+
+def seal_tree(path, concurrency=FS_CONCURRENCY):
+    """Drops the write bits of every file under path, so hardlinks and
+    symlinks handed out to workspaces can't be written through into it.
+    Files are still removable (dirs stay writable) for cache eviction.
+    """
+    stats = FsStats('seal')
+    _, files = _walk(path)
+    no_write = ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+    def seal(file_path):
+        if os.path.islink(file_path):
+            return
+        mode = os.stat(file_path).st_mode
+        if mode & ~no_write:
+            os.chmod(file_path, mode & no_write)
+            stats.add(files=1)
+
+    _parallel(seal, files, concurrency)
+    return stats.done()
+
+
+def detach_file(path):
+    """Replaces a hardlink or symlink into the cache by a private writable
+    copy, for a workspace file that has to be modified in place.
+    """
+    if not os.path.islink(path) and os.lstat(path).st_nlink == 1:
+        _make_writable(path)
+        return
+    tmp = '{}.jin-detach-{}'.format(path, os.getpid())
+    shutil.copy2(os.path.realpath(path), tmp)
+    _make_writable(tmp)
+    os.rename(tmp, path)
+
+
+def detach_tree(path, concurrency=FS_CONCURRENCY):
+    """detach_file for path or every hardlinked file under it, symlinks
+    are left as they are
+    """
+    stats = FsStats('detach')
+    if os.path.isdir(path) and not os.path.islink(path):
+        _, files = _walk(path)
+    else:
+        files = [path]
+
+    def detach(file_path):
+        st = os.lstat(file_path)
+        if stat.S_ISLNK(st.st_mode):
+            return
+        if st.st_nlink > 1:
+            detach_file(file_path)
+            stats.add(files=1, bytes=st.st_size, copied=1)
+        elif not st.st_mode & stat.S_IWUSR:
+            _make_writable(file_path)
+
+    _parallel(detach, files, concurrency)
+    return stats.done()
+
+
+def probe_reflink(src_dir, dst_dir):
+    """True when files of src_dir can be cloned into dst_dir"""
+    ensure_dir(dst_dir)
+    probe_src = os.path.join(src_dir, '.jin-reflink-probe')
+    probe_dst = os.path.join(dst_dir, '.jin-reflink-probe')
+    try:
+        with open(probe_src, 'wb') as fd:
+            fd.write(b'probe')
+        reflink_file(probe_src, probe_dst)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        for path in [probe_src, probe_dst]:
+            if os.path.lexists(path):
+                os.remove(path)
+
+
+CHECKOUT_MODES = ('move', 'auto') + LINK_MODES
+
+
 def checkout_from_cache(fetched_dir, dest_dir,
-                        subdir=None, force=None, strip=False):
+                        subdir=None, force=None, strip=False, mode='move'):
+    """Checks out fetched_dir (or its subdir) as dest_dir, or into it
+    with strip.
+    mode:
+      move - renames the fetched files away, the cache entry is consumed;
+        files shared with the artifacts cache become private copies
+      reflink - copy on write clones, private to the workspace
+      hardlink - shares the inodes of the cache entry
+      symlink - farm of links to the cache entry files
+      copy - plain private copy
+      auto - reflink when the filesystem supports it, else hardlink
+    hardlink and symlink seal the cache entry read only first, so a
+    workspace can't write into it (use detach_file to get a writable
+    copy of a file). Link modes keep the cache entry and cost the same
+    whatever the artifacts size.
+    """
+    if mode not in CHECKOUT_MODES:
+        raise ValueError('unknown mode {}, choose from {}'.format(
+            mode, CHECKOUT_MODES))
     if strip:
         ensure_dir_exists(dest_dir)
     elif not force:
         verify_path_doesnt_exists(dest_dir)
     elif force:
         logging.info('removing {}'.format(dest_dir))
-        Runner.run_cmd('rm -rf {}'.format(dest_dir))
+        remove_tree(dest_dir)
 
     if subdir:
         the_dir = os.path.join(fetched_dir, subdir)
     else:
         the_dir = fetched_dir
 
-    if strip:
-        Runner.run_cmd('mv {}/* {}/'.format(the_dir, dest_dir))
-    else:
-        Runner.run_cmd('mv {} {}'.format(the_dir, dest_dir))
+    if mode == 'move':
+        if strip:
+            moved = [os.path.join(dest_dir, name)
+                     for name in os.listdir(the_dir)]
+            stats = move_contents(the_dir, dest_dir)
+        else:
+            moved = [dest_dir]
+            stats = move_tree(the_dir, dest_dir)
+        logging.info('checkout {}: {}'.format(dest_dir, stats))
+        # the moved files may still be hardlinks of read only cache
+        # objects, which a workspace must not write through
+        for path in moved:
+            detach_tree(path)
+        remove_tree(fetched_dir)
+        return fetched_dir
 
-    Runner.run_cmd('rm -rf {}'.format(fetched_dir))
+    if mode == 'auto':
+        mode = 'reflink' if probe_reflink(the_dir, dest_dir) \
+            else 'hardlink'
+    if mode in ('hardlink', 'symlink'):
+        seal_tree(the_dir)
+    stats = link_tree(the_dir, dest_dir, mode=mode)
+    logging.info('checkout {}: {}'.format(dest_dir, stats))
     return fetched_dir
 
 
-def get_web_file_content(url):
+def get_web_file_content(url, session=None):
     import requests
-    response = requests.get(url)
+    response = (session or requests).get(url)
     if not (200 <= response.status_code < 300):
         raise JinException('Error when request {}'.format(url))
     return response.content.strip()
 
 
-def restore_user_permissions(dest_dir):
+def restore_user_permissions(dest_dir, recursive=False):
     if os.geteuid() == 0 and os.environ.get('SUDO_UID', None):
         uid = int(os.environ.get('SUDO_UID'))
         gid = int(os.environ.get('SUDO_GID'))
     else:
         uid = os.geteuid()
         gid = os.getegid()
-    run_cmd('chown {uid}:{gid} {dest_dir}',
-            uid=uid, gid=gid, dest_dir=dest_dir,
-            _tmp_script=True)
+    try:
+        if recursive:
+            chown_tree(dest_dir, uid, gid)
+        else:
+            os.chown(dest_dir, uid, gid)
+    except OSError as e:
+        logging.warn('cannot chown {} to {}:{}: {}'.format(
+            dest_dir, uid, gid, e))
 
 
 def ensure_dir(path):
@@ -0,0 +1,114 @@
+import time
+import socket
+import logging
+from urllib2 import HTTPError, URLError
+
+import bunch
+
+POOL_SIZE = 32
+
+
+class HttpResponse(object):
+    """urllib2 like view of a streamed requests response, so callers of
+    jenkins_open_ex keep using read()/info()/headers/close().
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self.code = response.status_code
+        self.headers = response.headers
+        self.url = response.url
+
+    def read(self, size=None):
+        return self._response.raw.read(size, decode_content=True)
+
+    def iter_lines(self, chunk_size=64 * 1024):
+        return self._response.iter_lines(chunk_size=chunk_size)
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.code
+
+    def close(self):
+        self._response.close()
+
+
+class HttpSession(object):
+    """Keep-alive connection pool of one jenkins server.
+
+    Thread safe, shared by the api calls, console streaming and the
+    artifacts ThreadRun workers. Authorization is set once on the
+    session; cookies persist so the jenkins crumb stays valid.
+    Metrics hooks are called after every response with Bunch of
+    method/url/status/elapsed and opened/reused connections totals.
+    """
+
+    def __init__(self, auth=None, timeout=None, pool_size=POOL_SIZE):
+        import requests
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        if auth:
+            self.session.headers['Authorization'] = auth
+        self.session.hooks['response'].append(self._on_response)
+        self.metrics_hooks = []
+
+    def add_metrics_hook(self, hook):
+        self.metrics_hooks.append(hook)
+
+    def connection_stats(self):
+        """opened - tcp connections created, reused - requests served
+        on already open connections
+        """
+        opened = requests_count = 0
+        for pool in self.adapter.poolmanager.pools._container.values():
+            opened += pool.num_connections
+            requests_count += pool.num_requests
+        return bunch.Bunch(opened=opened, requests=requests_count,
+                           reused=max(requests_count - opened, 0))
+
+    def _on_response(self, response, *args, **kwargs):
+        if not self.metrics_hooks:
+            return
+        event = self.connection_stats()
+        event.update(method=response.request.method,
+                     url=response.url,
+                     status=response.status_code,
+                     elapsed=response.elapsed.total_seconds())
+        for hook in self.metrics_hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                logging.warn('metrics hook {} failed: {}'.format(hook, e))
+
+    def open(self, req, timeout=None):
+        """Sends urllib2.Request, raises HTTPError on error status like
+        urllib2.urlopen does.
+        """
+        import requests
+        started = time.time()
+        try:
+            response = self.session.request(
+                req.get_method(), req.get_full_url(),
+                headers=dict(req.header_items()),
+                data=req.get_data(),
+                stream=True,
+                timeout=timeout or self.timeout)
+        except requests.Timeout as e:
+            raise socket.timeout(str(e))
+        except requests.ConnectionError as e:
+            raise URLError(e)
+        logging.debug('{} {} => {} [{:.3f}s]'.format(
+            req.get_method(), req.get_full_url(), response.status_code,
+            time.time() - started))
+        if response.status_code >= 400:
+            response.close()
+            raise HTTPError(req.get_full_url(), response.status_code,
+                            response.reason, response.headers, None)
+        return HttpResponse(response)
+
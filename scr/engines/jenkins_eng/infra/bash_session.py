@@ -0,0 +1,75 @@
+import uuid
+import pipes
+import logging
+import threading
+import subprocess
+
+from runner import CmdResult
+
+
+class BashSession(object):
+    """One long lived bash fed commands over stdin.
+
+    Every command runs in a `( ... )` subshell of the same bash, which
+    costs a fork but no exec, temp file or shell startup, so a sequence
+    of small commands pays the bash start once. Output (stdout and
+    stderr) is read up to a per command end marker which carries the
+    returncode. Commands must be complete shell snippets: an unclosed
+    quote or heredoc would swallow the marker.
+
+    with BashSession() as bash:
+        bash.run('mkdir -p out')
+        bash.run('cp a b', env={'LC_ALL': 'C'})
+    """
+
+    def __init__(self, env=None, cwd=None):
+        self.process = subprocess.Popen(
+            ['bash', '--noprofile', '--norc'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env, cwd=cwd)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _script(self, cmd, env, marker):
+        exports = ''.join('export {}={}\n'.format(k, pipes.quote(str(v)))
+                          for k, v in (env or {}).items())
+        return "(\nset -e\n{}{}\n) 2>&1 </dev/null\nprintf '\\n{} %d\\n' $?\n" \
+            .format(exports, cmd, marker)
+
+    def run(self, cmd, env=None, raise_on_err=False):
+        marker = 'JIN-END-{}'.format(uuid.uuid4().hex)
+        with self._lock:
+            if self.process.poll() is not None:
+                raise RuntimeError('bash session exited with {}'.format(
+                    self.process.returncode))
+            self.process.stdin.write(self._script(cmd, env, marker))
+            self.process.stdin.flush()
+            lines = []
+            while True:
+                line = self.process.stdout.readline()
+                if not line:
+                    raise RuntimeError('bash session exited while running '
+                                       '{}'.format(cmd))
+                if line.startswith(marker):
+                    returncode = int(line.split()[1])
+                    break
+                lines.append(line)
+        output = ''.join(lines).decode('utf-8', 'replace').strip()
+        logging.debug('bash session: {} => {}'.format(cmd, returncode))
+        if raise_on_err and returncode != 0:
+            raise RuntimeError(
+                'Error running command: {}. Return code: {}, Error: {}'.format(
+                    cmd, returncode, output))
+        return CmdResult(returncode=returncode, output=output, clean=False)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
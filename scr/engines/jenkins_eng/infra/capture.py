@@ -0,0 +1,219 @@
+import os
+import Queue
+import logging
+import tempfile
+import threading
+from collections import deque
+
+TAIL_LINES = 2000
+SPILL_BYTES = 1024 * 1024
+MAX_LOG_BYTES = 256 * 1024 * 1024
+LINES_QUEUE_SIZE = 1000
+READ_SIZE = 64 * 1024
+
+_EOF = object()
+
+
+class RollingLog(object):
+    """Append only log file, rotated to <path>.1 when it grows above
+    max_bytes, so at most 2 * max_bytes of disk is used.
+    keep - leave the files on close, by default only a given path is
+    kept and a temp file made for path None is removed
+    """
+
+    def __init__(self, path=None, max_bytes=MAX_LOG_BYTES, keep=None):
+        if keep is None:
+            keep = path is not None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='jin-', suffix='.log')
+            os.close(fd)
+        self.path = path
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self._fd = open(path, 'ab')
+        self._size = self._fd.tell()
+
+    def write(self, data):
+        if self._size + len(data) > self.max_bytes:
+            self._fd.close()
+            os.rename(self.path, self.path + '.1')
+            self._fd = open(self.path, 'ab')
+            self._size = 0
+        self._fd.write(data)
+        self._size += len(data)
+
+    def close(self):
+        self._fd.close()
+        if not self.keep:
+            for path in [self.path, self.path + '.1']:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+class OutputCapture(object):
+    """Drains stdout and stderr of a process concurrently.
+
+    One thread per pipe, so a chatty stderr can't block the child while
+    stdout is read. Each stream keeps only a tail of lines in memory.
+    Stdout lines are also kept whole in memory up to SPILL_BYTES and
+    then spill to a RollingLog on disk, removed by wait() unless
+    keep_log (or a log_path is given).
+    skip - predicate of stdout lines to drop (e.g. bash -x traces)
+    on_line - called with (stream name, line) for every line
+    stream - makes lines available through iter_lines()
+    """
+
+    def __init__(self, process, tail_lines=TAIL_LINES, log_path=None,
+                 skip=None, on_line=None, stream=False, keep_log=None):
+        self.process = process
+        self.log_path = log_path
+        self.keep_log = keep_log
+        self.skip = skip
+        self.on_line = on_line
+        self.tails = {'out': deque(maxlen=tail_lines),
+                      'err': deque(maxlen=tail_lines)}
+        self.lines_count = {'out': 0, 'err': 0}
+        self.log = None
+        self._buffer = []
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue(LINES_QUEUE_SIZE) if stream else None
+        self._aborted = False
+        # stderr is None when it is merged into stdout
+        self._threads = [
+            self._start_reader(name, pipe)
+            for name, pipe in [('out', process.stdout),
+                               ('err', process.stderr)]
+            if pipe is not None]
+        self._open_pipes = len(self._threads)
+
+    def _start_reader(self, name, pipe):
+        thread = threading.Thread(target=self._drain, args=(name, pipe),
+                                  name='jin-capture-{}'.format(name))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _drain(self, name, pipe):
+        # os.read returns what the pipe has, up to READ_SIZE: whole
+        # chunks instead of the byte per syscall of an unbuffered readline
+        fd = pipe.fileno()
+        rest = b''
+        try:
+            for chunk in iter(lambda: os.read(fd, READ_SIZE), b''):
+                end = chunk.rfind(b'\n')
+                if end < 0:
+                    rest += chunk
+                    continue
+                self._add(name, rest + chunk[:end])
+                rest = chunk[end + 1:]
+            if rest:
+                self._add(name, rest)
+        finally:
+            pipe.close()
+            if self._queue is not None:
+                self._queue.put((name, _EOF))
+
+    def _add(self, name, data):
+        """data - complete lines without the last line break"""
+        if self._aborted:
+            return
+        lines = data.decode('utf-8', 'replace').split(u'\n')
+        lines = [line[:-1] if line.endswith(u'\r') else line
+                 for line in lines]
+        if name == 'out' and self.skip:
+            lines = [line for line in lines if not self.skip(line)]
+        if not lines:
+            return
+        self.tails[name].extend(lines)
+        self.lines_count[name] += len(lines)
+        if name == 'out':
+            self._keep(lines)
+        if self.on_line:
+            for line in lines:
+                self.on_line(name, line)
+        if self._queue is not None:
+            for line in lines:
+                if self._aborted:
+                    break
+                self._queue.put((name, line))
+
+    def _keep(self, lines):
+        data = u'\n'.join(lines).encode('utf-8') + b'\n'
+        with self._lock:
+            if self._aborted:
+                return
+            if self.log is not None:
+                self.log.write(data)
+                return
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered > SPILL_BYTES:
+                self.log = RollingLog(self.log_path, keep=self.keep_log)
+                self.log.write(b''.join(self._buffer))
+                self._buffer = []
+                logging.debug('output of {} spilled to {}'.format(
+                    self.process.pid, self.log.path))
+
+    def iter_lines(self, streams=('out',)):
+        """Yields lines of streams as they arrive until the pipes close"""
+        if self._queue is None:
+            raise ValueError('capture was not created with stream=True')
+        while self._open_pipes:
+            try:
+                # timeout keeps Ctrl-C working while waiting
+                name, line = self._queue.get(True, 0.5)
+            except Queue.Empty:
+                continue
+            if line is _EOF:
+                self._open_pipes -= 1
+            elif name in streams:
+                yield line
+
+    def wait(self):
+        """Waits for the process and its pipes, returns the returncode"""
+        if self._queue is not None:
+            # drop what nobody consumed so the readers never block
+            for _ in self.iter_lines():
+                pass
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(0.5)
+        returncode = self.process.wait()
+        if self.log is not None:
+            self.log.close()
+        return returncode
+
+    def abort(self):
+        """Kills the process when its output isn't wanted any more (e.g.
+        an abandoned iter_lines) and releases the readers and the log.
+        """
+        self._aborted = True
+        if self.process.poll() is None:
+            self.process.kill()
+        if self._queue is not None:
+            # a reader may be blocked on the full queue
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except Queue.Empty:
+                    break
+        self.process.wait()
+        with self._lock:
+            if self.log is not None:
+                self.log.close()
+
+    @property
+    def truncated(self):
+        return self.log is not None
+
+    @property
+    def output(self):
+        """stdout if kept whole in memory, else its tail"""
+        if self.log is None:
+            return b''.join(self._buffer).decode('utf-8')
+        return u'\n'.join(self.tails['out'])
+
+    @property
+    def errors(self):
+        return u'\n'.join(self.tails['err'])
@@ -0,0 +1,339 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+import bunch
+
+CHUNK_SIZE = 1024 * 1024
+PART_SUFFIX = '.part'
+SEGMENTED_SUFFIX = '.seg.part'
+CORRUPT_SUFFIX = '.corrupt'
+# artifacts from this size are fetched as concurrent Range segments
+SEGMENTED_MIN_SIZE = 64 * 1024 * 1024
+SEGMENTS = 8
+MAX_RETRIES = 5
+RETRY_DELAY = 2.0
+POOL_SIZE = 32
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _make_session(pool_size=POOL_SIZE):
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def shared_session():
+    """One keep-alive session per process, shared by all the threads
+    of a ThreadRun so artifact downloads reuse connections.
+    """
+    pid = os.getpid()
+    with _shared_lock:
+        if pid not in _shared:
+            _shared.clear()
+            _shared[pid] = _make_session()
+        return _shared[pid]
+
+
+def _retriable_errors():
+    import requests
+    return (requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            IncompleteSegment)
+
+
+def head_info(url, session=None, timeout=None):
+    """Returns (size, accepts_ranges) without downloading the body.
+    size is None when the server doesn't send Content-Length.
+    """
+    session = session or shared_session()
+    rs = session.head(url, allow_redirects=True, timeout=timeout)
+    rs.raise_for_status()
+    length = rs.headers.get('Content-Length')
+    size = int(length) if length is not None else None
+    accepts_ranges = rs.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    return size, accepts_ranges
+
+
+class Digests(object):
+    """md5 (what jenkins fingerprints are) and sha1 (the artifacts cache
+    key) of the bytes written so far, updated chunk by chunk.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.md5 = hashlib.md5()
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+
+    def update(self, data):
+        self.md5.update(data)
+        self.sha1.update(data)
+        self.size += len(data)
+
+    def update_from_file(self, path, limit=None, chunk_size=CHUNK_SIZE):
+        left = os.path.getsize(path) if limit is None else limit
+        with open(path, 'rb') as fd:
+            while left > 0:
+                data = fd.read(min(chunk_size, left))
+                if not data:
+                    break
+                self.update(data)
+                left -= len(data)
+
+
+def _part_size(part_path):
+    if os.path.exists(part_path):
+        return os.path.getsize(part_path)
+    return 0
+
+
+def _fetch_into_part(session, url, part_path, offset, accepts_ranges,
+                     chunk_size, timeout, digests):
+    """Streams url into part_path starting at offset, feeding digests.
+    returns number of bytes written by this call.
+    """
+    headers = {}
+    if offset and accepts_ranges:
+        headers['Range'] = 'bytes={}-'.format(offset)
+    rs = session.get(url, headers=headers, stream=True, timeout=timeout)
+    try:
+        rs.raise_for_status()
+        if rs.status_code == 206:
+            mode = 'ab'
+        else:
+            # server ignored the range: start from scratch
+            mode = 'wb'
+            digests.reset()
+        written = 0
+        with open(part_path, mode) as fd:
+            for chunk in rs.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    fd.write(chunk)
+                    digests.update(chunk)
+                    written += len(chunk)
+        return written
+    finally:
+        rs.close()
+
+
+class RangesUnsupported(Exception):
+    pass
+
+
+class IncompleteSegment(IOError):
+    """a range response ended before the end of the range"""
+
+
+def _fetch_segment(session, url, path, segment, chunk_size, retries,
+                   timeout):
+    """Fetches bytes [start, end] of url into the same offsets of path,
+    retrying from where an interrupted attempt stopped.
+    """
+    start, end = segment.start, segment.end
+    attempt = 0
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        while start <= end:
+            headers = {'Range': 'bytes={}-{}'.format(start, end)}
+            try:
+                rs = session.get(url, headers=headers, stream=True,
+                                 timeout=timeout)
+                try:
+                    rs.raise_for_status()
+                    if rs.status_code != 206:
+                        raise RangesUnsupported(url)
+                    # own fd per segment, so seek + write is positional
+                    os.lseek(fd, start, os.SEEK_SET)
+                    for chunk in rs.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            chunk = chunk[:end + 1 - start]
+                            os.write(fd, chunk)
+                            start += len(chunk)
+                            segment.written += len(chunk)
+                    if start <= end:
+                        raise IncompleteSegment(
+                            'range response ended {} bytes short'.format(
+                                end + 1 - start))
+                finally:
+                    rs.close()
+            except _retriable_errors() as e:
+                logging.warn('segment {}-{} of {} interrupted: {}'.format(
+                    start, end, url, e))
+                attempt += 1
+                if attempt > retries:
+                    raise
+                time.sleep(RETRY_DELAY * attempt)
+    finally:
+        os.close(fd)
+
+
+def segmented_download(src, dst, size, session=None, segments=SEGMENTS,
+                       chunk_size=CHUNK_SIZE, retries=MAX_RETRIES,
+                       timeout=None):
+    """Downloads src of known size as concurrent HTTP Range segments into
+    a preallocated dst.seg.part file, renamed into place once every
+    segment is complete and the file size matches.
+    raises RangesUnsupported when the server answers a range with 200.
+    """
+    session = session or shared_session()
+    part_path = dst + SEGMENTED_SUFFIX
+    segment_size = -(-size // segments)
+    parts = [bunch.Bunch(start=start,
+                         end=min(start + segment_size, size) - 1,
+                         written=0, error=None)
+             for start in range(0, size, segment_size)]
+    with open(part_path, 'wb') as fd:
+        fd.truncate(size)
+
+    def run(segment):
+        try:
+            _fetch_segment(session, src, part_path, segment, chunk_size,
+                           retries, timeout)
+        except Exception as e:
+            segment.error = e
+
+    threads = [threading.Thread(target=run, args=(segment,),
+                                name='jin-segment-{}'.format(segment.start))
+               for segment in parts]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.5)
+
+    errors = [segment.error for segment in parts if segment.error]
+    written = sum(segment.written for segment in parts)
+    local_size = _part_size(part_path)
+    if not errors and (written != size or local_size != size):
+        errors.append(IOError(
+            'size mismatch for {}: expected {} got {} ({} written)'.format(
+                src, size, local_size, written)))
+    if errors:
+        os.remove(part_path)
+        unsupported = [e for e in errors if isinstance(e, RangesUnsupported)]
+        raise unsupported[0] if unsupported else errors[0]
+    os.rename(part_path, dst)
+    return written, len(parts)
+
+
+def verify_result(result, md5, sha1, expected_md5):
+    """Adds md5/sha1 to result and checks md5 against expected_md5. A
+    mismatching file is moved aside to dst.corrupt.
+    """
+    result.md5 = md5
+    result.sha1 = sha1
+    result.verified = None
+    if expected_md5:
+        result.verified = result.md5 == expected_md5.lower()
+        if not result.verified:
+            os.rename(result.dst, result.dst + CORRUPT_SUFFIX)
+            logging.error('{}: md5 {} does not match fingerprint {}, '
+                          'kept as {}'.format(result.src, result.md5,
+                                              expected_md5,
+                                              result.dst + CORRUPT_SUFFIX))
+    return result
+
+
+def stream_download(src, dst, session=None,
+                    chunk_size=CHUNK_SIZE, retries=MAX_RETRIES,
+                    timeout=None, segments=SEGMENTS,
+                    segmented_min_size=SEGMENTED_MIN_SIZE,
+                    expected_md5=None):
+    """Downloads src into dst through a dst.part file.
+
+    Resumes an existing .part file with an HTTP Range request when the
+    server supports it, and renames into place only once complete.
+    Files from segmented_min_size are fetched with segmented_download
+    when the server accepts ranges, falling back to a single stream if
+    it turns out it doesn't.
+    md5 and sha1 are computed while the data streams in (segments arrive
+    out of order, so those are hashed once complete) and md5 is checked
+    against expected_md5 (a jenkins fingerprint) when given.
+    returns Bunch with byte counts, throughput, md5, sha1 and verified.
+    """
+    session = session or shared_session()
+    part_path = dst + PART_SUFFIX
+    size, accepts_ranges = head_info(src, session=session, timeout=timeout)
+
+    started = time.time()
+    # an existing .part is resumed as a single stream instead
+    if accepts_ranges and size is not None and segments > 1 and \
+            size >= segmented_min_size and not os.path.exists(part_path):
+        try:
+            transferred, used = segmented_download(
+                src, dst, size, session=session, segments=segments,
+                chunk_size=chunk_size, retries=retries, timeout=timeout)
+            elapsed = time.time() - started
+            digests = Digests()
+            digests.update_from_file(dst)
+            return verify_result(bunch.Bunch(
+                src=src, dst=dst, size=size, transferred=transferred,
+                resumed=False, segments=used, elapsed=elapsed,
+                throughput=transferred / elapsed if elapsed > 0 else 0.0),
+                digests.md5.hexdigest(), digests.sha1.hexdigest(),
+                expected_md5)
+        except RangesUnsupported:
+            logging.warn('{} ignores ranges, downloading as one '
+                         'stream'.format(src))
+            accepts_ranges = False
+
+    transferred = 0
+    resumed = False
+    attempt = 0
+    digests = Digests()
+    while True:
+        offset = _part_size(part_path)
+        if not accepts_ranges:
+            offset = 0
+        if digests.size != offset:
+            # a .part left by an earlier run: hash what it already has
+            digests.reset()
+            digests.update_from_file(part_path, offset)
+        if size is not None and offset == size:
+            break
+        if offset:
+            resumed = True
+            logging.info('resuming {} at {} bytes'.format(src, offset))
+        try:
+            transferred += _fetch_into_part(
+                session, src, part_path, offset, accepts_ranges,
+                chunk_size, timeout, digests)
+            if size is None or _part_size(part_path) >= size:
+                break
+        except _retriable_errors() as e:
+            logging.warn('retrieve {} interrupted: {}'.format(src, e))
+        attempt += 1
+        if attempt > retries:
+            raise IOError('failed to download {} after {} retries'.format(
+                src, retries))
+        time.sleep(RETRY_DELAY * attempt)
+
+    local_size = _part_size(part_path)
+    if size is not None and local_size != size:
+        raise IOError('size mismatch for {}: expected {} got {}'.format(
+            src, size, local_size))
+    os.rename(part_path, dst)
+
+    elapsed = time.time() - started
+    return verify_result(bunch.Bunch(
+        src=src,
+        dst=dst,
+        size=local_size,
+        transferred=transferred,
+        resumed=resumed,
+        segments=1,
+        elapsed=elapsed,
+        throughput=transferred / elapsed if elapsed > 0 else 0.0
+    ), digests.md5.hexdigest(), digests.sha1.hexdigest(), expected_md5)
@@ -1,11 +1,19 @@
 import os
+import re
+import time
+import errno
+import Queue
 import bunch
 import shlex
 import logging
+import threading
 import subprocess
 import tempfile
 import multiprocessing
 import signal
+import collections
+
+from capture import OutputCapture
 
 
 class Command(object):
@@ -15,16 +23,64 @@ class Command(object):
     def run(self, **kwargs):
         raise NotImplementedError()
 
+# anything a plain argv can't express: expansions, redirections, pipes,
+# lists, globs, comments and line continuations
+SHELL_CHARS = re.compile(r'[|&;<>()$`\\*?\[\]#~{}!\n]')
+SHELL_BUILTINS = frozenset([
+    '.', 'alias', 'cd', 'eval', 'exec', 'exit', 'export', 'read',
+    'set', 'source', 'trap', 'ulimit', 'umask', 'unset', 'wait'])
+
+
+def is_simple_command(cmd):
+    """True when cmd can be exec'ed as argv without a shell"""
+    if SHELL_CHARS.search(cmd):
+        return False
+    try:
+        argv = shlex.split(cmd)
+    except ValueError:
+        return False
+    return bool(argv) and argv[0] not in SHELL_BUILTINS \
+        and '=' not in argv[0]
+
+
+# what sh searches when the env has no PATH
+SH_DEFAULT_PATH = '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin'
+
+
+def find_executable(name, env):
+    """Resolves name like sh would for a command run with env: through
+    env PATH, else the PATH of jin followed by the sh default. Returns
+    name unchanged when not found, exec then fails as usual.
+    """
+    if '/' in name:
+        return name
+    path = env.get('PATH') or os.pathsep.join(
+        p for p in [os.environ.get('PATH'), SH_DEFAULT_PATH] if p)
+    for directory in path.split(os.pathsep):
+        candidate = os.path.join(directory or '.', name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return name
+
+
+def _is_bash_debug_line(line):
+    return line.startswith('+ ')
+
+
 def _clean_bash_debug_output(text):
     return "\n".join(
         line for line in text.split('\n')
-        if not line.startswith('+ '))
+        if not _is_bash_debug_line(line))
 
 
 class CmdResult(object):
-    def __init__(self, returncode, output):
+    """output - whole output, or its tail when log_path is set (the
+    full output is then in the log_path file, see run_local _keep_log)
+    """
+    def __init__(self, returncode, output, log_path=None, clean=True):
         self.returncode = returncode
-        self.output = _clean_bash_debug_output(output)
+        self.output = _clean_bash_debug_output(output) if clean else output
+        self.log_path = log_path
 
     def readlines(self, pattern=None):
         return [x.strip() for x in self.output.split('\n') if x.strip()]
@@ -43,7 +99,7 @@ class CmdResult(object):
 class AsyncReslut(object):
     """docstring for AsyncReslut"""
     def __init__(self, process, commands, ret_codes=0, log_output=None,
-                 cleanup=None):
+                 cleanup=None, stream=False, keep_log=False):
         self.process = process
         self.commands = commands
         self.cleanup = cleanup or (lambda: None)
@@ -56,6 +112,12 @@ class AsyncReslut(object):
         if not log_output and logging.getLogger().level <= logging.DEBUG:
             log_output = True
         self.log_output = log_output
+        self.capture = OutputCapture(
+            process,
+            skip=_is_bash_debug_line,
+            on_line=self._log_line if log_output else None,
+            stream=stream,
+            keep_log=keep_log)
 
     @property
     def _get_log_prefix(self):
@@ -67,29 +129,22 @@ class AsyncReslut(object):
             prefix = None
         return prefix
 
-    def _comunicate_log_output(self):
-        process = self.process
-        prefix = self._get_log_prefix
-        output_log = []
-        while True:
-            output = process.stdout.readline()  # read(100) # readline()
-            if not output and process.poll() is not None:
-                break
-            if output:
-                _out = output.decode('ascii').strip()
-                logging.debug("{}{}".format(prefix, _out))
-                output_log.append(_out)
-        out = "\n".join(output_log)
-        err = process.stderr.read()
-        return out, err
+    def _log_line(self, stream, line):
+        logging.debug("{}{}".format(self._get_log_prefix, line))
+
+    def iter_lines(self):
+        """Yields stdout lines while the process runs (stream=True)"""
+        return self.capture.iter_lines()
+
+    def abort(self):
+        """Kills the process, its output is dropped"""
+        self.capture.abort()
+        self.cleanup()
 
     def communicate_local(self):
-        if self.log_output:
-            out, err = self._comunicate_log_output()
-        else:
-            out, err = self.process.communicate()
+        returncode = self.capture.wait()
         self.cleanup()
-        return out.strip(), err, self.process.returncode
+        return self.capture.output.strip(), self.capture.errors, returncode
 
     def get(self, raise_on_err=True):
         output, errors, returncode = self.communicate_local()
@@ -98,11 +153,44 @@ class AsyncReslut(object):
                 'Error running command: {}. Return code: {}, Error: {}'.format(
                     self.commands, returncode, errors))
         
-        res = CmdResult(returncode=returncode, output=output)
+        log = self.capture.log
+        res = CmdResult(returncode=returncode, output=output,
+                        log_path=log.path if log and log.keep else None,
+                        clean=False)
         return res
 
 
+class StartFailed(object):
+    """AsyncReslut of a command which couldn't be exec'ed, with the
+    returncode sh gives: 127 not found, 126 not executable.
+    """
+    def __init__(self, commands, error, ret_codes=0, cleanup=None):
+        self.commands = commands
+        self.returncode = 127 if error.errno == errno.ENOENT else 126
+        self.errors = '{}: {}'.format(
+            commands if isinstance(commands, basestring) else commands[0],
+            error.strerror)
+        if not hasattr(ret_codes, '__getitem__'):
+            ret_codes = [ret_codes]
+        self.ret_codes = ret_codes
+        (cleanup or (lambda: None))()
+
+    def iter_lines(self):
+        return iter([])
+
+    def communicate_local(self):
+        return '', self.errors, self.returncode
+
+    def get(self, raise_on_err=True):
+        if raise_on_err and self.returncode not in self.ret_codes:
+            raise RuntimeError(
+                'Error running command: {}. Return code: {}, Error: {}'.format(
+                    self.commands, self.returncode, self.errors))
+        return CmdResult(returncode=self.returncode, output='', clean=False)
+
+
 def run_local(cmds, _log_output=False, _ret_codes=0, _cleanup=None,
+              _stream=False, _merge_stderr=False, _keep_log=False,
               **kwargs):
     if isinstance(cmds, basestring):
         commands = cmds
@@ -112,17 +200,26 @@ def run_local(cmds, _log_output=False, _ret_codes=0, _cleanup=None,
 
     logging.debug('run local: {} with {}'.format(commands, kwargs))
 
-    process = subprocess.Popen(
-        commands,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        **kwargs)
+    try:
+        process = subprocess.Popen(
+            commands,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if _merge_stderr else subprocess.PIPE,
+            **kwargs)
+    except OSError as e:
+        if e.errno not in (errno.ENOENT, errno.EACCES):
+            raise
+        logging.debug('cannot exec {}: {}'.format(commands, e))
+        return StartFailed(commands, e, ret_codes=_ret_codes,
+                           cleanup=_cleanup)
 
     async_result = AsyncReslut(
         process, commands,
         log_output=_log_output,
         ret_codes=_ret_codes,
-        cleanup=_cleanup)
+        cleanup=_cleanup,
+        stream=_stream,
+        keep_log=_keep_log)
     return async_result
 
 
@@ -189,6 +286,7 @@ class Runner(object):
         _tmp_script = rest.pop('_tmp_script', False)
         _split = rest.pop('_split', None)
         _raise = rest.pop('_raise', False)
+        _fast = rest.pop('_fast', None)
         if _split and _tmp_script:
             raise ValueError('both _split and _tmp_script cannot be True')
 
@@ -200,35 +298,87 @@ class Runner(object):
             _split=_split,
             _tmp_script=_tmp_script,
             total_env=total_env,
-            _raise=_raise
+            _raise=_raise,
+            _fast=_fast
         ), rest
 
     def run(self, cmd_tml, *args, **kwargs):
+        run_params, async_result = self._start(cmd_tml, args, kwargs)
+        if async_result is None:
+            return run_params.dry_result
+        res = async_result.get(raise_on_err=run_params._raise)
+        return res
+
+    def run_lines(self, cmd_tml, *args, **kwargs):
+        """Like run, but yields output lines while the command runs
+        instead of returning them at the end.
+        """
+        kwargs['_stream'] = True
+        run_params, async_result = self._start(cmd_tml, args, kwargs)
+        if async_result is None:
+            yield run_params.dry_result.output
+            return
+        finished = False
+        try:
+            for line in async_result.iter_lines():
+                yield line
+            finished = True
+        finally:
+            if not finished:
+                # abandoned (close() or garbage collected) before the end
+                async_result.abort()
+        async_result.get(raise_on_err=run_params._raise)
+
+    def _start(self, cmd_tml, args, kwargs):
         run_params, rest = self._extract_run_params(kwargs)
         cmd_content = self._expand_cmd(cmd_tml, args, kwargs)
         cmd = cmd_content
         cleanup = None
         shell = True
 
-        if run_params._split:
+        # _fast: None - exec argv directly when no shell is needed,
+        # True - require it, False - always go through the shell
+        fast = run_params._fast
+        if fast is None:
+            fast = not run_params._split and is_simple_command(cmd_content)
+        elif fast and not is_simple_command(cmd_content):
+            raise ValueError('{} needs a shell, cannot run it fast'.format(
+                cmd_content))
+
+        if run_params._split or fast:
             cmd = shlex.split(cmd_content)
+            cmd[0] = find_executable(cmd[0], run_params.total_env)
+            shell = False
 
         if run_params.dry:
             _msg = 'dry run: with env={} opts={} will run {}'.format(
                    run_params.total_env, rest, cmd_content)
             logging.info(_msg)
-            return CmdResult(0, _msg)
+            run_params.dry_result = CmdResult(0, _msg)
+            return run_params, None
 
         self._update_cwd(rest)
-        if run_params._tmp_script:
+        if fast:
+            # the tmp script runs with 2>&1, keep stderr in the output
+            rest['_merge_stderr'] = run_params._tmp_script
+            logging.debug('exec {}'.format(cmd))
+        elif run_params._tmp_script:
             cmd, cleanup = self._create_tmp_script(
                 run_params.total_env, cmd_content)
 
         async_result = run_local(
             cmd, shell=shell, _cleanup=cleanup,
             env=run_params.total_env, **rest)
-        res = async_result.get(raise_on_err=run_params._raise)
-        return res
+        return run_params, async_result
+
+    def bash_session(self):
+        """Persistent bash with the runner env and working dir, for
+        sequences of small commands (see BashSession)
+        """
+        from bash_session import BashSession
+        opts = {}
+        self._update_cwd(opts)
+        return BashSession(env=self._expand_env(None), cwd=opts.get('cwd'))
 
     @staticmethod
     def run_cmd(cmd, *args, **kw):
@@ -244,18 +394,22 @@ class Runner(object):
         return Runner.run_cmd(cmd, **kwargs)
 
     @staticmethod
-    def run_in_parallel(cmds):
-        return ParallelRun(cmds, Runner.run_cmd)
+    def run_in_parallel(cmds, backend='thread', concurrency=None):
+        return make_multi_run(cmds, Runner.run_cmd,
+                              backend=backend, concurrency=concurrency)
 
     @staticmethod
-    def run_items_in_parallel(items):
-        return ParallelRun(items, Runner.run_item)
+    def run_items_in_parallel(items, backend='thread', concurrency=None):
+        return make_multi_run(items, Runner.run_item,
+                              backend=backend, concurrency=concurrency)
 
 
 class UrlItem(object):
-    def __init__(self, src, dst):
+    def __init__(self, src, dst, md5=None):
         self.src = src
         self.dst = dst
+        # expected content md5 (jenkins fingerprint), when known
+        self.md5 = md5
 
     def __repr__(self):
         return "{}({})".format(self.__class__.__name__, self.shortname())
@@ -263,10 +417,23 @@ class UrlItem(object):
     def shortname(self):
         return self.src.split('/')[-1]
 
-    def get_remote_size(self):
-        import urllib2
-        f = urllib2.urlopen(self.src)
-        return int(f.headers["Content-Length"])
+    def get_remote_size(self, session=None):
+        from download import head_info
+        size, _ = head_info(self.src, session=session)
+        return size
+
+
+class ArchiveItem(UrlItem):
+    """One zip of many files: src is the zip url, members maps archive
+    member names to the UrlItem of the file it holds.
+    """
+    def __init__(self, src, members):
+        super(ArchiveItem, self).__init__(src, None)
+        self.members = members
+
+    def shortname(self):
+        return '{} ({} files)'.format(super(ArchiveItem, self).shortname(),
+                                      len(self.members))
 
 
 def trace_unhandled_exceptions(func):
@@ -295,7 +462,16 @@ def run_item(item):
 
 
 class IMultiRun(object):
-    pass
+    # called once with the results list, by wait_all or at the end of a
+    # `with` block which raised nothing
+    on_done = None
+    _reported = False
+
+    def _done(self, results):
+        if self.on_done and not self._reported:
+            self._reported = True
+            self.on_done(results)
+        return results
 
 
 class ParallelRun(IMultiRun):
@@ -308,10 +484,11 @@ class ParallelRun(IMultiRun):
         signal.signal(signal.SIGINT, original_sigint_handler)
         return pool
 
-    def __init__(self, items, method=run_item, ctx=None):
+    def __init__(self, items, method=run_item, ctx=None, processes=None):
         self.items = items
         self.method = method
-        self.pool = self._make_pool(processes=self.MAX_IO_BOUND_PROCS)
+        self.pool = self._make_pool(
+            processes=processes or self.MAX_IO_BOUND_PROCS)
         self.ctx = ctx
 
     def start_all(self):
@@ -325,25 +502,76 @@ class ParallelRun(IMultiRun):
         self.pool.close()
         self.pool.join()
 
+    def terminate(self):
+        self.pool.terminate()
+
     def __enter__(self):
-        return self.start_all()
+        self._results = self.start_all()
+        return self._results
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_type and issubclass(exc_type, KeyboardInterrupt):
             logging.info("Caught KeyboardInterrupt, terminating sdfdsfsdfsdfsdfworkers")
-            self.pool.terminate()
+            self.terminate()
         self.finish_all()
+        if exc_type is None and self._results.successful():
+            self._done(self._results.get())
         return exc_type is not None
 
 
     def wait_all(self, timeout=60 * 60 * 5.0):  # hours
         with self as results:
-            return results.get(timeout)
+            return self._done(results.get(timeout))
+
+
+class ThreadRun(ParallelRun):
+    """Same as ParallelRun but on a pool of threads: no fork and no
+    pickling of items, and workers share in-process state such as the
+    keep-alive http connection pool. Use it for network bound work.
+
+    The pools are kept per size and reused by every ThreadRun, creating
+    and joining one costs about 100ms on py2. So items must not wait for
+    another ThreadRun of the same size, it may be queued behind them.
+    """
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    @staticmethod
+    def _make_pool(*args, **kwargs):
+        from multiprocessing.pool import ThreadPool
+        return ThreadPool(*args, **kwargs)
+
+    def __init__(self, items, method=run_item, ctx=None, processes=None):
+        self.items = items
+        self.method = method
+        self.processes = processes or self.MAX_IO_BOUND_PROCS
+        self.pool = self._shared_pool(self.processes)
+        self.ctx = ctx
+
+    @classmethod
+    def _shared_pool(cls, processes):
+        key = (processes, os.getpid())
+        with cls._pools_lock:
+            if key not in cls._pools:
+                cls._pools[key] = cls._make_pool(processes=processes)
+            return cls._pools[key]
+
+    def finish_all(self):
+        # the pool outlives the run, only wait for its own items
+        logging.debug('finished parallel run')
+        self._results.wait()
+
+    def terminate(self):
+        with self._pools_lock:
+            key = (self.processes, os.getpid())
+            if self._pools.get(key) is self.pool:
+                del self._pools[key]
+        self.pool.terminate()
 
 
 class SequentialRun(IMultiRun):
 
-    def __init__(self, items, method=run_item, ctx=None):
+    def __init__(self, items, method=run_item, ctx=None, processes=None):
         self.items = items
         self.method = method
 
@@ -359,13 +587,269 @@ class SequentialRun(IMultiRun):
         logging.debug('finished parallel run')
 
     def __enter__(self):
-        return self.start_all()
+        self._results = self.start_all()
+        return self._results
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_type and issubclass(exc_type, KeyboardInterrupt):
             logging.info("Caught KeyboardInterrupt, terminating workers")
         self.finish_all()
+        if exc_type is None:
+            self._done(self._results)
         return exc_type is not None
 
     def wait_all(self, timeout=60 * 60 * 5.0):  # hours
-        return self.start_all()
+        return self._done(self.start_all())
+
+
+MULTI_RUN_BACKENDS = {
+    'process': ParallelRun,
+    'thread': ThreadRun,
+    'sequential': SequentialRun,
+}
+
+
+def make_multi_run(items, method=run_item, ctx=None,
+                   backend='thread', concurrency=None):
+    try:
+        klass = MULTI_RUN_BACKENDS[backend]
+    except KeyError:
+        raise ValueError('unknown backend {}, choose from {}'.format(
+            backend, sorted(MULTI_RUN_BACKENDS)))
+    return klass(items, method, ctx=ctx, processes=concurrency)
+
+
+
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def shared_pool(backend='process'):
+    """Worker pool of cpu count workers, created once per process and
+    backend and reused by every DagRun instead of a pool per call.
+    """
+    key = (backend, os.getpid())
+    with _shared_pools_lock:
+        if key not in _shared_pools:
+            klass = MULTI_RUN_BACKENDS[backend]
+            _shared_pools[key] = klass._make_pool(
+                processes=multiprocessing.cpu_count())
+        return _shared_pools[key]
+
+
+def _run_dag_command(command):
+    """pool worker: returns (ok, result or traceback text, started, finished)
+    so failures and timings cross the process boundary without raising.
+    """
+    import traceback
+    started = time.time()
+    try:
+        if isinstance(command, Command):
+            result = command.run()
+        else:
+            result = command()
+        ok = getattr(result, 'returncode', 0) == 0
+    except Exception:
+        result = traceback.format_exc()
+        ok = False
+    return ok, result, started, time.time()
+
+
+class DagNode(object):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, name, command, deps=()):
+        self.name = name
+        self.command = command
+        self.deps = list(deps)
+        self.state = self.PENDING
+        self.result = None
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return "{}({}, {})".format(self.__class__.__name__, self.name,
+                                   self.state)
+
+    @property
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+class DagRun(IMultiRun):
+    """Runs Command objects (or picklable callables) in dependency order.
+
+    Nodes whose deps are done are submitted to the shared pool at once,
+    results are yielded by iter_results() as nodes finish. When a node
+    fails (non zero returncode or exception) everything downstream of it
+    is cancelled, independent branches keep running. With the process
+    backend commands must be picklable (ShellCommand is).
+
+    dag = DagRun()
+    dag.add('deps', ShellCommand('make deps'))
+    dag.add('build', ShellCommand('make'), deps=['deps'])
+    report = dag.wait_all()
+    """
+
+    def __init__(self, backend='process', pool=None):
+        self.backend = backend
+        self.pool = pool
+        self.nodes = collections.OrderedDict()
+        self.started = None
+        self.finished = None
+
+    def add(self, name, command, deps=()):
+        if name in self.nodes:
+            raise ValueError('node {} already added'.format(name))
+        node = DagNode(name, command, deps)
+        self.nodes[name] = node
+        return node
+
+    def _downstream(self):
+        downstream = {name: [] for name in self.nodes}
+        for node in self.nodes.values():
+            for dep in node.deps:
+                if dep not in self.nodes:
+                    raise ValueError('{} depends on unknown node {}'.format(
+                        node.name, dep))
+                downstream[dep].append(node.name)
+        return downstream
+
+    def topological_order(self):
+        downstream = self._downstream()
+        missing = {name: len(node.deps) for name, node in self.nodes.items()}
+        ready = [name for name, count in missing.items() if not count]
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for child in downstream[name]:
+                missing[child] -= 1
+                if not missing[child]:
+                    ready.append(child)
+        if len(order) != len(self.nodes):
+            raise ValueError('dependency cycle between {}'.format(
+                sorted(set(self.nodes) - set(order))))
+        return order
+
+    def _cancel_downstream(self, name, downstream):
+        cancelled = []
+        stack = list(downstream[name])
+        while stack:
+            child = self.nodes[stack.pop()]
+            if child.state == DagNode.PENDING:
+                child.state = DagNode.CANCELLED
+                child.result = 'cancelled: {} failed'.format(name)
+                cancelled.append(child)
+                stack.extend(downstream[child.name])
+        return cancelled
+
+    def iter_results(self, timeout=None):
+        """Yields nodes as they finish, fail or get cancelled.
+        timeout - seconds for the whole run, then multiprocessing
+        TimeoutError is raised; nodes already running aren't stopped.
+        """
+        self.topological_order()
+        downstream = self._downstream()
+        pool = self.pool or shared_pool(self.backend)
+        finished = Queue.Queue()
+        running = {}
+
+        def submit(node):
+            node.state = DagNode.RUNNING
+            running[node.name] = pool.apply_async(
+                _run_dag_command, (node.command,),
+                callback=lambda res: finished.put((node, res)))
+
+        def put_pool_errors():
+            # the pool skips the callback when it fails to pickle the
+            # command or the result (py2 has no error_callback)
+            for name, async_result in running.items():
+                if async_result.ready() and not async_result.successful():
+                    try:
+                        async_result.get(0)
+                    except Exception as e:
+                        now = time.time()
+                        finished.put((self.nodes[name], (
+                            False, 'pool error: {!r}'.format(e), now, now)))
+
+        def is_ready(node):
+            return node.state == DagNode.PENDING and all(
+                self.nodes[dep].state == DagNode.DONE for dep in node.deps)
+
+        self.started = time.time()
+        logging.info('started dag run with {} nodes'.format(len(self.nodes)))
+        for node in self.nodes.values():
+            if is_ready(node):
+                submit(node)
+        while running:
+            if timeout and time.time() - self.started > timeout:
+                raise multiprocessing.TimeoutError(
+                    'dag run timed out after {}s, running: {}'.format(
+                        timeout, sorted(running)))
+            try:
+                # timeout keeps Ctrl-C working while waiting
+                node, (ok, result, started, ended) = finished.get(True, 0.5)
+            except Queue.Empty:
+                put_pool_errors()
+                continue
+            del running[node.name]
+            node.result, node.started, node.finished = result, started, ended
+            node.state = DagNode.DONE if ok else DagNode.FAILED
+            logging.debug('dag node {} {} in {:.3f}s'.format(
+                node.name, node.state, node.duration))
+            yield node
+            if ok:
+                for name in downstream[node.name]:
+                    if is_ready(self.nodes[name]):
+                        submit(self.nodes[name])
+            else:
+                logging.error('dag node {} failed: {}'.format(
+                    node.name, result))
+                for cancelled in self._cancel_downstream(node.name,
+                                                         downstream):
+                    yield cancelled
+        self.finished = time.time()
+
+    def critical_path(self):
+        """longest chain of finished nodes by duration: (names, seconds)"""
+        total = {}
+        previous = {}
+        for name in self.topological_order():
+            node = self.nodes[name]
+            best = max(node.deps, key=lambda dep: total[dep]) \
+                if node.deps else None
+            total[name] = node.duration + (total[best] if best else 0.0)
+            previous[name] = best
+        if not total:
+            return [], 0.0
+        name = max(total, key=total.get)
+        seconds = total[name]
+        path = []
+        while name:
+            path.append(name)
+            name = previous[name]
+        return list(reversed(path)), seconds
+
+    def report(self):
+        path, seconds = self.critical_path()
+        return bunch.Bunch(
+            ok=all(node.state == DagNode.DONE
+                   for node in self.nodes.values()),
+            wall=(self.finished or time.time()) - (self.started or time.time()),
+            critical_path=path,
+            critical_seconds=seconds,
+            nodes=[bunch.Bunch(name=node.name, state=node.state,
+                               duration=node.duration)
+                   for node in self.nodes.values()])
+
+    def wait_all(self, timeout=None):
+        for _ in self.iter_results(timeout):
+            pass
+        return self._done(self.report())
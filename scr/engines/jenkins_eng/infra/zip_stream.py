@@ -0,0 +1,204 @@
+import os
+import zlib
+import struct
+import hashlib
+
+import bunch
+
+CHUNK_SIZE = 64 * 1024
+
+LOCAL_HEADER = 0x04034b50
+DATA_DESCRIPTOR = 0x08074b50
+CENTRAL_HEADER = 0x02014b50
+END_OF_CENTRAL = 0x06054b50
+ZIP64_EXTRA = 0x0001
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+STORED = 0
+DEFLATED = 8
+UINT32_MAX = 0xffffffff
+
+
+class ZipStreamError(Exception):
+    pass
+
+
+class _Sink(object):
+    """Output file of a member, hashed as it is written"""
+
+    def __init__(self, path):
+        self.fd = open(path, 'wb')
+        self.md5 = hashlib.md5()
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data):
+        self.fd.write(data)
+        self.md5.update(data)
+        self.sha1.update(data)
+
+    def close(self):
+        self.fd.close()
+
+
+class _Reader(object):
+    """Reads exact sizes from a non seekable stream, with push back of
+    bytes read past the end of a deflated entry.
+    """
+
+    def __init__(self, fileobj, chunk_size):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.buffer = b''
+
+    def read_some(self):
+        if self.buffer:
+            data, self.buffer = self.buffer, b''
+            return data
+        data = self.fileobj.read(self.chunk_size)
+        if not data:
+            raise ZipStreamError('truncated zip stream')
+        return data
+
+    def read_exact(self, size):
+        parts = []
+        while size > 0:
+            data = self.read_some()
+            if len(data) > size:
+                self.unread(data[size:])
+                data = data[:size]
+            parts.append(data)
+            size -= len(data)
+        return b''.join(parts)
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+
+
+def _zip64_sizes(extra, csize, usize):
+    """sizes from the zip64 extra field, for the fields set to 0xffffffff"""
+    pos = 0
+    while pos + 4 <= len(extra):
+        field_id, length = struct.unpack('<HH', extra[pos:pos + 4])
+        if field_id == ZIP64_EXTRA:
+            values = extra[pos + 4:pos + 4 + length]
+            if usize == UINT32_MAX:
+                usize = struct.unpack('<Q', values[:8])[0]
+                values = values[8:]
+            if csize == UINT32_MAX:
+                csize = struct.unpack('<Q', values[:8])[0]
+            return csize, usize, True
+        pos += 4 + length
+    return csize, usize, False
+
+
+def _copy_entry(reader, name, method, flags, csize, sink):
+    """Writes the uncompressed data of the current entry to sink (None to
+    drop it). returns (size, crc32)."""
+    size = 0
+    crc = 0
+    if method == DEFLATED:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        # the deflate stream marks its own end, which is how entries with
+        # a data descriptor (sizes unknown upfront) are delimited
+        while True:
+            data = decompressor.decompress(reader.read_some())
+            if decompressor.unused_data:
+                reader.unread(decompressor.unused_data)
+                data += decompressor.flush()
+            if data:
+                size += len(data)
+                crc = zlib.crc32(data, crc)
+                if sink:
+                    sink.write(data)
+            if decompressor.unused_data:
+                return size, crc & UINT32_MAX
+    if method == STORED and not flags & FLAG_DATA_DESCRIPTOR:
+        left = csize
+        while left:
+            data = reader.read_exact(min(left, reader.chunk_size))
+            left -= len(data)
+            size += len(data)
+            crc = zlib.crc32(data, crc)
+            if sink:
+                sink.write(data)
+        return size, crc & UINT32_MAX
+    raise ZipStreamError('{}: unsupported compression {} (flags {})'.format(
+        name, method, flags))
+
+
+def _read_descriptor(reader, zip64):
+    data = reader.read_exact(4)
+    if struct.unpack('<I', data)[0] != DATA_DESCRIPTOR:
+        # the descriptor signature is optional
+        reader.unread(data)
+    if zip64:
+        crc, _, usize = struct.unpack('<IQQ', reader.read_exact(20))
+    else:
+        crc, _, usize = struct.unpack('<III', reader.read_exact(12))
+    return crc, usize
+
+
+def extract_stats():
+    return bunch.Bunch(entries=0, files=0, bytes=0, skipped=0,
+                       extracted=[], digests={})
+
+
+def extract_stream(fileobj, target_for, chunk_size=CHUNK_SIZE, stats=None):
+    """Extracts a zip while it is read from fileobj (e.g. an http response),
+    without seeking and without holding more than a chunk in memory.
+
+    target_for(name) returns the destination path of an archive member,
+    or None to skip it. Files are written to <dest>.part and renamed once
+    their crc matches.
+    returns Bunch(entries, files, bytes, skipped, extracted=[names],
+    digests={name: Bunch(md5, sha1, size)}).
+    stats - extract_stats() Bunch to fill, which keeps the members
+    extracted before an error.
+    """
+    reader = _Reader(fileobj, chunk_size)
+    if stats is None:
+        stats = extract_stats()
+    while True:
+        signature = struct.unpack('<I', reader.read_exact(4))[0]
+        if signature in (CENTRAL_HEADER, END_OF_CENTRAL):
+            return stats
+        if signature != LOCAL_HEADER:
+            raise ZipStreamError('bad zip signature {:#x}'.format(signature))
+        (_, flags, method, _, _, crc, csize, usize, name_len,
+         extra_len) = struct.unpack('<HHHHHIIIHH', reader.read_exact(26))
+        raw_name = reader.read_exact(name_len)
+        name = raw_name.decode('utf-8' if flags & FLAG_UTF8 else 'cp437')
+        csize, usize, zip64 = _zip64_sizes(reader.read_exact(extra_len),
+                                           csize, usize)
+        stats.entries += 1
+
+        dest = None if name.endswith('/') else target_for(name)
+        sink = None
+        if dest:
+            parent = os.path.dirname(dest)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            sink = _Sink(dest + '.part')
+        try:
+            size, actual_crc = _copy_entry(reader, name, method, flags,
+                                           csize, sink)
+        finally:
+            if sink:
+                sink.close()
+        if flags & FLAG_DATA_DESCRIPTOR:
+            crc, usize = _read_descriptor(reader, zip64)
+        if not dest:
+            stats.skipped += 1
+            continue
+        if actual_crc != crc or size != usize:
+            os.remove(dest + '.part')
+            raise ZipStreamError('{}: corrupted (crc {:#x} != {:#x}, size {} '
+                                 '!= {})'.format(name, actual_crc, crc,
+                                                 size, usize))
+        os.rename(dest + '.part', dest)
+        stats.files += 1
+        stats.bytes += size
+        stats.extracted.append(name)
+        stats.digests[name] = bunch.Bunch(md5=sink.md5.hexdigest(),
+                                          sha1=sink.sha1.hexdigest(),
+                                          size=size)
@@ -1,4 +1,4 @@
-// params = [:] // are inserted by jin
+// params = [:] and jin_emit(value) are inserted by jin
 assert (
     params.scriptContent
 )
@@ -35,4 +35,5 @@ job('z_tmp/${the_now}_${the_uuid}') {
 """
 
 create_shell_job(the_dsl)
-return the_dsl
\ No newline at end of file
+jin_emit(the_dsl)
+return null
\ No newline at end of file
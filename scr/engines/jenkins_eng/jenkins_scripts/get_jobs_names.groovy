@@ -1,4 +1,4 @@
-// params = [:] // are inserted by jin
+// params = [:] and jin_emit(value) are inserted by jin
 // assert (
 //     params.lastSuccess &&
 //     params.buildName)
@@ -18,7 +18,7 @@ def walkChildren(items, Closure action) {
 }
 
 def printFullName = { item ->
-  println item.fullName
+  jin_emit(item.fullName)
 }
 
 walkChildren(Hudson.instance.items, printFullName)
@@ -1,4 +1,4 @@
-// params = [:] // are inserted by jin
+// params = [:] and jin_emit(value) are inserted by jin
 assert (
     params.pattern &&
     params.action)
@@ -21,12 +21,12 @@ def actions_map = [
   delete: { item ->
     if (item.fullName =~ params.pattern) {
         item.delete()
-        println("deleted: ${item.fullName}")
+        jin_emit(item.fullName)
     }
   },
   list: { item ->
     if (item.fullName =~ params.pattern) {
-        println("${item.fullName}")
+        jin_emit(item.fullName)
     }
   }
 ]
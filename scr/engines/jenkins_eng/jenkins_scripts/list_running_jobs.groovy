@@ -1,12 +1,9 @@
+// jin_emit(value) is inserted by jin
 def now = new Date()  // Get the current time
 // Get a list of all running jobs
 def buildingJobs = Jenkins.instance.getAllItems(Job.class).findAll {
   it.isBuilding() }
 
-def report_lines = ["[START:REPORT:RESULTS_TSV]",
-    "progress.%\tduration.minutes\tjob.name\tnode.name"
-]
-
 void printAllMethods( obj ){
     if( !obj ){
 		println( "Object is null\r\n" );
@@ -55,10 +52,6 @@ buildingJobs.each { job->
         try {
             def progress = ((100 * duration_mins).intValue() / predicted_duration).intValue()
 
-            def progress_str = "${progress.toString().padLeft(7)}"
-            def total_minutes_str = "${predicted_duration.toString().padLeft(7)}"
-            def job_str = "${jobname.toString().padRight(40)}"
-
             // println item.isInProgress()
 
             def node_name =  'N/A'
@@ -69,13 +62,12 @@ buildingJobs.each { job->
                 //printAllMethods(item)
             }
 
-            def line =  "p${progress_str}%\t${total_minutes_str}m\t${job_str}\t${node_name}"
-            report_lines.add(line)
+            jin_emit([progress: progress, duration: predicted_duration,
+                      job: jobname, node: node_name])
         }
         catch (Exception ex){
             println "failed to fetch: ---${duration_mins}--${predicted_duration}--${jobname} ${ex}"
         }
     }
 }
-report_lines.add("[FINISH:REPORT:RESULTS_TSV]")
-return report_lines
+return null
@@ -1,38 +1,102 @@
 import os
+import sys
+import json
+import base64
 import logging
+import threading
+
+import utils
+import plugin_inventory
+from utils import read_job_specs
+from job_index import JobIndex, default_index_path
+
+EMIT_MARK = 'JIN:'
+RESULT_MARK = 'Result: '
+
+# prepended to every script: json decoded params and jin_emit(value)
+# which prints one json document per line
+SCRIPT_PRELUDE = (
+    "def params = new groovy.json.JsonSlurper().parseText("
+    "new String('{params}'.decodeBase64(), 'UTF-8'))\n"
+    "def jin_emit = {{ value -> println('" + EMIT_MARK + "' + "
+    "groovy.json.JsonOutput.toJson(value)) }}\n")
 
 
 def _scripts_dir():
     return os.path.join(os.path.dirname(__file__), 'jenkins_scripts')
 
 
-def _clean_server_script_output(info):
-    r = info.replace('[', '').replace(']', '')
-    xs = [x.strip() for x in r.split(',')]
-    return xs
+class ScriptRegistry(object):
+    """Loads groovy templates once per process"""
+
+    def __init__(self, scripts_dir):
+        self.scripts_dir = scripts_dir
+        self._scripts = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, name):
+        if name.endswith('.groovy'):
+            filename = name
+        else:
+            filename = name + '.groovy'
+
+        if 'jenkins_scripts' in filename:
+            return filename
+        return os.path.join(self.scripts_dir, filename)
+
+    def get(self, name):
+        path = self.resolve(name)
+        with self._lock:
+            if path not in self._scripts:
+                with open(path) as fp:
+                    self._scripts[path] = fp.read()
+            return self._scripts[path]
+
+    def render(self, name, **params):
+        encoded = base64.b64encode(json.dumps(params))
+        return SCRIPT_PRELUDE.format(params=encoded) + self.get(name)
+
+
+scripts = ScriptRegistry(_scripts_dir())
+
+
+def parse_script_output(lines):
+    """Yields values emitted by jin_emit as they arrive, and the script
+    return value if any. Other output lines are only logged.
+    """
+    for line in lines:
+        if line.startswith(EMIT_MARK):
+            yield json.loads(line[len(EMIT_MARK):])
+        elif line.startswith(RESULT_MARK):
+            yield line[len(RESULT_MARK):]
+        elif line.strip():
+            logging.info(line)
+
+
+def iter_server_script(jenkins, name, **params):
+    script = scripts.render(name, **params)
+    logging.debug("running: {}".format(name))
+    return parse_script_output(jenkins.run_script_lines(script))
 
 
 def run_server_script(jenkins, name, **params):
-    if name.endswith('.groovy'):
-        filename = name
-    else:
-        filename = name + '.groovy'
-
-    if 'jenkins_scripts' in filename:
-        dest_path = filename
-    else:
-        dest_path = os.path.join(_scripts_dir(), filename)
-
-    with open(dest_path) as fp:
-        script = fp.read()
-    if params:
-        params_line = "def params = [{}]\n".format(
-            ', '.join("'{0}': '{1}'".format(*r) for r in params.items()))
-        script = params_line + script
-        logging.debug(script)
-    logging.debug("running: {}".format(filename))
-    info = jenkins.run_script(script)
-    return _clean_server_script_output(info)
+    return list(iter_server_script(jenkins, name, **params))
+
+
+def _print_lines(lines):
+    """Writes lines as they come, for long listings"""
+    for line in lines:
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+
+def _format_running_jobs(rows):
+    yield "[START:REPORT:RESULTS_TSV]"
+    yield "progress.%\tduration.minutes\tjob.name\tnode.name"
+    for row in rows:
+        yield "p{:>7}%\t{:>7}m\t{:<40}\t{}".format(
+            row['progress'], row['duration'], row['job'], row['node'])
+    yield "[FINISH:REPORT:RESULTS_TSV]"
 
 
 class JobMenu(object):
@@ -40,21 +104,36 @@ class JobMenu(object):
     def __init__(self, jenkins):
         self._jenkins = jenkins
 
-    def list(self, all=True, api=False):
-        """Lists jobs"""
-        results = ["Failure"]
+    def list(self, all=True, api=False, pattern=None, regex=None,
+             max_depth=None, index=False):
+        """Lists jobs, printing them as they are found.
+        pattern - fnmatch on full name (api/index), regex - re.search
+        index - answer from the local job index (see `jin index sync`),
+                falls back to the server when the index is empty
+        """
+        job_index = None
+        if index:
+            job_index = self._jenkins.job_index or JobIndex(
+                default_index_path(self._jenkins.server))
+            if job_index.is_empty():
+                logging.warn('job index is empty, listing from server')
+                job_index = None
         if all:
-            if api:
-                all_jobs = self._jenkins.list_jobs()
+            if job_index is not None:
+                results = (job.fullname for job in
+                           job_index.search(pattern=pattern, regex=regex))
+            elif api:
+                all_jobs = self._jenkins.list_jobs(
+                    pattern=pattern, regex=regex, max_depth=max_depth)
                 results = (job.fullname for job in all_jobs)
             else:
-                results = run_server_script(
+                results = iter_server_script(
                     self._jenkins, 'jobs_transform.groovy',
-                    action='list', pattern='.*')
+                    action='list', pattern=regex or '.*')
         else:
-            results = run_server_script(
-                self._jenkins, 'list_running_jobs.groovy')
-        return "\n".join(results)
+            results = _format_running_jobs(iter_server_script(
+                self._jenkins, 'list_running_jobs.groovy'))
+        _print_lines(results)
 
     def create(self, script_content):
         results = run_server_script(
@@ -63,21 +142,24 @@ class JobMenu(object):
         return "\n".join(results)
 
     def delete(self, pattern):
-        results = run_server_script(
+        results = iter_server_script(
             self._jenkins, 'jobs_transform.groovy',
             action='delete', pattern=pattern)
-        return "\n".join(results)
+        return "\n".join('deleted: {}'.format(name) for name in results)
 
     def transform(self, action, pattern):
-        results = run_server_script(self._jenkins, 
-            'jobs_transform.groovy', action=action, pattern=pattern)
+        results = iter_server_script(
+            self._jenkins, 'jobs_transform.groovy',
+            action=action, pattern=pattern)
         return "\n".join(results)
 
     def init(self):
         results = run_server_script(self._jenkins, 'init_self_check.groovy')
         return "\n".join(results)
 
-    def run(self, jobname):
+    def run(self, jobname, notify_port=None):
+        if notify_port:
+            self._jenkins.listen_notifications(port=notify_port)
         info = self._jenkins.invoke_job(jobname, #parameters,
                                    cause='cli invoke',
                                    wait_started=True,
@@ -85,7 +167,104 @@ class JobMenu(object):
                                    output_progress=True,
                                    short_info=True)
         return "\n".join(report_json(info))
-        
+
+    def run_many(self, jobs=None, jobs_file=None, concurrency=8):
+        """Runs many jobs concurrently and reports all results.
+        jobs - list of job names
+        jobs_file - file with lines: <job name> [k=v,k=v]
+        """
+        if isinstance(jobs, basestring):
+            jobs = [jobs]
+        specs = list(jobs or [])
+        if jobs_file:
+            specs.extend(read_job_specs(jobs_file))
+        results = self._jenkins.invoke_jobs(specs,
+                                            cause='cli invoke',
+                                            concurrency=concurrency)
+        return "\n".join(report_json(results))
+
+
+class IndexMenu(object):
+    """Local jobs index for fast offline lookups"""
+
+    def __init__(self, jenkins, path=None):
+        self._jenkins = jenkins
+        self._path = path
+
+    def _index(self):
+        return JobIndex(self._path or default_index_path(self._jenkins.server))
+
+    def sync(self, full=False, concurrency=8):
+        """Updates the index, only changed folders unless --full"""
+        stats = self._index().sync(self._jenkins, full=full,
+                                   concurrency=concurrency)
+        return "\n".join(report_json(stats))
+
+    def show(self, jobname):
+        job = self._index().get(jobname)
+        if job is None:
+            return '{} is not in the index'.format(jobname)
+        return "\n".join(report_json(job))
+
+
+class PluginsMenu(object):
+    """Plugin inventories of many servers: snapshots, diff and drift.
+    A source is a snapshot file or a server url, urls are read
+    concurrently with one projected request each.
+    """
+
+    def __init__(self, jenkins, make_server):
+        self._jenkins = jenkins
+        self._make_server = make_server
+
+    def _snapshots(self, sources, concurrency):
+        sources = list(sources or [self._jenkins.server])
+        servers = dict(
+            (source, self._jenkins if source == self._jenkins.server
+             else self._make_server(source))
+            for source in sources if not os.path.isfile(source))
+        captured = dict(
+            (snapshot.server, snapshot) for snapshot in
+            plugin_inventory.capture_all(servers.values(), concurrency))
+        snapshots = []
+        for source in sources:
+            if source in servers:
+                snapshot = captured.get(servers[source].server)
+            else:
+                snapshot = plugin_inventory.PluginSnapshot.load(source)
+            if snapshot is not None:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def list(self):
+        return "\n".join('{}\t{}'.format(name, version) for name, version
+                         in self._jenkins.get_plugins_with_version())
+
+    def snapshot(self, servers=None, out_dir='.', concurrency=16):
+        """Writes <host>.plugins.json of every server (default: this one)"""
+        if isinstance(servers, basestring):
+            servers = [servers]
+        paths = [snapshot.save(os.path.join(out_dir, snapshot.default_name()))
+                 for snapshot in self._snapshots(servers, concurrency)]
+        return "\n".join(paths)
+
+    def diff(self, base, other=None, concurrency=16):
+        """Plugins added, removed and changed from base to other
+        (default: this server)
+        """
+        snapshots = self._snapshots([base, other or self._jenkins.server],
+                                    concurrency)
+        if len(snapshots) != 2:
+            raise utils.JinException('can not read both {} and {}'.format(
+                base, other or self._jenkins.server))
+        return "\n".join(report_json(plugin_inventory.diff(*snapshots)))
+
+    def drift(self, *sources, **kwargs):
+        """Plugins whose version differs between sources, null for missing"""
+        snapshots = self._snapshots(sources, kwargs.get('concurrency', 16))
+        return "\n".join(report_json(plugin_inventory.drift(snapshots)))
+
+
 def report_json(info):
     import json
     return [
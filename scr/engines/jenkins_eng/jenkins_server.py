@@ -2,32 +2,38 @@ import json
 import bunch
 import logging
 import os
-import webbrowser
-import waiting
+import sys
+import socket
+import functools
+import threading
 from fnmatch import fnmatch
+from urllib import quote
 from bunch import bunchify
 
 import jenkins
-from jenkins import HTTPError, urlopen, BUILD_WITH_PARAMS_JOB, urlencode
+from jenkins import HTTPError, BUILD_WITH_PARAMS_JOB, urlencode
 
 import utils
 import fs_utils
-from infra.runner import UrlItem, ParallelRun
-
-
-def _get_queue_info_short(d):
-    causes = next(a for a in d['actions'] if 'causes' in a)['causes']
-    short_causes = [x['shortDescription'] for x in causes]
-    p = {
-        'name': d['task']['name'],
-        'queue': d['url'],
-        'blocked': 'blocked' if d['blocked'] else '',
-        'why': d['why'],
-        'causes': short_causes,
-    }
-    s = "{name} waiting at {queue} {blocked} " \
-        "why:{why} causes:{causes}".format(**p)
-    return s
+import projection
+from artifact_cache import ArtifactCache
+from build_waiter import BuildWaiter, WebhookReceiver
+from console_stream import ConsoleStream
+from meta_cache import MetaCache, is_build_completed
+from http_session import HttpSession
+from job_walker import JobWalker
+from node_inventory import NodeInventory
+from plugin_inventory import read_plugins
+from queue_monitor import QueueMonitor, queue_id_from_url
+from infra.runner import UrlItem, ArchiveItem, make_multi_run
+
+JOB_TREE = '%(folder_url)sjob/%(short_name)s/api/json?tree=%(tree)s'
+BUILD_TREE = ('%(folder_url)sjob/%(short_name)s/%(number)d/'
+              'api/json?tree=%(tree)s')
+NODE_TREE = 'computer/%(name)s/api/json?tree=%(tree)s'
+
+_lazy_lock = threading.Lock()
+_crumb_lock = threading.Lock()
 
 
 def _is_parametrized_job(job_info):
@@ -79,6 +85,170 @@ class BuildSelector(object):
 
 class JenkinsServer(jenkins.Jenkins):
     BuildSelector = BuildSelector
+    # artifacts fetch engine: 'thread', 'process' or 'sequential'
+    fetch_backend = 'thread'
+    fetch_concurrency = 16
+    # fetch as one zip from this many artifacts, when they are at least
+    # this share of the zip content
+    archive_min_count = 100
+    archive_min_share = 0.5
+
+    _waiter = None
+    _nodes = None
+    _queue = None
+    _meta_cache = None
+    _http = None
+    # job_index.JobIndex answering job lookups offline when attached
+    job_index = None
+
+    @property
+    def http(self):
+        """Pooled keep-alive session used for all requests to the server"""
+        if self._http is None:
+            with _lazy_lock:
+                if self._http is None:
+                    timeout = self.timeout
+                    if not isinstance(timeout, (int, float)):
+                        timeout = None
+                    self._http = HttpSession(auth=self.auth, timeout=timeout)
+        return self._http
+
+    def maybe_add_crumb(self, req):
+        # the crumb is fetched once and is bound to the session cookie
+        if self.crumb is None:
+            with _crumb_lock:
+                super(JenkinsServer, self).maybe_add_crumb(req)
+        else:
+            super(JenkinsServer, self).maybe_add_crumb(req)
+
+    def jenkins_open(self, req, add_crumb=True, **kwargs):
+        """Same contract as jenkins.Jenkins.jenkins_open over self.http"""
+        try:
+            rs = self.jenkins_open_ex(req, add_crumb=add_crumb)
+            try:
+                response = rs.read()
+            finally:
+                rs.close()
+        except HTTPError as e:
+            if e.code in [401, 403, 500]:
+                raise jenkins.JenkinsException(
+                    'Error in request. Possibly authentication failed '
+                    '[{}]: {}'.format(e.code, e.msg))
+            elif e.code == 404:
+                raise jenkins.NotFoundException(
+                    'Requested item could not be found')
+            raise
+        except socket.timeout as e:
+            raise jenkins.TimeoutException('Error in request: {}'.format(e))
+        if not response:
+            raise jenkins.EmptyResponseException(
+                'Error communicating with server[{}]: '
+                'empty response'.format(self.server))
+        return response.decode('utf-8')
+
+    @property
+    def meta_cache(self):
+        """job/build/node info cache, see MetaCache"""
+        if self._meta_cache is None:
+            self._meta_cache = MetaCache()
+        return self._meta_cache
+
+    def get_job_info(self, name, depth=0, fetch_all_builds=False,
+                     cached=True):
+        return self.meta_cache.get(
+            'job_info', (name, depth, fetch_all_builds),
+            lambda: super(JenkinsServer, self).get_job_info(
+                name, depth, fetch_all_builds),
+            cached=cached)
+
+    def get_build_info(self, name, number, depth=0, cached=True):
+        return self.meta_cache.get(
+            'build_info', (name, number, depth),
+            lambda: super(JenkinsServer, self).get_build_info(
+                name, number, depth),
+            immutable=is_build_completed,
+            cached=cached)
+
+    def get_node_info(self, name, depth=0, cached=True):
+        return self.meta_cache.get(
+            'node_info', (name, depth),
+            lambda: super(JenkinsServer, self).get_node_info(name, depth),
+            cached=cached)
+
+    def _get_json(self, url):
+        return bunchify(json.loads(self.jenkins_open(jenkins.Request(url))))
+
+    def get_job_fields(self, name, fields, cached=True):
+        """Reads only the fields of projection.Projection of job info"""
+        folder_url, short_name = self._get_job_folder(name)
+        url = self._build_url(JOB_TREE, dict(
+            folder_url=folder_url, short_name=short_name,
+            tree=quote(fields.tree, safe=',')))
+        return self.meta_cache.get(
+            'job_info', (name, fields.name),
+            lambda: self._get_json(url),
+            cached=cached)
+
+    def get_build_fields(self, name, number, fields, cached=True):
+        """Reads only the fields of projection.Projection of build info"""
+        folder_url, short_name = self._get_job_folder(name)
+        url = self._build_url(BUILD_TREE, dict(
+            folder_url=folder_url, short_name=short_name, number=number,
+            tree=quote(fields.tree, safe=',')))
+        return self.meta_cache.get(
+            'build_info', (name, number, fields.name),
+            lambda: self._get_json(url),
+            immutable=is_build_completed,
+            cached=cached)
+
+    def get_node_fields(self, name, fields, cached=True):
+        """Reads only the fields of projection.Projection of node info"""
+        node_name = '(master)' if name == 'master' else name
+        url = self._build_url(NODE_TREE, dict(
+            name=node_name, tree=quote(fields.tree, safe=',')))
+        return self.meta_cache.get(
+            'node_info', (name, fields.name),
+            lambda: self._get_json(url),
+            cached=cached)
+
+    def _read_build(self, name, number, fields=None, cached=True):
+        if fields is None:
+            return self.get_build_info(name, number, cached=cached)
+        return self.get_build_fields(name, number, fields, cached=cached)
+
+    @property
+    def waiter(self):
+        """Shared poller for all queue/build waits of this server"""
+        if self._waiter is None:
+            self._waiter = BuildWaiter()
+        return self._waiter
+
+    @property
+    def queue(self):
+        """Shared queue poller for all started waits, see QueueMonitor"""
+        if self._queue is None:
+            self._queue = QueueMonitor(self)
+        return self._queue
+
+    @property
+    def nodes(self):
+        """Indexed snapshot of all nodes, see NodeInventory"""
+        if self._nodes is None:
+            self._nodes = NodeInventory(self)
+        return self._nodes
+
+    def listen_notifications(self, port=8765, host='0.0.0.0'):
+        """Lets the Notification plugin finish waits instead of polls"""
+        self.queue.has_source = True
+        self.waiter.add_source(WebhookReceiver(host=host, port=port),
+                               notify=self._notify)
+
+    def _notify(self, key):
+        # ('queue', id) keys wake the queue monitor, build keys the waiter
+        if key[0] == 'queue':
+            self.queue.notify(key[1])
+        else:
+            self.waiter.notify(key)
 
     @property
     def settings(self):
@@ -97,33 +267,26 @@ class JenkinsServer(jenkins.Jenkins):
         returns response with headers.
         """
         try:
-            if self.auth:
-                req.add_header('Authorization', self.auth)
             if add_crumb:
                 self.maybe_add_crumb(req)
-            rs = urlopen(req, timeout=self.timeout)
+            rs = self.http.open(req)
             return rs
         except HTTPError as e:
             if e.code in [401, 403, 500]:
                 logging.error('Possibly authentication failed {}: {} '
                               'when running {}'.format(e.code, e.msg, req))
             elif e.code == 404:
-                raise logging.error('Requested item could not be found: '
-                                    '{}'.format(req))
+                logging.debug('Requested item could not be found: '
+                              '{}'.format(req))
             raise
 
-    def invoke_job(self, name, parameters=None, token=None,
-                   cause=None,
-                   wait_started=True, wait_done=True,
-                   output_progress=False, output_done=True,
-                   open_browser=False, short_info=True):
-
-        wait_started = wait_started or open_browser or wait_done
-
+    def trigger_job(self, name, parameters=None, token=None, cause=None):
+        """Puts the job into the queue.
+        returns the queue item api url.
+        """
         logging.info('invoke job:{} parameters:{}'.format(name, parameters))
-        job_info = self.get_job_info(name)
-        has_params = _is_parametrized_job(job_info)
-        params = parameters or {}
+        has_params = self.is_parametrized_job(name)
+        params = dict(parameters or {})
 
         if has_params and cause:
             params['cause'] = cause
@@ -136,24 +299,48 @@ class JenkinsServer(jenkins.Jenkins):
         logging.info('running with params: {}'.format(params))
         job_in_queue_url = response.headers['location'] + 'api/json'
         logging.info('enqueued url: {}'.format(job_in_queue_url))
+        # last*Build fields of the job are about to change
+        self.meta_cache.invalidate('job_info', lambda key: key[0] == name)
+        return job_in_queue_url
+
+    def is_parametrized_job(self, name):
+        if self.job_index is not None:
+            job = self.job_index.get(name)
+            if job is not None:
+                return job.has_params
+        job_info = self.get_job_fields(name, projection.JOB_PARAMS)
+        return _is_parametrized_job(job_info)
+
+    def invoke_job(self, name, parameters=None, token=None,
+                   cause=None,
+                   wait_started=True, wait_done=True,
+                   output_progress=False, output_done=True,
+                   open_browser=False, short_info=True):
 
+        wait_started = wait_started or open_browser or wait_done
+
+        job_in_queue_url = self.trigger_job(name, parameters, token, cause)
         result = json.loads(
             self.jenkins_open(jenkins.Request(job_in_queue_url)))
         wait_started = wait_started or wait_done
         logging.info("triggered: {}".format(name))
 
+        info_fields = projection.BUILD_SHORT if short_info else None
         if wait_started:
             logging.info('\n[wait until:started:{}]\n'.format(name))
             build_number = self._wait_started(job_in_queue_url)
-            build_info = self.get_build_info(name, build_number)
+            build_info = self._read_build(name, build_number, info_fields)
             if open_browser:
+                import webbrowser
                 webbrowser.open_new_tab('{}/console'.format(build_info['url']))
             if wait_done:
                 logging.info("waiting for done: {}".format(name))
                 build_info = self.wait_done(name, build_number,
-                                            output_progress=output_progress)
-            if output_done:
-                logging.info(self.get_build_console_output(name, build_number))
+                                            output_progress=output_progress,
+                                            fields=info_fields)
+            if output_done and not (wait_done and output_progress):
+                # with output_progress the console was already streamed
+                self.write_console(name, build_number, follow=False)
             result = build_info
 
         if result and short_info:
@@ -161,51 +348,108 @@ class JenkinsServer(jenkins.Jenkins):
             result = utils.from_build_info_to_build_short_info(info)
         return result
 
+    def invoke_jobs(self, jobs, cause=None, concurrency=8,
+                    wait_done=True, short_info=True):
+        """Triggers many jobs at once and waits for all of them.
+
+        jobs - list of job names, (name, parameters) pairs or dicts with
+               name/parameters/token keys
+        concurrency - max simultaneous trigger requests. waits are all
+               served by the shared self.waiter poller, so total time is
+               about the slowest job.
+        returns list of results in jobs order, failed ones as
+        {'name': .., 'error': ..}
+        """
+        specs = [utils.to_job_spec(job) for job in jobs]
+        info_fields = projection.BUILD_SHORT if short_info else None
+
+        def trigger(spec):
+            try:
+                return self.trigger_job(spec.name, spec.parameters,
+                                        spec.token, cause)
+            except Exception as e:
+                logging.error('failed to trigger {}: {}'.format(spec.name, e))
+                return e
+
+        def wait(pair):
+            spec, queued = pair
+            if isinstance(queued, Exception):
+                return bunch.Bunch(name=spec.name, error=str(queued))
+            try:
+                build_number = self._wait_started(queued)
+                if wait_done:
+                    info = self.wait_done(spec.name, build_number,
+                                          fields=info_fields)
+                else:
+                    info = self._read_build(spec.name, build_number,
+                                            info_fields, cached=False)
+            except Exception as e:
+                logging.error('failed waiting {}: {}'.format(spec.name, e))
+                return bunch.Bunch(name=spec.name, error=str(e))
+            if short_info:
+                info = utils.from_build_info_to_build_short_info(info)
+            return info
+
+        logging.info('invoking {} jobs'.format(len(specs)))
+        queued = make_multi_run(specs, trigger, backend='thread',
+                                concurrency=concurrency).wait_all()
+        return make_multi_run(zip(specs, queued), wait, backend='thread',
+                              concurrency=len(specs) or 1).wait_all()
+
     def _wait_started(self, job_in_queue_url):
-        def get_queue_info():
-            js = self.jenkins_open(jenkins.Request(job_in_queue_url))
-            return json.loads(js)
-        q_info = get_queue_info()
-
-        def is_build_started():
-            progress = get_queue_info()
-            logging.info('waiting for started: {}'.format(
-                _get_queue_info_short(progress)))
-            if ('executable' in progress and
-                    'number' in progress['executable']):
-                build_number = progress['executable']['number']
-                return build_number
-            else:
-                return None
+        queue_id = queue_id_from_url(job_in_queue_url)
+        if queue_id is None:
+            queue_id = json.loads(self.jenkins_open(
+                jenkins.Request(job_in_queue_url)))['id']
+        logging.info('waiting for started: queue item {}'.format(queue_id))
         try:
-            return waiting.wait(is_build_started)
+            return self.queue.wait_started(queue_id)
         except KeyboardInterrupt:
             c = raw_input('choose: [s]top queue, else: deattach').strip()
             if c == 's':
-                self.cancel_queue(q_info['id'])
+                self.cancel_queue(queue_id)
             raise
 
+    def iter_console(self, name, build_number, start=0, follow=True):
+        """Yields build console text incrementally from offset start.
+        follow - keep polling until the build stops writing the log.
+        """
+        stream = ConsoleStream(self, name, build_number, start=start)
+        return stream.follow() if follow else stream.poll()
+
+    def write_console(self, name, build_number, out=None, follow=True):
+        stream = ConsoleStream(self, name, build_number)
+        return stream.write_to(out or sys.stdout, follow=follow)
+
     def wait_done(self, name, build_number,
-                  output_progress=False):
-        info = {'out': 0}
+                  output_progress=False, progress_out=None, fields=None):
+        """Waits for the build result.
+        returns build info, only projection.Projection fields if given.
+        """
+        stream = ConsoleStream(self, name, build_number)
+        out = progress_out or sys.stdout
 
         def is_build_done():
-            build_info = self.get_build_info(name, build_number)
+            status = self.get_build_fields(name, build_number,
+                                           projection.BUILD_STATUS,
+                                           cached=False)
             if output_progress:
-                output = self.get_build_console_output(name, build_number)
-                rest = output[info['out']:]
-                if rest.strip():
-                    logging.info(rest)
-                    info['out'] += len(rest)
-            if build_info['result']:
-                return build_info
+                stream.write_to(out, follow=bool(status['result']))
+            if status['result']:
+                # the cached document is the one read when it started
+                return self._read_build(name, build_number, fields,
+                                        cached=False)
             return None
 
-        init_build_info = self.get_build_info(name, build_number)
+        init_build_info = self.get_build_fields(name, build_number,
+                                                projection.BUILD_STATUS)
         logging.info('waiting for done: {}console'.format(
             init_build_info['url']))
+        estimated = init_build_info.get('estimatedDuration', -1)
         try:
-            return waiting.wait(is_build_done)
+            return self.waiter.wait(
+                (name, build_number), is_build_done,
+                estimated=estimated / 1000.0 if estimated > 0 else None)
         except KeyboardInterrupt:
             c = raw_input('choose: [s]top build, else deattach').strip()
             if c == 's':
@@ -231,16 +475,17 @@ class JenkinsServer(jenkins.Jenkins):
             return self.build_job_url(name, token=token)
 
     def get_build_info_ex(self, job_name, build_number=None, depth=1,
-                          build_status=BuildSelector.last_successful):
-        job_info = self.get_job_info(job_name, depth=1)
+                          build_status=BuildSelector.last_successful,
+                          fields=None):
         if build_number is None:
-            build_number = BuildSelector.last_build_number(job_info,
-                                                           build_status)
+            build_number = self.get_last_build_number(job_name, build_status)
+        if fields is not None:
+            return self.get_build_fields(job_name, build_number, fields)
         return self.get_build_info(job_name, build_number, depth=depth)
 
     def get_last_build_number(self, job_name,
                               build_status=BuildSelector.last_successful):
-        job_info = self.get_job_info(job_name, depth=1)
+        job_info = self.get_job_fields(job_name, projection.JOB_LAST_BUILDS)
         build_number = BuildSelector.last_build_number(
             job_info, build_status)
         return build_number
@@ -250,17 +495,30 @@ class JenkinsServer(jenkins.Jenkins):
               build_number=None,
               build_status=BuildSelector.last_successful,
               build_info=None,
-              file_pattern=None):
-
+              file_pattern=None,
+              cache_max_size=None,
+              archive=None):
+        """Fetches build artifacts into <cache>/cache-<job>-<build>.
+        Artifacts already in the cache index are linked without network,
+        the rest is fetched per file or as one zip (see save_artifacts).
+        Artifacts jenkins fingerprinted are also looked up in the cache
+        by md5, whatever build stored them, and downloads are checked
+        against their md5.
+        returns IMultiRun with cache_stats (hits/misses/...) and integrity
+        (verified/unverified counts, corrupted/partial paths, filled once
+        done) attributes.
+        """
         if build_info is None:
-            build_info = self.get_build_info_ex(job_name,
-                                                build_number=build_number,
-                                                build_status=build_status)
+            build_info = self.get_build_info_ex(
+                job_name, build_number=build_number,
+                build_status=build_status,
+                fields=projection.BUILD_ARTIFACTS)
         build_number = int(build_info['number'])
 
         cache = cache or '.'
         fs_utils.ensure_dir(cache)
         fs_utils.restore_user_permissions(cache)
+        artifacts_cache = ArtifactCache(cache, max_size=cache_max_size)
 
         name = 'cache-{}-{}'.format(jobname_to_flat(job_name), build_number)
         dest = os.path.join(cache, name)
@@ -269,8 +527,60 @@ class JenkinsServer(jenkins.Jenkins):
         logging.info('fetching artifacts for jenkins-{}-{}'.format(
                      job_name, build_number))
 
+        fingerprints = self.artifact_fingerprints(build_info)
+        used, missing = [], []
+        with artifacts_cache.batch():
+            for art_info in self.match_artifacts(build_info, file_pattern):
+                relative_path = art_info['relativePath']
+                art_dest = self.get_artifact_dest(dest, art_info)
+                sha1 = artifacts_cache.checkout(
+                    job_name, build_number, relative_path, art_dest,
+                    md5=fingerprints.get(relative_path))
+                if sha1:
+                    used.append(sha1)
+                else:
+                    missing.append(art_info)
+        logging.info('artifacts cache: {} hits, {} to download'.format(
+                     len(used), len(missing)))
+
+        integrity = bunch.Bunch(verified=0, unverified=0,
+                                corrupted=[], partial=[])
+
+        def store_fetched(results):
+            fetched = {}
+            for result in results:
+                for file_result in result.get('file_results') or [result]:
+                    fetched[file_result.dst] = file_result
+            with artifacts_cache.batch():
+                for art_info in missing:
+                    art_dest = self.get_artifact_dest(dest, art_info)
+                    result = fetched.get(art_dest)
+                    if result is None or result.get('error'):
+                        integrity.partial.append(art_dest)
+                        continue
+                    if result.verified is False:
+                        integrity.corrupted.append(art_dest)
+                        continue
+                    if result.verified:
+                        integrity.verified += 1
+                    else:
+                        integrity.unverified += 1
+                    used.append(artifacts_cache.store(
+                        job_name, build_number, art_info['relativePath'],
+                        art_dest, sha1=result.sha1, md5=result.md5))
+                artifacts_cache.evict(keep=used)
+            if integrity.corrupted or integrity.partial:
+                logging.error('jenkins-{}-{}: {} corrupted, {} partial '
+                              'artifacts'.format(job_name, build_number,
+                                                 len(integrity.corrupted),
+                                                 len(integrity.partial)))
+
         save_context = self.save_artifacts(dest, build_info,
-                                           file_name_pattern=file_pattern)
+                                           artifacts=missing,
+                                           archive=archive)
+        save_context.on_done = store_fetched
+        save_context.cache_stats = artifacts_cache.stats
+        save_context.integrity = integrity
         return save_context
 
     def get_build_url(self, build_info):
@@ -282,35 +592,121 @@ class JenkinsServer(jenkins.Jenkins):
 
     @staticmethod
     def get_artifact_url(art_info, build_url=None):
-        from urllib import quote
         relative_path = art_info["relativePath"]
         return "{}artifact/{}".format(build_url, quote(relative_path))
 
     def get_artifact(self):
         pass
 
-    def save_artifacts(self, dest_dir, build_info,
-                       file_name_pattern=None):
-
-        artifacts = build_info["artifacts"]
-        build_url = self.get_build_url(build_info)
-        deploy_url = os.path.join(dest_dir, '.')
-
-        def mk_item(art_info):
-            return UrlItem(self.get_artifact_url(art_info, build_url),
-                           os.path.join(deploy_url, art_info["relativePath"]))
-
+    @staticmethod
+    def match_artifacts(build_info, file_name_pattern=None):
         def is_match(art_info):
             if file_name_pattern:
                 return fnmatch(art_info["fileName"], file_name_pattern)
             else:
                 return True
-        items = map(mk_item, filter(is_match, artifacts))
-        return ParallelRun(items, retrieve, ctx=dest_dir)
+        return filter(is_match, build_info["artifacts"])
+
+    @staticmethod
+    def artifact_fingerprints(build_info):
+        """relativePath => md5 of the artifacts jenkins fingerprinted"""
+        by_name = {}
+        for fingerprint in build_info.get('fingerprint') or []:
+            by_name[fingerprint['fileName']] = fingerprint['hash']
+        artifacts = build_info.get('artifacts') or []
+        names = [art_info['fileName'] for art_info in artifacts]
+        fingerprints = {}
+        for art_info in artifacts:
+            md5 = by_name.get(art_info['relativePath'])
+            # fingerprints may be recorded by bare file name, only trust
+            # those when the name is unique in the build
+            if md5 is None and names.count(art_info['fileName']) == 1:
+                md5 = by_name.get(art_info['fileName'])
+            if md5:
+                fingerprints[art_info['relativePath']] = md5
+        return fingerprints
+
+    @staticmethod
+    def get_artifact_dest(dest_dir, art_info):
+        return os.path.join(dest_dir, '.', art_info["relativePath"])
+
+    @staticmethod
+    def get_archive_url(build_url, prefix=''):
+        """zip of all the artifacts, or of the artifacts dir prefix"""
+        if not prefix:
+            return '{}artifact/*zip*/archive.zip'.format(build_url)
+        return '{}artifact/{}/*zip*/{}.zip'.format(
+            build_url, quote(prefix), quote(prefix.split('/')[-1]))
+
+    @staticmethod
+    def _common_dir(artifacts):
+        dirs = [art_info['relativePath'].split('/')[:-1]
+                for art_info in artifacts]
+        return '/'.join(os.path.commonprefix(dirs))
+
+    def _use_archive(self, build_info, artifacts, archive):
+        # the artifacts api has no sizes, so decide on counts: many files
+        # which are most of what the zip would carry
+        if archive is not None or not artifacts:
+            return bool(archive and artifacts)
+        if len(artifacts) < self.archive_min_count:
+            return False
+        prefix = self._common_dir(artifacts)
+        in_zip = [art_info for art_info in build_info['artifacts']
+                  if not prefix or
+                  art_info['relativePath'].startswith(prefix + '/')]
+        return len(artifacts) >= self.archive_min_share * len(in_zip)
+
+    def _archive_item(self, build_url, artifacts, mk_item):
+        prefix = self._common_dir(artifacts)
+        # members are archive/<path> for the build zip and
+        # <prefix last dir>/<path under it> for a dir zip
+        if prefix:
+            parent = prefix.rsplit('/', 1)[0] + '/' if '/' in prefix else ''
+            to_member = lambda path: path[len(parent):]
+        else:
+            to_member = lambda path: 'archive/' + path
+        members = {to_member(art_info['relativePath']): mk_item(art_info)
+                   for art_info in artifacts}
+        return ArchiveItem(self.get_archive_url(build_url, prefix), members)
+
+    def save_artifacts(self, dest_dir, build_info,
+                       file_name_pattern=None, artifacts=None, archive=None):
+        """archive - True/False forces one zip download with streaming
+        extraction / one request per file, None picks the zip when there
+        are many artifacts.
+        """
+        if artifacts is None:
+            artifacts = self.match_artifacts(build_info, file_name_pattern)
+        build_url = self.get_build_url(build_info)
+        fingerprints = self.artifact_fingerprints(build_info)
+
+        def mk_item(art_info):
+            return UrlItem(self.get_artifact_url(art_info, build_url),
+                           self.get_artifact_dest(dest_dir, art_info),
+                           md5=fingerprints.get(art_info['relativePath']))
+
+        if self._use_archive(build_info, artifacts, archive):
+            item = self._archive_item(build_url, artifacts, mk_item)
+            logging.info('fetching {} artifacts as {}'.format(
+                len(artifacts), item.src))
+            method = functools.partial(retrieve_archive,
+                                       session=self.http.session)
+            return make_multi_run([item], method, ctx=dest_dir,
+                                  backend='sequential')
+
+        items = map(mk_item, artifacts)
+        method = retrieve
+        if self.fetch_backend != 'process':
+            # workers share the server connection pool and auth
+            method = functools.partial(retrieve, session=self.http.session)
+        return make_multi_run(items, method, ctx=dest_dir,
+                              backend=self.fetch_backend,
+                              concurrency=self.fetch_concurrency)
 
     def get_artifact_build_file_content(self, build_info, path):
         url = self._get_artifacts_url(build_info, path)
-        return fs_utils.get_web_file_content(url)
+        return fs_utils.get_web_file_content(url, session=self.http.session)
 
     def _get_artifacts_url(self, build_info, path=None):
         build_url = self.get_build_url(build_info)
@@ -320,51 +716,120 @@ class JenkinsServer(jenkins.Jenkins):
             url = '{}/artifact'.format(build_url)
         return url
 
-    def list_jobs(self):
-        return bunchify(self.get_all_jobs())
-
-    def get_nodes_info(self, nodes_name_list):
-        for worker_name in nodes_name_list:
-            try:
-                yield self.get_node_info(worker_name, depth=1)
-            except jenkins.NotFoundException:
-                if worker_name != 'master':
-                    logging.warn('worker {} has no info', worker_name)
-                yield None
-
-    def _filter_workers(self, workers_list, host=None, node=None):
-        if host:
-            workers_list = filter(lambda wn: wn.startswith(host), workers_list)
-        if node:
-            workers_list = filter(lambda wn: wn == node, workers_list)
-        return workers_list
-
-    def get_workers(self, host, node_name, is_offline=None):
-        workers_list = [node['name'] for node in self.get_nodes()
-                        if is_offline is None or node['offline'] is is_offline]
-        return self._filter_workers(workers_list, host, node_name)
+    def run_script_lines(self, script):
+        """Like jenkins.Jenkins.run_script but yields the output lines as
+        they arrive instead of returning the whole text.
+        """
+        if isinstance(script, unicode):
+            script = script.encode('utf-8')
+        req = jenkins.Request(self._build_url(jenkins.SCRIPT_TEXT),
+                              'script=' + quote(script))
+        rs = self.jenkins_open_ex(req)
+        try:
+            for line in rs.iter_lines():
+                yield line.decode('utf-8')
+        finally:
+            rs.close()
+
+    def list_jobs(self, pattern=None, regex=None, max_depth=None,
+                  concurrency=8):
+        """Yields jobs as they are discovered, see JobWalker"""
+        walker = JobWalker(self, concurrency=concurrency,
+                           max_depth=max_depth)
+        return walker.walk(pattern=pattern, regex=regex)
+
+    def get_nodes_info(self, nodes_name_list, fields=None):
+        """Node infos (None for unknown nodes) fetched concurrently"""
+        for info in self.nodes.details(nodes_name_list, fields=fields):
+            yield info
+
+    def get_workers(self, host, node_name, is_offline=None, label=None):
+        """Node names by host prefix, exact name, offline state and label,
+        looked up in the cached nodes snapshot
+        """
+        return self.nodes.find(host=host, name=node_name,
+                               offline=is_offline, label=label)
 
     def get_plugins_with_version(self):
-        plugins_raw = self.get_plugins()
-        plugins_dict = [(x[0][0], x[1]) for x in plugins_raw.items()]
-        plugins_dict_clean = filter(
-            lambda p: p[0] not in self.settings.plugins_ignore_list,
-            plugins_dict)
-        plugins_versions = [(x[0], x[1]["version"])
-                            for x in plugins_dict_clean]
-        return plugins_versions
-
-def retrieve(item):
-    import urllib
+        """(short name, version) of the plugins not in plugins_ignore_list,
+        read with one tree= projected request
+        """
+        return sorted(read_plugins(self).items())
+
+def retrieve(item, session=None):
     import humanfriendly
-    logging.info('start retrieve: {} [{}]'.format(
-        item, humanfriendly.format_size(item.get_remote_size())))
+    from infra.download import stream_download
+    logging.info('start retrieve: {}'.format(item))
     logging.debug('{} => {}'.format(item.src, item.dst))
     dest_dir = os.path.dirname(item.dst)
     fs_utils.ensure_dir(dest_dir)
-    urllib.urlretrieve(item.src, item.dst)
-    local_size = humanfriendly.format_size(os.path.getsize(item.dst))
-    logging.info('done retrieve: {} [{}]'.format(item, local_size))
+    try:
+        result = stream_download(item.src, item.dst, session=session,
+                                 expected_md5=item.md5)
+    except IOError as e:
+        # reported by fetch, a .part left behind is resumed next time
+        logging.error('retrieve {} failed: {}'.format(item, e))
+        return bunch.Bunch(src=item.src, dst=item.dst, error=str(e),
+                           verified=False)
+    logging.info('done retrieve: {} [{} at {}/s]'.format(
+        item, humanfriendly.format_size(result.size),
+        humanfriendly.format_size(result.throughput)))
+    return result
+
+
+def retrieve_archive(item, session=None):
+    """Downloads the zip of an ArchiveItem and extracts its members while
+    it streams. Members the zip didn't carry (or the rest of them, if the zip
+    or the connection fails) are fetched one by one.
+    returns the extraction Bunch with file_results - per file results
+    like the ones of retrieve.
+    """
+    import requests
+    from requests.packages.urllib3.exceptions import HTTPError as \
+        Urllib3Error
+    from infra.download import shared_session, verify_result
+    from infra.zip_stream import extract_stream, extract_stats, ZipStreamError
+    session = session or shared_session()
+    logging.info('start retrieve: {}'.format(item))
+
+    def target_for(name):
+        member = item.members.get(name)
+        return member.dst if member else None
+
+    rs = None
+    result = extract_stats()
+    try:
+        rs = session.get(item.src, stream=True)
+        rs.raise_for_status()
+        rs.raw.decode_content = True
+        extract_stream(rs.raw, target_for, stats=result)
+    # a dropped connection is a urllib3 error when read through rs.raw
+    except (IOError, ZipStreamError, requests.RequestException,
+            Urllib3Error) as e:
+        logging.warn('zip {} failed after {} files: {}'.format(
+            item.src, result.files, e))
+    finally:
+        if rs is not None:
+            rs.close()
+
+    # not result.items, which would shadow dict.items instead of a key
+    result.file_results = []
+    for name in result.extracted:
+        member = item.members[name]
+        digest = result.digests[name]
+        result.file_results.append(verify_result(
+            bunch.Bunch(src=member.src, dst=member.dst, size=digest.size),
+            digest.md5, digest.sha1, member.md5))
+    missing = set(item.members) - set(result.extracted)
+    if missing:
+        logging.warn('{} members not in {}, fetching them one by one'.format(
+            len(missing), item.src))
+        for name in missing:
+            result.file_results.append(
+                retrieve(item.members[name], session=session))
+    logging.info('done retrieve: {} [{} files, {} bytes, {} skipped]'.format(
+        item, result.files, result.bytes, result.skipped))
+    return result
 
 
 def jobname_to_short(fullname):
@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+import bunch
+
+import fs_utils
+import projection
+from job_walker import JobWalker, is_folder, make_matcher
+
+# bumped when the tables or the signatures change, the index is rebuilt
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    fullname TEXT PRIMARY KEY,
+    name TEXT,
+    folder TEXT,
+    class TEXT,
+    signature TEXT,
+    last_build INTEGER,
+    last_completed_build INTEGER,
+    last_successful_build INTEGER,
+    last_failed_build INTEGER,
+    has_params INTEGER,
+    parameters TEXT,
+    last_build_time REAL,
+    synced_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_folder ON jobs (folder);
+CREATE TABLE IF NOT EXISTS folders (
+    fullname TEXT PRIMARY KEY,
+    signature TEXT,
+    synced_at REAL
+);
+"""
+
+
+def default_index_path(server_url):
+    host = urlparse.urlparse(server_url).netloc.replace(':', '_')
+    return os.path.join(os.path.expanduser('~'), '.jin',
+                        'jobs-{}.sqlite'.format(host))
+
+
+def _job_signature(job):
+    """changes with a new build or new parameter definitions"""
+    last_build = job.get('lastBuild') or {}
+    params = hashlib.sha1(json.dumps(_param_definitions(job),
+                                     sort_keys=True)).hexdigest()
+    return '{}:{}:{}'.format(job.get('_class'), last_build.get('number'),
+                             params[:12])
+
+
+def _folder_signature(jobs):
+    digest = hashlib.sha1()
+    for job in sorted(jobs, key=lambda j: j['name']):
+        digest.update(u'{}={};'.format(
+            job['name'], _job_signature(job)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _build_number(info, field):
+    build = info.get(field)
+    return build['number'] if build else None
+
+
+def _param_definitions(info):
+    params = []
+    for field in ['actions', 'property']:
+        for el in info.get(field) or []:
+            for definition in el.get('parameterDefinitions') or []:
+                default = definition.get('defaultParameterValue') or {}
+                params.append(dict(name=definition.get('name'),
+                                   type=definition.get('type'),
+                                   default=default.get('value')))
+    return params
+
+
+class JobIndex(object):
+    """Local sqlite index of the jobs of one server.
+
+    sync() lists every folder with a light tree= request and only reads
+    the details (parameters, last builds) of jobs in folders whose
+    listing changed since the previous sync. Reads (get/search) never
+    touch the network.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        fs_utils.ensure_dir(os.path.dirname(os.path.abspath(path)))
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._migrate()
+
+    def _migrate(self):
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            if version:
+                logging.info('job index {} is of an older version, '
+                             'rebuilding it'.format(self.path))
+            self._db.executescript(
+                'DROP TABLE IF EXISTS jobs; DROP TABLE IF EXISTS folders;')
+            self._db.execute('PRAGMA user_version = {:d}'.format(
+                SCHEMA_VERSION))
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    @staticmethod
+    def _to_job(row):
+        job = bunch.Bunch(zip(row.keys(), row))
+        job.has_params = bool(job.has_params)
+        job.parameters = json.loads(job.parameters or '[]')
+        return job
+
+    def is_empty(self):
+        return self._db.execute(
+            'SELECT COUNT(*) FROM jobs').fetchone()[0] == 0
+
+    def get(self, fullname):
+        """returns the indexed job or None if it isn't in the index"""
+        row = self._db.execute('SELECT * FROM jobs WHERE fullname = ?',
+                               (fullname,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def search(self, pattern=None, regex=None):
+        is_match = make_matcher(pattern, regex)
+        rows = self._db.execute('SELECT * FROM jobs ORDER BY fullname')
+        for row in rows:
+            if is_match(row['fullname']):
+                yield self._to_job(row)
+
+    def sync(self, server, full=False, concurrency=8):
+        """Updates the index from server.
+        full - re-read details of every job, not only changed folders
+        returns Bunch with sync counters.
+        """
+        started = time.time()
+        walker = JobWalker(server, concurrency=concurrency,
+                           job_fields=projection.JOB_INDEX_LISTING.tree)
+        folders = {}
+        for prefix, _, jobs in walker.pages():
+            folders.setdefault(prefix.rstrip('/'), []).extend(jobs)
+
+        stats = bunch.Bunch(folders=len(folders), changed_folders=0,
+                            updated=0, deleted=0)
+        known = dict(self._db.execute(
+            'SELECT fullname, signature FROM folders'))
+        changed_folders, to_read, removed = [], [], []
+        for folder, jobs in folders.items():
+            signature = _folder_signature(jobs)
+            if not full and known.get(folder) == signature:
+                continue
+            changed_folders.append((folder, signature))
+            changed, gone = self._diff_folder(folder, jobs, full)
+            to_read.extend(changed)
+            removed.extend(gone)
+        stats.changed_folders = len(changed_folders)
+
+        pool = ThreadPool(concurrency)
+        try:
+            details = pool.map(
+                lambda job: server.get_job_fields(
+                    job.fullname, projection.JOB_INDEX, cached=False),
+                to_read)
+        finally:
+            pool.close()
+        # folder signatures are stored with their jobs: when reading the
+        # details fails, the next sync sees the folders as changed again
+        with self._db:
+            for folder in set(known) - set(folders):
+                stats.deleted += self._delete_folder(folder)
+            for fullname in removed:
+                self._db.execute('DELETE FROM jobs WHERE fullname = ?',
+                                 (fullname,))
+                stats.deleted += 1
+            for job, info in zip(to_read, details):
+                self._upsert(job, info, started)
+                stats.updated += 1
+            for folder, signature in changed_folders:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO folders VALUES (?, ?, ?)',
+                    (folder, signature, started))
+        stats.seconds = round(time.time() - started, 3)
+        logging.info('job index sync: {}'.format(stats))
+        return stats
+
+    def _diff_folder(self, folder, jobs, full):
+        """returns (jobs to read, fullnames of jobs gone from folder)"""
+        stored = dict(self._db.execute(
+            'SELECT fullname, signature FROM jobs WHERE folder = ?',
+            (folder,)))
+        listed = set()
+        changed = []
+        for job in jobs:
+            if is_folder(job):
+                continue
+            fullname = '{}/{}'.format(folder, job['name']) if folder \
+                else job['name']
+            listed.add(fullname)
+            signature = _job_signature(job)
+            if full or stored.get(fullname) != signature:
+                changed.append(bunch.Bunch(fullname=fullname, folder=folder,
+                                           signature=signature))
+        return changed, sorted(set(stored) - listed)
+
+    def _delete_folder(self, folder):
+        self._db.execute('DELETE FROM folders WHERE fullname = ?', (folder,))
+        return self._db.execute('DELETE FROM jobs WHERE folder = ?',
+                                (folder,)).rowcount
+
+    def _upsert(self, job, info, synced_at):
+        params = _param_definitions(info)
+        last_build = info.get('lastBuild') or {}
+        timestamp = last_build.get('timestamp')
+        self._db.execute(
+            'INSERT OR REPLACE INTO jobs VALUES '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job.fullname, info.get('name'), job.folder, info.get('_class'),
+             job.signature,
+             _build_number(info, 'lastBuild'),
+             _build_number(info, 'lastCompletedBuild'),
+             _build_number(info, 'lastSuccessfulBuild'),
+             _build_number(info, 'lastFailedBuild'),
+             1 if params else 0,
+             json.dumps(params),
+             timestamp / 1000.0 if timestamp else None,
+             synced_at))
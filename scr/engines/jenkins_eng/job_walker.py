@@ -0,0 +1,125 @@
+import re
+import Queue
+import logging
+from fnmatch import fnmatch
+from urllib import quote
+from multiprocessing.pool import ThreadPool
+
+import bunch
+
+FOLDER_CLASSES = (
+    'com.cloudbees.hudson.plugins.folder.Folder',
+    'jenkins.branch.OrganizationFolder',
+    'org.jenkinsci.plugins.workflow.multibranch.WorkflowMultiBranchProject',
+)
+JOB_FIELDS = 'name,url,_class'
+JOBS_PAGE_TREE = 'jobs[{fields}]{{{start},{end}}}'
+
+
+def is_folder(job):
+    return job.get('_class') in FOLDER_CLASSES or 'jobs' in job
+
+
+def make_matcher(pattern=None, regex=None):
+    """fnmatch pattern and/or regex (search) on the job full name"""
+    compiled = re.compile(regex) if regex else None
+
+    def is_match(fullname):
+        if pattern and not fnmatch(fullname, pattern):
+            return False
+        if compiled and not compiled.search(fullname):
+            return False
+        return True
+    return is_match
+
+
+class JobWalker(object):
+    """Walks the jobs tree level by level with concurrent folder reads.
+
+    Every folder page is a small `tree=jobs[name,url,_class]{start,end}`
+    request, pages and sub folders are fetched by a thread pool, and jobs
+    are yielded as soon as their page arrives, filtered on the fly.
+    """
+
+    def __init__(self, server, concurrency=8, page_size=500,
+                 max_depth=None, job_fields=JOB_FIELDS):
+        self.server = server
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.max_depth = max_depth
+        self.job_fields = job_fields
+
+    def _folder_url(self, url):
+        # job urls carry the host jenkins thinks it has, use ours
+        parts = url.split('/job/', 1)
+        if len(parts) == 1:
+            return self.server.server
+        return self.server.server.rstrip('/') + '/job/' + parts[1]
+
+    def _page_url(self, folder_url, start):
+        tree = JOBS_PAGE_TREE.format(fields=self.job_fields, start=start,
+                                     end=start + self.page_size)
+        return '{}api/json?tree={}'.format(folder_url,
+                                           quote(tree, safe=',{}'))
+
+    def walk(self, pattern=None, regex=None):
+        """Yields Bunch(name, fullname, url, _class, depth) of every job
+        (not folder) which matches pattern/regex.
+        """
+        is_match = make_matcher(pattern, regex)
+        for prefix, depth, jobs in self.pages():
+            for job in jobs:
+                fullname = prefix + job['name']
+                if not is_folder(job) and is_match(fullname):
+                    yield bunch.Bunch(name=job['name'],
+                                      fullname=fullname,
+                                      url=job['url'],
+                                      _class=job.get('_class'),
+                                      depth=depth)
+
+    def pages(self):
+        """Yields (folder prefix, depth, jobs) for every page of every
+        folder, in arrival order. prefix is '' for the root, 'a/b/' for
+        folder a/b. jobs entries have the job_fields.
+        """
+        results = Queue.Queue()
+        pool = ThreadPool(self.concurrency)
+        pending = [0]
+
+        def fetch(folder_url, prefix, depth, start):
+            try:
+                page = self.server._get_json(self._page_url(folder_url, start))
+                results.put((None, (folder_url, prefix, depth, start,
+                                    page.get('jobs') or [])))
+            except Exception as e:
+                results.put((e, folder_url))
+
+        def submit(folder_url, prefix, depth, start=0):
+            pending[0] += 1
+            pool.apply_async(fetch, (folder_url, prefix, depth, start))
+
+        submit(self.server.server, '', 0)
+        try:
+            while pending[0]:
+                try:
+                    # timeout keeps Ctrl-C working while waiting
+                    error, payload = results.get(True, 0.5)
+                except Queue.Empty:
+                    continue
+                pending[0] -= 1
+                if error:
+                    logging.error('failed to list {}: {}'.format(
+                        payload, error))
+                    raise error
+                folder_url, prefix, depth, start, jobs = payload
+                if len(jobs) >= self.page_size:
+                    submit(folder_url, prefix, depth,
+                           start + self.page_size)
+                for job in jobs:
+                    if is_folder(job) and (self.max_depth is None or
+                                           depth < self.max_depth):
+                        submit(self._folder_url(job['url']),
+                               prefix + job['name'] + '/', depth + 1)
+                yield prefix, depth, jobs
+        finally:
+            pool.terminate()
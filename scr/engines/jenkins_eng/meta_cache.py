@@ -0,0 +1,81 @@
+import time
+import logging
+import threading
+
+import bunch
+
+FOREVER = float('inf')
+
+
+def is_build_completed(build_info):
+    return bool(build_info.get('result')) and not build_info.get('building')
+
+
+class MetaCache(object):
+    """In-memory cache of jenkins api reads of one server.
+
+    Entries are grouped by endpoint ('job_info', 'build_info', ...) each
+    with its own ttl in seconds. Values which can't change any more
+    (e.g. info of a completed build) are kept forever.
+    stats holds hits/misses/invalidated counters per endpoint.
+    """
+    DEFAULT_TTLS = {
+        'job_info': 10.0,
+        'build_info': 5.0,
+        'node_info': 30.0,
+        'nodes': 30.0,
+    }
+
+    def __init__(self, ttls=None):
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.stats = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _counters(self, endpoint):
+        if endpoint not in self.stats:
+            self.stats[endpoint] = bunch.Bunch(hits=0, misses=0,
+                                               invalidated=0)
+        return self.stats[endpoint]
+
+    def get(self, endpoint, key, loader, immutable=None, cached=True):
+        """Returns the cached value or calls loader() and stores it.
+        immutable - predicate on the value, True means never expires
+        cached - False forces loader(), the result is still stored
+        """
+        now = time.time()
+        with self._lock:
+            counters = self._counters(endpoint)
+            entry = self._entries.get((endpoint, key))
+            if cached and entry and entry[0] > now:
+                counters.hits += 1
+                return entry[1]
+            counters.misses += 1
+
+        value = loader()
+        if immutable and immutable(value):
+            expires = FOREVER
+        else:
+            expires = now + self.ttls.get(endpoint, 0)
+        with self._lock:
+            self._entries[(endpoint, key)] = (expires, value)
+        return value
+
+    def invalidate(self, endpoint=None, match=None):
+        """Drops entries of endpoint (all if None) whose key passes
+        match(key) (all if None).
+        """
+        with self._lock:
+            for entry_key in list(self._entries):
+                entry_endpoint, key = entry_key
+                if endpoint and entry_endpoint != endpoint:
+                    continue
+                if match and not match(key):
+                    continue
+                del self._entries[entry_key]
+                self._counters(entry_endpoint).invalidated += 1
+        logging.debug('invalidated {} cache'.format(endpoint or 'all'))
+
+    def clear(self):
+        self.invalidate()
@@ -0,0 +1,122 @@
+import time
+import logging
+from urllib import quote
+from multiprocessing.pool import ThreadPool
+
+import bunch
+import jenkins
+
+import projection
+
+NODES_TREE = 'computer/api/json?tree=%(tree)s'
+
+
+class NodeSnapshot(object):
+    """All nodes of a server at one point in time, with indexes so
+    lookups by name, host prefix, label and offline state don't scan.
+    """
+
+    def __init__(self, computers, taken_at=None):
+        self.taken_at = taken_at or time.time()
+        self.nodes = []
+        self.by_name = {}
+        self.by_prefix = {}
+        self.by_label = {}
+        self.by_offline = {True: set(), False: set()}
+        self._order = {}
+        for position, computer in enumerate(computers):
+            node = bunch.Bunch(
+                name=computer['displayName'],
+                offline=bool(computer.get('offline')),
+                temporarily_offline=bool(computer.get('temporarilyOffline')),
+                idle=computer.get('idle'),
+                executors=computer.get('numExecutors'),
+                offline_reason=computer.get('offlineCauseReason'),
+                labels=[label['name'] for label in
+                        computer.get('assignedLabels') or []])
+            self.nodes.append(node)
+            self.by_name[node.name] = node
+            self._order[node.name] = position
+            for end in range(1, len(node.name) + 1):
+                self.by_prefix.setdefault(node.name[:end], set()).add(
+                    node.name)
+            for label in node.labels:
+                self.by_label.setdefault(label, set()).add(node.name)
+            self.by_offline[node.offline].add(node.name)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def find(self, host=None, name=None, label=None, offline=None):
+        """Names of the nodes matching all given criteria, in server order.
+        host - name prefix, name - exact name
+        """
+        candidates = []
+        if name:
+            candidates.append({name} if name in self.by_name else set())
+        if host:
+            candidates.append(self.by_prefix.get(host, set()))
+        if label:
+            candidates.append(self.by_label.get(label, set()))
+        if offline is not None:
+            candidates.append(self.by_offline[bool(offline)])
+        if not candidates:
+            return [node.name for node in self.nodes]
+        candidates.sort(key=len)
+        names = set(candidates[0]).intersection(*candidates[1:])
+        return sorted(names, key=self._order.get)
+
+
+class NodeInventory(object):
+    """Node inventory of one server.
+
+    The summary of every node comes from a single
+    computer/api/json?tree=computer[...] request, kept as a NodeSnapshot
+    for the 'nodes' ttl of the server MetaCache. Full per node documents
+    are fetched concurrently, only when asked for.
+    """
+
+    def __init__(self, server, concurrency=16):
+        self.server = server
+        self.concurrency = concurrency
+
+    def _load(self):
+        url = self.server._build_url(NODES_TREE, dict(
+            tree=quote(projection.NODES.tree, safe=',')))
+        started = time.time()
+        snapshot = NodeSnapshot(self.server._get_json(url).computer)
+        logging.debug('node inventory: {} nodes in {:.3f}s'.format(
+            len(snapshot), time.time() - started))
+        return snapshot
+
+    def snapshot(self, cached=True):
+        return self.server.meta_cache.get('nodes', 'all', self._load,
+                                          cached=cached)
+
+    def find(self, host=None, name=None, label=None, offline=None,
+             cached=True):
+        return self.snapshot(cached=cached).find(
+            host=host, name=name, label=label, offline=offline)
+
+    def details(self, names, fields=None):
+        """Node documents (depth=1, or only projection fields) of names,
+        fetched concurrently, in names order. None for unknown nodes.
+        """
+        def read(name):
+            try:
+                if fields is None:
+                    return self.server.get_node_info(name, depth=1)
+                return self.server.get_node_fields(name, fields)
+            except jenkins.NotFoundException:
+                if name != 'master':
+                    logging.warn('worker {} has no info'.format(name))
+                return None
+
+        names = list(names)
+        if len(names) < 2:
+            return map(read, names)
+        pool = ThreadPool(min(self.concurrency, len(names)))
+        try:
+            return pool.map(read, names)
+        finally:
+            pool.close()
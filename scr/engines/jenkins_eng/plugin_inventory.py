@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import logging
+import urlparse
+from urllib import quote
+from multiprocessing.pool import ThreadPool
+
+import bunch
+
+import fs_utils
+import projection
+
+PLUGINS_TREE = 'pluginManager/api/json?tree=%(tree)s'
+SNAPSHOT_SUFFIX = '.plugins.json'
+MISSING = None
+
+
+def read_plugins(server, ignore=None):
+    """{short name: version} of the plugins of server, from one
+    pluginManager request with a tree= projection
+    """
+    ignore = frozenset(ignore if ignore is not None
+                       else server.settings.plugins_ignore_list)
+    url = server._build_url(PLUGINS_TREE, dict(
+        tree=quote(projection.PLUGINS.tree, safe=',')))
+    plugins = server._get_json(url).get('plugins') or []
+    return dict((plugin['shortName'], plugin['version'])
+                for plugin in plugins
+                if plugin['shortName'] not in ignore)
+
+
+class PluginSnapshot(object):
+    """Plugin versions of one server at one point in time.
+
+    Saved as one compact json document, so audits compare files
+    locally instead of asking every server again.
+    """
+
+    def __init__(self, server, plugins, taken_at=None):
+        self.server = server
+        self.plugins = plugins
+        self.taken_at = taken_at or time.time()
+
+    def __len__(self):
+        return len(self.plugins)
+
+    def __repr__(self):
+        return '{}({}:{} plugins)'.format(self.__class__.__name__,
+                                          self.server, len(self))
+
+    @classmethod
+    def capture(cls, server):
+        started = time.time()
+        snapshot = cls(server.server, read_plugins(server))
+        logging.debug('plugins of {}: {} in {:.3f}s'.format(
+            server.server, len(snapshot), time.time() - started))
+        return snapshot
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fp:
+            doc = json.load(fp)
+        return cls(doc['server'], doc['plugins'], doc.get('taken_at'))
+
+    def save(self, path):
+        fs_utils.ensure_dir(os.path.dirname(os.path.abspath(path)))
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(dict(server=self.server, taken_at=self.taken_at,
+                           plugins=self.plugins),
+                      fp, sort_keys=True, separators=(',', ':'))
+        os.rename(tmp_path, path)
+        return path
+
+    def default_name(self):
+        host = urlparse.urlparse(self.server).netloc or self.server
+        return host.replace(':', '_') + SNAPSHOT_SUFFIX
+
+
+def capture_all(servers, concurrency=16):
+    """PluginSnapshot of every server, read concurrently, in servers order.
+    A server which fails is logged and left out.
+    """
+    def capture(server):
+        try:
+            return PluginSnapshot.capture(server)
+        except Exception as e:
+            logging.error('plugins of {} failed: {}'.format(server.server, e))
+            return None
+
+    servers = list(servers)
+    if len(servers) < 2:
+        snapshots = map(capture, servers)
+    else:
+        pool = ThreadPool(min(concurrency, len(servers)))
+        try:
+            snapshots = pool.map(capture, servers)
+        finally:
+            pool.close()
+    return [snapshot for snapshot in snapshots if snapshot is not None]
+
+
+def diff(base, other):
+    """Set difference of two snapshots: plugins only in other (added),
+    only in base (removed) and in both with other versions (changed)
+    """
+    base_names = set(base.plugins)
+    other_names = set(other.plugins)
+    return bunch.Bunch(
+        base=base.server,
+        other=other.server,
+        added=dict((name, other.plugins[name])
+                   for name in sorted(other_names - base_names)),
+        removed=dict((name, base.plugins[name])
+                     for name in sorted(base_names - other_names)),
+        changed=dict((name, [base.plugins[name], other.plugins[name]])
+                     for name in sorted(base_names & other_names)
+                     if base.plugins[name] != other.plugins[name]))
+
+
+def drift(snapshots):
+    """Plugins whose version isn't the same on every snapshot:
+    {name: {server: version or None when missing}}
+    """
+    names = set()
+    for snapshot in snapshots:
+        names.update(snapshot.plugins)
+    drifted = {}
+    for name in names:
+        versions = dict((snapshot.server, snapshot.plugins.get(name, MISSING))
+                        for snapshot in snapshots)
+        if len(set(versions.values())) > 1:
+            drifted[name] = versions
+    return drifted
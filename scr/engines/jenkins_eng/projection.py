@@ -0,0 +1,112 @@
+def _render(fields):
+    parts = []
+    for field in fields:
+        if isinstance(field, tuple):
+            name, subfields = field
+            parts.append('{}[{}]'.format(name, _render(subfields)))
+        else:
+            parts.append(field)
+    return ','.join(parts)
+
+
+class Projection(object):
+    """Fields to read through the jenkins api `tree=` filter.
+
+    Every internal reader declares the fields it actually uses instead
+    of pulling depth=1 documents, which are megabytes on jobs with long
+    histories. A field is either a name or a (name, subfields) pair.
+    """
+
+    def __init__(self, name, *fields):
+        self.name = name
+        self.fields = fields
+        self.tree = _render(fields)
+
+    def __repr__(self):
+        return '{}({}:{})'.format(self.__class__.__name__,
+                                  self.name, self.tree)
+
+
+_LAST_BUILDS = ('lastBuild', 'lastCompletedBuild', 'lastFailedBuild',
+                'lastStableBuild', 'lastSuccessfulBuild',
+                'lastUnstableBuild', 'lastUnsuccessfulBuild')
+
+# BuildSelector.last_build_number
+JOB_LAST_BUILDS = Projection(
+    'job_last_builds',
+    *[(name, ('number',)) for name in _LAST_BUILDS])
+
+# _is_parametrized_job
+JOB_PARAMS = Projection(
+    'job_params',
+    ('actions', (('parameterDefinitions', ('name',)),)),
+    ('property', (('parameterDefinitions', ('name',)),)))
+
+# job_index.JobIndex.sync
+_PARAM_DEFINITIONS = ('parameterDefinitions', (
+    'name', 'type', ('defaultParameterValue', ('value',))))
+JOB_INDEX = Projection(
+    'job_index',
+    'name', '_class',
+    ('actions', (_PARAM_DEFINITIONS,)),
+    ('property', (_PARAM_DEFINITIONS,)),
+    *[(name, ('number', 'timestamp')) for name in _LAST_BUILDS])
+
+# job_index.JobIndex.sync folder listings, the signature of a job
+JOB_INDEX_LISTING = Projection(
+    'job_index_listing',
+    'name', 'url', '_class',
+    ('actions', (_PARAM_DEFINITIONS,)),
+    ('property', (_PARAM_DEFINITIONS,)),
+    ('lastBuild', ('number', 'timestamp')))
+
+# wait loops
+BUILD_STATUS = Projection(
+    'build_status',
+    'number', 'url', 'result', 'building', 'estimatedDuration', 'duration')
+
+# utils.from_build_info_to_build_short_info
+BUILD_SHORT = Projection(
+    'build_short',
+    'queueId', 'number', 'timestamp', 'displayName', 'fullDisplayName',
+    'duration', 'result', 'building', 'url',
+    ('artifacts', ('fileName', 'relativePath', 'displayPath')),
+    ('actions', ('_class', ('parameters', ('name', 'value')))))
+
+# fetch / save_artifacts
+BUILD_ARTIFACTS = Projection(
+    'build_artifacts',
+    'number', 'url', 'result', 'building',
+    ('artifacts', ('fileName', 'relativePath')),
+    ('fingerprint', ('fileName', 'hash')))
+
+NODE_SUMMARY = Projection(
+    'node_summary',
+    'displayName', 'offline', 'temporarilyOffline', 'idle',
+    'numExecutors', 'offlineCauseReason',
+    ('assignedLabels', ('name',)))
+
+# node_inventory.NodeInventory, all nodes in one request
+NODES = Projection(
+    'nodes',
+    ('computer', NODE_SUMMARY.fields))
+
+# queue_monitor.QueueMonitor, the whole queue once per tick
+QUEUE_ITEMS = Projection(
+    'queue_items',
+    ('items', (
+        'id', 'url', 'blocked', 'buildable', 'stuck', 'why', 'inQueueSince',
+        ('task', ('name', 'url')),
+        ('actions', (('causes', ('shortDescription',)),)))))
+
+# queue_monitor.QueueMonitor, an item which left the queue
+QUEUE_LEFT_ITEM = Projection(
+    'queue_left_item',
+    'id', 'cancelled', 'inQueueSince',
+    ('executable', ('number', 'url')),
+    ('task', ('name',)))
+
+# plugin_inventory.read_plugins, versions only instead of full depth
+PLUGINS = Projection(
+    'plugins',
+    ('plugins', ('shortName', 'version')))
@@ -0,0 +1,280 @@
+import re
+import time
+import logging
+import threading
+from urllib import quote
+
+import bunch
+import jenkins
+
+import utils
+import projection
+
+QUEUE_TREE = 'queue/api/json?tree=%(tree)s'
+QUEUE_ITEM_TREE = 'queue/item/%(id)d/api/json?tree=%(tree)s'
+QUEUE_ID_RE = re.compile(r'/queue/item/(\d+)/')
+
+# event kinds
+QUEUED = 'queued'
+BLOCKED = 'blocked'
+UNBLOCKED = 'unblocked'
+STARTED = 'started'
+CANCELLED = 'cancelled'
+LOST = 'lost'
+
+
+def queue_id_from_url(url):
+    """.../queue/item/<id>/api/json => id"""
+    match = QUEUE_ID_RE.search(url)
+    return int(match.group(1)) if match else None
+
+
+def _to_item(raw, previous=None):
+    if previous is not None:
+        # causes don't change, only the state fields are re-read
+        item = bunch.Bunch(previous)
+    else:
+        causes = []
+        for action in raw.get('actions') or []:
+            causes.extend(cause.get('shortDescription')
+                          for cause in action.get('causes') or [])
+        item = bunch.Bunch(id=raw['id'], name=raw['task']['name'],
+                           url=raw.get('url'), causes=causes,
+                           in_queue_since=raw.get('inQueueSince', 0) / 1000.0)
+    item.update(blocked=bool(raw.get('blocked')),
+                buildable=bool(raw.get('buildable')),
+                stuck=bool(raw.get('stuck')),
+                why=raw.get('why'))
+    return item
+
+
+def format_item(item):
+    return "{name} waiting at {url} {blocked} why:{why} causes:{causes}" \
+        .format(name=item.name, url=item.url,
+                blocked='blocked' if item.blocked else '',
+                why=item.why, causes=item.causes)
+
+
+class QueueMonitor(object):
+    """One poller of the whole build queue of a server.
+
+    Every tick reads queue/api/json once with a tree= projection and
+    diffs it with the previous snapshot. Items which left the queue are
+    resolved once through their queue/item/<id> document. Events
+    (queued, blocked, unblocked, started, cancelled, lost) go to every
+    subscribed listener and wake the waits registered for the item. The
+    poller only runs while someone waits or listens.
+    notify(queue_id) (a push notification, see WebhookReceiver) runs a
+    tick right away; once a notification source is attached polling
+    slows down to fallback_interval. A wait fails with the error when
+    its item can't be resolved, or when max_failures ticks in a row fail.
+    """
+    max_failures = 3
+
+    def __init__(self, server, interval=1.0, fallback_interval=10.0):
+        self.server = server
+        self.interval = interval
+        self.fallback_interval = fallback_interval
+        self.has_source = False
+        self.snapshot = {}
+        self.listeners = []
+        self.counters = bunch.Bunch(ticks=0, started=0, cancelled=0,
+                                    time_to_start=0.0)
+        self._waits = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._notified = False
+
+    def subscribe(self, listener):
+        """listener(event) is called from the poller thread"""
+        with self._cond:
+            self.listeners.append(listener)
+            self._ensure_thread()
+
+    def unsubscribe(self, listener):
+        with self._cond:
+            self.listeners.remove(listener)
+
+    def notify(self, queue_id):
+        """Something happened to queue_id: tick now instead of waiting
+        for the next poll
+        """
+        with self._cond:
+            logging.debug('queue item {} notified'.format(queue_id))
+            self._notified = True
+            self._cond.notify()
+
+    def wait_started(self, queue_id, timeout=None):
+        """Blocks until the queue item becomes a build, returns its number.
+        raises JinException when it is cancelled or can't be found, and
+        the resolution error when reading the item fails.
+        """
+        started = time.time()
+        with self._cond:
+            event = self._waits.setdefault(queue_id, bunch.Bunch(
+                done=threading.Event(), kind=None, build_number=None,
+                error=None))
+            self._ensure_thread()
+            self._cond.notify()
+        try:
+            # short waits keep the main thread responsive to Ctrl-C
+            while not event.done.wait(0.5):
+                if timeout and time.time() - started > timeout:
+                    raise utils.JinException(
+                        'timeout waiting for queue item {}'.format(queue_id))
+        finally:
+            with self._cond:
+                self._waits.pop(queue_id, None)
+        if event.error is not None:
+            raise event.error
+        if event.kind != STARTED:
+            raise utils.JinException('queue item {} {}'.format(
+                queue_id, event.kind))
+        return event.build_number
+
+    def metrics(self):
+        """Queue depth and time in queue, from the last snapshot"""
+        now = time.time()
+        items = self.snapshot.values()
+        waits = [now - item.in_queue_since for item in items]
+        started = self.counters.started
+        return bunch.Bunch(
+            depth=len(items),
+            blocked=sum(1 for item in items if item.blocked),
+            buildable=sum(1 for item in items if item.buildable),
+            stuck=sum(1 for item in items if item.stuck),
+            max_wait=max(waits) if waits else 0.0,
+            mean_wait=sum(waits) / len(waits) if waits else 0.0,
+            started=started,
+            cancelled=self.counters.cancelled,
+            mean_time_to_start=(self.counters.time_to_start / started
+                                if started else 0.0),
+            ticks=self.counters.ticks)
+
+    def _ensure_thread(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run,
+                                        name='jin-queue-monitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._cond:
+                if not self._waits and not self.listeners:
+                    self._thread = None
+                    return
+                self._notified = False
+            try:
+                self.tick()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logging.warn('queue monitor tick failed: {}'.format(e))
+                if failures >= self.max_failures:
+                    self._fail_waits(e)
+                    failures = 0
+            with self._cond:
+                if not self._notified:
+                    self._cond.wait(self.fallback_interval if self.has_source
+                                    else self.interval)
+
+    def _fail_waits(self, error):
+        with self._cond:
+            waits = self._waits.values()
+        for wait in waits:
+            wait.error = error
+            wait.done.set()
+
+    def tick(self):
+        """Reads the queue once and dispatches the changes"""
+        url = self.server._build_url(QUEUE_TREE, dict(
+            tree=quote(projection.QUEUE_ITEMS.tree, safe=',')))
+        raw_items = self.server._get_json(url).get('items') or []
+        self.counters.ticks += 1
+        events = []
+        current = {}
+        for raw in raw_items:
+            previous = self.snapshot.get(raw['id'])
+            item = _to_item(raw, previous)
+            current[item.id] = item
+            if previous is None:
+                events.append(bunch.Bunch(kind=QUEUED, item=item))
+            if item.blocked and not (previous and previous.blocked):
+                events.append(bunch.Bunch(kind=BLOCKED, item=item))
+            elif previous and previous.blocked and not item.blocked:
+                events.append(bunch.Bunch(kind=UNBLOCKED, item=item))
+
+        with self._cond:
+            waited = set(self._waits)
+        # gone since the last tick, or waited for but never seen (left the
+        # queue before the first tick)
+        left = (set(self.snapshot) | waited) - set(current)
+        for queue_id in left:
+            item = self.snapshot.get(queue_id)
+            try:
+                event = self._resolve(queue_id, item)
+            except Exception as e:
+                # given up instead of retried every tick, the wait gets e
+                logging.warn('queue item {} resolve failed: {}'.format(
+                    queue_id, e))
+                event = bunch.Bunch(kind=LOST, error=e,
+                                    item=item or bunch.Bunch(id=queue_id))
+            if event is not None:
+                events.append(event)
+            elif queue_id in self.snapshot:
+                # still pending, listed again on the next tick
+                current[queue_id] = self.snapshot[queue_id]
+        self.snapshot = current
+        for event in events:
+            self._dispatch(event)
+        logging.debug('queue: {}'.format(self.metrics()))
+
+    def _resolve(self, queue_id, item):
+        url = self.server._build_url(QUEUE_ITEM_TREE, dict(
+            id=queue_id,
+            tree=quote(projection.QUEUE_LEFT_ITEM.tree, safe=',')))
+        try:
+            raw = self.server._get_json(url)
+        except jenkins.NotFoundException:
+            return bunch.Bunch(kind=LOST, item=item or bunch.Bunch(
+                id=queue_id))
+        if item is None:
+            item = bunch.Bunch(
+                id=queue_id, name=(raw.get('task') or {}).get('name'),
+                url=None, causes=[], blocked=False, buildable=False,
+                stuck=False, why=None,
+                in_queue_since=raw.get('inQueueSince', 0) / 1000.0)
+        executable = raw.get('executable') or {}
+        if executable.get('number') is not None:
+            return bunch.Bunch(kind=STARTED, item=item,
+                               build_number=executable['number'],
+                               waited=time.time() - item.in_queue_since)
+        if raw.get('cancelled'):
+            return bunch.Bunch(kind=CANCELLED, item=item)
+        return None
+
+    def _dispatch(self, event):
+        if event.kind == STARTED:
+            self.counters.started += 1
+            self.counters.time_to_start += event.waited
+        elif event.kind == CANCELLED:
+            self.counters.cancelled += 1
+        if event.kind == BLOCKED:
+            logging.info('queue blocked: {}'.format(format_item(event.item)))
+        with self._cond:
+            wait = self._waits.get(event.item.id)
+            listeners = list(self.listeners)
+        if wait is not None and event.kind in (STARTED, CANCELLED, LOST):
+            wait.kind = event.kind
+            wait.build_number = event.get('build_number')
+            wait.error = event.get('error')
+            wait.done.set()
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logging.warn('queue listener {} failed: {}'.format(
+                    listener, e))
@@ -16,6 +16,39 @@ def from_ini_params(s):
     return dict(line.split('=') for line in lines)
 
 
+def to_job_spec(job):
+    """name | (name, params) | {'name':.., 'parameters':.., 'token':..}
+    to Bunch(name, parameters, token). params may be dict or ini string.
+    """
+    if isinstance(job, basestring):
+        name, params, token = job, None, None
+    elif isinstance(job, dict):
+        name = job['name']
+        params = job.get('parameters')
+        token = job.get('token')
+    else:
+        name, params = job[0], job[1] if len(job) > 1 else None
+        token = None
+    if params and not isinstance(params, dict):
+        params = from_ini_params(params)
+    return bunch.Bunch(name=name, parameters=params or {}, token=token)
+
+
+def read_job_specs(path):
+    """Reads job specs file, line format: <job name> [k=v,k=v]
+    empty lines and # comments are skipped.
+    """
+    specs = []
+    with open(path) as fd:
+        for line in fd:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split(None, 1)
+            specs.append(to_job_spec(parts))
+    return specs
+
+
 def from_build_info_to_build_short_info(result):
 
     build_info = bunch.bunchify(result)
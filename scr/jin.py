@@ -1,21 +1,67 @@
-import fire
-from bunch import Bunch
+import os
 import logging
-logging.basicConfig(level=logging.DEBUG)
 
-from engines.jenkins_eng.jenkins_server import JenkinsServer
-from engines.jenkins_eng.jenkins_scripts_api import JobMenu
+LOG_LEVEL_ENV = 'JIN_LOG_LEVEL'
+
+# jenkins_eng (python-jenkins, bunch, multiprocessing, ...) is imported by
+# the menu methods, so `jin --help` and menus that don't need a server
+# don't pay for it. Nothing talks to jenkins before a subcommand does.
 
 class RootMenu(object):
 
-  def __init__(self, 
-               server='jenkins', port=8080, 
-               username=None, password=None):
-    server_url = 'http://{}:{}'.format(server,port)
-    self.__jenkins_server = JenkinsServer(server_url,
-                                    username=username,
-                                    password=password)
-    self.job = JobMenu(jenkins=self.__jenkins_server)    
-  
+  def __init__(self,
+               server='jenkins', port=8080,
+               username=None, password=None,
+               use_index=False, index_path=None,
+               log_level=None):
+    if log_level:
+      logging.getLogger().setLevel(log_level.upper())
+    self._server_url = 'http://{}:{}'.format(server,port)
+    self._username = username
+    self._password = password
+    self._use_index = use_index
+    self._index_path = index_path
+    self.__jenkins_server = None
+
+  def _make_server(self, server_url):
+    from engines.jenkins_eng.jenkins_server import JenkinsServer
+    return JenkinsServer(server_url,
+                         username=self._username,
+                         password=self._password)
+
+  def _jenkins_server(self):
+    if self.__jenkins_server is None:
+      self.__jenkins_server = self._make_server(self._server_url)
+      if self._use_index:
+        from engines.jenkins_eng.job_index import (
+          JobIndex, default_index_path)
+        self.__jenkins_server.job_index = JobIndex(
+            self._index_path or default_index_path(self._server_url))
+    return self.__jenkins_server
+
+  def job(self):
+    """jobs: list, run, run_many, delete, transform, init"""
+    from engines.jenkins_eng.jenkins_scripts_api import JobMenu
+    return JobMenu(jenkins=self._jenkins_server())
+
+  def index(self):
+    """local jobs index: sync, show"""
+    from engines.jenkins_eng.jenkins_scripts_api import IndexMenu
+    return IndexMenu(jenkins=self._jenkins_server(), path=self._index_path)
+
+  def plugins(self):
+    """plugin inventories: list, snapshot, diff, drift"""
+    from engines.jenkins_eng.jenkins_scripts_api import PluginsMenu
+    return PluginsMenu(jenkins=self._jenkins_server(),
+                       make_server=self._make_server)
+
+
+def main():
+  level = os.environ.get(LOG_LEVEL_ENV, 'INFO').upper()
+  logging.basicConfig(level=getattr(logging, level, logging.INFO))
+  import fire
+  fire.Fire(RootMenu, name='jin')
+
+
 if __name__ == '__main__':
-  fire.Fire(RootMenu, name='jin')
\ No newline at end of file
+  main()